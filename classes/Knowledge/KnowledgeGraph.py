@@ -7,32 +7,41 @@ import hashlib
 import yaml
 from collections import OrderedDict
 import datetime as dt
+import array
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Import text functions
 try:
     # Try relative imports for deployment
     from ....modules.text import *
+    from ....modules.templates import *
     from ....modules.markdown import *
     from ....ai_handler import AIHandler
+    from ..ai import telemetry
     from ....modules.elastic import *
     from ....modules.neo4j import *
 except ImportError:
     try:
         # Fallback to absolute imports with project name for structured imports
         from ParchmentProphet.modules.text import *
+        from ParchmentProphet.modules.templates import *
         from ParchmentProphet.modules.markdown import *
         from ParchmentProphet.classes.ai_handler import AIHandler
+        from ParchmentProphet.classes.ai import telemetry
         from ParchmentProphet.modules.elastic import *
         from ParchmentProphet.modules.neo4j import *
     except ImportError:
         # Fallback to simple absolute imports for local testing
         from modules.text import *
+        from modules.templates import *
         from modules.markdown import *
         from classes.ai_handler import AIHandler
+        from classes.ai import telemetry
         from modules.neo4j import *
         from modules.elastic import *
 
-from .prompts.graph import graph_system_prompt, graph_user_prompt
+from .prompts.graph import graph_system_prompt, graph_user_prompt, graph_instruction, graph_previous_chunk_instruction
 from .prompts.document_summary import document_summary_system_prompt
 from .prompts.merge_descriptions import merge_descriptions_entity_system_prompt, merge_descriptions_entity_user_prompt, merge_descriptions_relationship_system_prompt, merge_descriptions_relationship_user_prompt
 from .prompts.deduplicate import deduplicate_system_entity_prompt, deduplicate_user_entity_prompt
@@ -41,9 +50,42 @@ from .prompts.claim import claim_system_prompt, claim_user_prompt
 # Index in Elastic where documents are stored
 DOCUMENTS_INDEX = "prod-documents"
 
+# Index in Elastic where claims are stored
+CLAIMS_INDEX = "prod-claims"
+
+# Instructions for the graph user prompt, dedented once at import
+_GRAPH_INSTRUCTION = textwrap.dedent(graph_instruction)
+_GRAPH_PREVIOUS_CHUNK_INSTRUCTION = textwrap.dedent(graph_previous_chunk_instruction)
+
+def _md5_file(file_path):
+    md5_hash = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(4096), b""):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
+def _chunk_with_tails(markdown_path, token_limit, tail_limit, chunking="lines"):
+    # Keep each chunk's trailing tokens (plus one to detect line starts) so the previous
+    # chunk context can be decoded later without re-encoding the chunk
+    tail_limit = int(tail_limit) + 1
+
+    if chunking == "sections":
+        chunks = chunk_markdown_file(markdown_path, token_limit, return_tokens=True)
+    else:
+        chunks = chunk_file(markdown_path, token_limit, return_tokens=True)
+
+    for chunk in chunks:
+        chunk["tail_tokens"] = array.array('l', chunk.pop("tokens")[-tail_limit:])
+        yield chunk
+
+def _hash_and_chunk(markdown_path, token_limit, tail_limit, chunking="lines"):
+    # Runs in a worker process, so it must stay a module-level function
+    chunks = list(_chunk_with_tails(markdown_path, token_limit, tail_limit, chunking))
+    return _md5_file(markdown_path), chunks
+
 class KnowledgeGraph:
 
-    def __init__(self, project_id, documents, report_scope, questionnaire, persona):
+    def __init__(self, project_id, documents, report_scope, questionnaire, persona, preprocess_workers=1, chunking="lines", concurrent_claims=False, summary_mode="sequential"):
         self.project_id = project_id
         self.documents = documents
         self.report_scope = report_scope
@@ -53,6 +95,30 @@ class KnowledgeGraph:
         self.token_limit = 600
         self.previous_chunk_limit = self.token_limit * 0.5
 
+        # Workers used to hash, chunk and summarise documents. 1 preprocesses sequentially
+        self.preprocess_workers = preprocess_workers
+
+        # Request claim scrolls concurrently when the AI handler supports it
+        self.concurrent_claims = concurrent_claims
+
+        # Trailing tokens of each chunk by chunk_id, used to build the previous chunk context
+        self._chunk_tails = {}
+
+        # Previous revisions of changed documents by document_id, and the chunk_ids they retired
+        self._revisions = {}
+        self._retired_chunk_ids = set()
+
+        # "lines" packs lines up to the token limit, "sections" packs whole markdown sections
+        if chunking not in ("lines", "sections"):
+            raise ValueError(f"Unsupported chunking mode: {chunking}")
+        self.chunking = chunking
+
+        # "sequential" folds chunks into one running summary, "map_reduce" summarises them
+        # concurrently and merges the results in a tree
+        if summary_mode not in ("sequential", "map_reduce"):
+            raise ValueError(f"Unsupported summary mode: {summary_mode}")
+        self.summary_mode = summary_mode
+
         self.ai_handler = AIHandler.load()
 
         # Initialize global_graph from existing project data
@@ -93,32 +159,137 @@ class KnowledgeGraph:
             # return default
             return {}
 
-    def process(self):
-        # Preprocess documents
-        self._preprocess_documents()
-
-        # Process each document
-        for document in self.documents:
-            if not self._document_exists(document['document_id']):
-                self._process_single_document(document)
-
-        # Deduplicate entities
-        self._deduplicate_entities()
-
-        # Merge entity and relationship descriptions
-        self._merge_descriptions()
-
-        # Return chunked documents
-        return True
+    def process(self, incremental=False, mode="sync"):
+        """
+        Extracts entities and relationships from every document not yet in the project.
+
+        Args:
+            incremental (bool, optional): When a document is a new revision of a stored document
+                (same source_id), only extract its new chunks and drop the removed ones from the
+                graph. Claims are revised by process_claims(incremental=True). Defaults to False,
+                which processes changed documents from scratch.
+            mode (str, optional): "sync" requests each chunk in turn. "batch" submits every
+                chunk of every document as one offline batch job; each prompt then lists the
+                entities known before the job rather than those found in earlier chunks.
+                Defaults to "sync".
+
+        Returns:
+            bool: True once processing completes.
+        """
+        self._check_mode(mode)
+
+        with telemetry.project(self.project_id):
+
+            # Preprocess documents
+            self._preprocess_documents()
+
+            # (chunk, system_prompt, user_prompt) for every graph scroll of the batch job
+            scrolls = []
+
+            # Process each document
+            for document in self.documents:
+                if not self._document_exists(document['document_id']):
+                    revision = self._get_previous_revision(document) if incremental else None
+
+                    if revision is not None:
+                        self._apply_graph_revision(document, revision)
+                    only_chunk_ids = revision['new_chunk_ids'] if revision is not None else None
+
+                    if mode == "batch":
+                        existing_entities = self.get_entity_list()
+                        scrolls.extend(
+                            (chunk, *self._get_graph_prompts(chunk, existing_entities, self.persona, document['document_summary'], previous_chunk))
+                            for chunk, previous_chunk in self._graph_scrolls(document, only_chunk_ids)
+                        )
+                    else:
+                        self._process_single_document(document, only_chunk_ids=only_chunk_ids)
+
+            if scrolls:
+                with telemetry.stage("knowledge_scroll"):
+                    responses = self.ai_handler.run_batch([
+                        {"system_prompt": system_prompt, "prompt": user_prompt, "json_output": True, "model": self.graph_model}
+                        for _, system_prompt, user_prompt in scrolls
+                    ])
+
+                for (chunk, system_prompt, user_prompt), response in zip(scrolls, responses):
+                    local_graph = self._store_graph(chunk, system_prompt, user_prompt, response)
+                    self.update_global_graph(local_graph.copy(), chunk['chunk_id'])
+
+            # Deduplicate entities
+            self._deduplicate_entities()
+
+            # Merge entity and relationship descriptions
+            self._merge_descriptions()
+
+            # Return chunked documents
+            return True
     
-    def process_claims(self):
-
-        # Process each document
-        for document in self.documents:
-            if not self._document_exists(document['document_id']):
-                self._process_single_document_claims(document)
-
-        return self.global_claims
+    def process_claims(self, incremental=False, mode="sync"):
+        """
+        Extracts claims from every document not yet in the project.
+
+        Args:
+            incremental (bool, optional): Only extract claims from the new chunks of revised
+                documents, retiring the claims of removed chunks and moving the rest to the new
+                revision. Defaults to False, which extracts every chunk of a changed document and
+                leaves the previous revision's claims as they are.
+            mode (str, optional): "sync" requests each claim scroll directly, concurrently if
+                concurrent_claims is set. "batch" submits every scroll of every document as one
+                offline batch job. Defaults to "sync".
+
+        Returns:
+            list: The extracted claims.
+        """
+        self._check_mode(mode)
+
+        with telemetry.project(self.project_id):
+
+            # (document, category, chunk, system_prompt, user_prompt) for every claim scroll of the batch job
+            scrolls = []
+
+            # Process each document
+            for document in self.documents:
+                if not self._document_exists(document['document_id']):
+                    revision = self._get_previous_revision(document) if incremental else None
+
+                    if revision is not None:
+                        self._apply_claims_revision(document, revision)
+                    only_chunk_ids = revision['new_chunk_ids'] if revision is not None else None
+
+                    if mode == "batch":
+                        scrolls.extend(
+                            (document, category, chunk, *self._get_claim_prompts(chunk, self.entities_string, questions, document['document_summary']))
+                            for category, questions, chunk in self._claim_scrolls(document, only_chunk_ids)
+                        )
+                    else:
+                        self._process_single_document_claims(document, only_chunk_ids=only_chunk_ids)
+
+            if scrolls:
+                with telemetry.stage("claim_scroll"):
+                    responses = self.ai_handler.run_batch([
+                        {"system_prompt": system_prompt, "prompt": user_prompt, "json_output": True, "model": self.claim_model}
+                        for _, _, _, system_prompt, user_prompt in scrolls
+                    ])
+
+                for (document, category, chunk, system_prompt, user_prompt), response in zip(scrolls, responses):
+                    claims = self._store_claims(chunk, system_prompt, user_prompt, response)
+                    self._add_claims(document, category, chunk, claims)
+
+            return self.global_claims
+
+    def llm_usage(self, by=("stage", "model")):
+        """
+        Returns this project's LLM calls in this process, totalled by stage and model: calls,
+        retries, errors, tokens, cost and latency. See Telemetry.rollup.
+        """
+        return telemetry.get_telemetry().rollup(project=self.project_id, by=by)
+
+    def _check_mode(self, mode):
+        if mode not in ("sync", "batch"):
+            raise ValueError(f"Unsupported processing mode: {mode}")
+
+        if mode == "batch" and not hasattr(self.ai_handler, "run_batch"):
+            raise ValueError("The AI handler does not support batch mode")
     
     def return_unique_documents(self):
         unique_documents = []
@@ -132,18 +303,23 @@ class KnowledgeGraph:
         if 'project_id' not in document:
             document['project_id'] = self.project_id
 
+        # The summary prompt includes the metadata, so default it first
+        if 'document_metadata' not in document:
+            document['document_metadata'] = {"title": "UNKNOWN"}
+
         if 'document_id' not in document:
             document['document_id'] = self._md5_hash(document['markdown_path'])
 
+        # Identifies the document across revisions, whose document_id changes with the content
+        if 'source_id' not in document:
+            document['source_id'] = document['markdown_path']
+
         if 'document_summary' not in document:
             document['document_summary'] = self._generate_document_summary(document)
 
         if 'chunks' not in document:
             document['chunks'] = self._chunk_document(document)
 
-        if 'document_metadata' not in document:
-            document['document_metadata'] = {"title": "UNKNOWN"}
-
         return document
 
     def _document_exists(self,document_id, index_name=DOCUMENTS_INDEX):
@@ -164,11 +340,179 @@ class KnowledgeGraph:
         # If the total number of hits is greater than 0, the document exists
         return result['hits']['total']['value'] > 0
 
-    def _process_single_document_claims(self, document):
+    def _get_previous_revision(self, document, index_name=DOCUMENTS_INDEX):
+        # Looked up once per document, as applying a revision supersedes the stored one
+        if document['document_id'] in self._revisions:
+            return self._revisions[document['document_id']]
+
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"term": {"source_id.keyword": document['source_id']}},
+                        {"term": {"project_id.keyword": self.project_id}},
+                        # The latest revision, or the one this document already superseded in an earlier run
+                        {"bool": {
+                            "should": [
+                                {"bool": {"must_not": [{"exists": {"field": "superseded_by"}}]}},
+                                {"term": {"superseded_by.keyword": document['document_id']}}
+                            ],
+                            "minimum_should_match": 1
+                        }}
+                    ],
+                    "must_not": [
+                        {"term": {"document_id.keyword": document['document_id']}}
+                    ]
+                }
+            },
+            "sort": [
+                {"created": {"order": "desc", "unmapped_type": "date"}}
+            ],
+            "size": 1,
+            "_source": ["document_id", "chunks.chunk_id", "superseded_by", "revision_diff"]
+        }
+
+        result = search_es(index_name, query)
+
+        revision = None
+        if result['hits']['total']['value'] > 0:
+            hit = result['hits']['hits'][0]
+            diff = hit['_source'].get('revision_diff')
+
+            if hit['_source'].get('superseded_by') == document['document_id'] and diff is not None:
+                # Reuse the diff recorded when the revision was first applied
+                new_chunk_ids = set(diff['new_chunk_ids'])
+                removed_chunk_ids = set(diff['removed_chunk_ids'])
+            else:
+                previous_chunk_ids = {chunk['chunk_id'] for chunk in hit['_source'].get('chunks', [])}
+                chunk_ids = {chunk['chunk_id'] for chunk in document['chunks']}
+                new_chunk_ids = chunk_ids - previous_chunk_ids
+                removed_chunk_ids = self._unshared_chunk_ids(previous_chunk_ids - chunk_ids, document['source_id'])
+
+            revision = {
+                "_id": hit['_id'],
+                "document_id": hit['_source']['document_id'],
+                "new_chunk_ids": new_chunk_ids,
+                "removed_chunk_ids": removed_chunk_ids,
+                "superseded": hit['_source'].get('superseded_by') == document['document_id'],
+                "applied": set()
+            }
+
+        self._revisions[document['document_id']] = revision
+        return revision
+
+    def _unshared_chunk_ids(self, chunk_ids, source_id, index_name=DOCUMENTS_INDEX):
+        # chunk_ids are content hashes, so identical chunks in other documents share them
+        if not chunk_ids:
+            return set()
+
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"terms": {"chunks.chunk_id.keyword": list(chunk_ids)}},
+                        {"term": {"project_id.keyword": self.project_id}}
+                    ],
+                    "must_not": [
+                        {"term": {"source_id.keyword": source_id}}
+                    ]
+                }
+            },
+            "size": 10000,
+            "_source": ["chunks.chunk_id"]
+        }
+
+        result = search_es(index_name, query)
+
+        shared = set()
+        for hit in result['hits']['hits']:
+            shared.update(chunk['chunk_id'] for chunk in hit['_source'].get('chunks', []))
+
+        return chunk_ids - shared
+
+    def _apply_graph_revision(self, document, revision):
+        if "graph" in revision['applied']:
+            return
+        revision['applied'].add("graph")
+
+        # Drop the removed chunks from the graph; Neo4j is updated in submit_to_neo4j
+        self.remove_chunk_references(revision['removed_chunk_ids'])
+
+        self._supersede(document, revision)
+
+    def _apply_claims_revision(self, document, revision):
+        if "claims" in revision['applied']:
+            return
+        revision['applied'].add("claims")
+
+        removed_chunk_ids = revision['removed_chunk_ids']
+
+        # Retire claims extracted from chunks that no longer exist
+        if removed_chunk_ids:
+            bulk_update_by_query(CLAIMS_INDEX, {
+                "query": {
+                    "bool": {
+                        "must": [
+                            {"term": {"project_id.keyword": self.project_id}},
+                            {"term": {"document_id.keyword": revision['document_id']}},
+                            {"terms": {"chunk_id.keyword": list(removed_chunk_ids)}}
+                        ]
+                    }
+                },
+                "script": {
+                    "source": "ctx._source.retired = true; ctx._source.retired_at = params.retired_at",
+                    "params": {"retired_at": dt.datetime.now(dt.timezone.utc).isoformat()}
+                }
+            })
+
+        # The remaining claims now belong to the new revision
+        bulk_update_by_query(CLAIMS_INDEX, {
+            "query": {
+                "bool": {
+                    "must": [
+                        {"term": {"project_id.keyword": self.project_id}},
+                        {"term": {"document_id.keyword": revision['document_id']}}
+                    ],
+                    "must_not": [
+                        {"term": {"retired": True}}
+                    ]
+                }
+            },
+            "script": {
+                "source": "ctx._source.document_id = params.document_id; ctx._source.document_metadata = params.document_metadata; ctx._source.document_summary = params.document_summary",
+                "params": {
+                    "document_id": document['document_id'],
+                    "document_metadata": document['document_metadata'],
+                    "document_summary": document['document_summary']
+                }
+            }
+        })
+
+        self._supersede(document, revision)
+
+    def _supersede(self, document, revision):
+        # So the next revision diffs against this one, and a later run (e.g. process_claims
+        # after process) finds this revision and its diff
+        if revision['superseded']:
+            return
+        revision['superseded'] = True
+
+        update_document(DOCUMENTS_INDEX, revision['_id'], {
+            "superseded_by": document['document_id'],
+            "revision_diff": {
+                "new_chunk_ids": sorted(revision['new_chunk_ids']),
+                "removed_chunk_ids": sorted(revision['removed_chunk_ids'])
+            }
+        })
+
+    def _claim_scrolls(self, document, only_chunk_ids=None):
 
         # Get question categories
         unique_categories = {item["category"] for item in self.questionnaire["questionnaire"]}
 
+        # (category, questions, chunk) for every claim scroll to run
+        scrolls = []
+
         # For each category
         for category in unique_categories:
 
@@ -177,17 +521,48 @@ class KnowledgeGraph:
 
             # Scroll through each chunk
             for chunk in document['chunks']:
-                claims = self._claim_scroll(chunk, self.entities_string, questions, document['document_summary'])
-
-                # Add claims to global claims
-                for claim in claims["claims"]:
-                    claim['project_id'] = self.project_id
-                    claim['category'] = category
-                    claim["document_id"] = document['document_id']
-                    claim["chunk_id"] = chunk["chunk_id"]
-                    claim["document_metadata"] = document['document_metadata']
-                    claim["document_summary"] = document['document_summary']
-                    self.global_claims.append(claim)
+                if only_chunk_ids is not None and chunk['chunk_id'] not in only_chunk_ids:
+                    continue
+
+                scrolls.append((category, questions, chunk))
+
+        return scrolls
+
+    @telemetry.stage("claim_scroll")
+    def _process_single_document_claims(self, document, only_chunk_ids=None):
+
+        scrolls = self._claim_scrolls(document, only_chunk_ids)
+
+        # Every scroll is independent, so they can be requested concurrently
+        if self.concurrent_claims and hasattr(self.ai_handler, "complete_many"):
+            prompts = [self._get_claim_prompts(chunk, self.entities_string, questions, document['document_summary']) for _, questions, chunk in scrolls]
+
+            responses = self.ai_handler.complete_many([
+                {"system_prompt": system_prompt, "prompt": user_prompt, "json_output": True, "model": self.claim_model}
+                for system_prompt, user_prompt in prompts
+            ])
+
+            results = [
+                self._store_claims(chunk, system_prompt, user_prompt, response)
+                for (_, _, chunk), (system_prompt, user_prompt), response in zip(scrolls, prompts, responses)
+            ]
+        else:
+            results = [self._claim_scroll(chunk, self.entities_string, questions, document['document_summary']) for _, questions, chunk in scrolls]
+
+        for (category, _, chunk), claims in zip(scrolls, results):
+            self._add_claims(document, category, chunk, claims)
+
+    def _add_claims(self, document, category, chunk, claims):
+
+        # Add claims to global claims
+        for claim in claims["claims"]:
+            claim['project_id'] = self.project_id
+            claim['category'] = category
+            claim["document_id"] = document['document_id']
+            claim["chunk_id"] = chunk["chunk_id"]
+            claim["document_metadata"] = document['document_metadata']
+            claim["document_summary"] = document['document_summary']
+            self.global_claims.append(claim)
     
     def _fetch_existing_graph(self):
         # Fetch existing graph data from Neo4j for the current project_id
@@ -220,6 +595,11 @@ class KnowledgeGraph:
         }
     
     def submit_to_neo4j(self):
+        # Remove references to chunks retired by document revisions first
+        if self._retired_chunk_ids:
+            remove_chunk_references(self._retired_chunk_ids, self.project_id)
+            self._retired_chunk_ids = set()
+
         if self.graph_modified:
             add_to_neo4j(self.global_graph, self.project_id)
 
@@ -230,34 +610,103 @@ class KnowledgeGraph:
     
     def _preprocess_documents(self):
 
+        if self.preprocess_workers > 1:
+            return self._preprocess_documents_concurrently()
+
         for document in self.documents:
             if 'project_id' not in document:
                 document['project_id'] = self.project_id
 
+            # The summary prompt includes the metadata, so default it first
+            if 'document_metadata' not in document:
+                document['document_metadata'] = {"title": "UNKNOWN"}
+
             if 'document_id' not in document:
                 document['document_id'] = self._md5_hash(document['markdown_path'])
 
+            # Identifies the document across revisions, whose document_id changes with the content
+            if 'source_id' not in document:
+                document['source_id'] = document['markdown_path']
+
             if 'document_summary' not in document:
                 document['document_summary'] = self._generate_document_summary(document)
 
             if 'chunks' not in document:
                 document['chunks'] = self._chunk_document(document)
 
+    def _preprocess_documents_concurrently(self):
+
+        for document in self.documents:
+            if 'project_id' not in document:
+                document['project_id'] = self.project_id
+
             if 'document_metadata' not in document:
                 document['document_metadata'] = {"title": "UNKNOWN"}
 
-    def _process_single_document(self, document):
+            if 'source_id' not in document:
+                document['source_id'] = document['markdown_path']
 
-        previous_chunk = None
+        # Hashing and chunking are CPU-bound, so they run in a process pool while the
+        # network-bound summary calls run in a thread pool alongside them, each in a copy of
+        # this context so its calls keep their telemetry tags
+        with ProcessPoolExecutor(max_workers=self.preprocess_workers) as process_pool, \
+                ThreadPoolExecutor(max_workers=self.preprocess_workers) as thread_pool:
 
-        for chunk in document['chunks']:
+            chunk_futures = {
+                index: process_pool.submit(_hash_and_chunk, document['markdown_path'], self.token_limit, self.previous_chunk_limit, self.chunking)
+                for index, document in enumerate(self.documents)
+                if 'document_id' not in document or 'chunks' not in document
+            }
+
+            summary_futures = {
+                index: thread_pool.submit(contextvars.copy_context().run, self._generate_document_summary, document)
+                for index, document in enumerate(self.documents)
+                if 'document_summary' not in document
+            }
+
+            # Collect results in the original document order
+            for index, document in enumerate(self.documents):
+                if index in summary_futures:
+                    document['document_summary'] = summary_futures[index].result()
+
+                if index in chunk_futures:
+                    document_id, chunks = chunk_futures[index].result()
+
+                    if 'document_id' not in document:
+                        document['document_id'] = document_id
+
+                    if 'chunks' not in document:
+                        document['chunks'] = self._build_chunks(document, chunks)
+
+    def _process_single_document(self, document, only_chunk_ids=None):
+
+        for chunk, previous_chunk in self._graph_scrolls(document, only_chunk_ids):
             existing_entities = self.get_entity_list()
             local_graph = self._knowledge_scroll(chunk, existing_entities, self.persona, document['document_summary'], previous_chunk)
             self.update_global_graph(local_graph.copy(), chunk['chunk_id'])
 
-            # Get last tokens from previous chunk
-            previous_chunk = get_last_n_tokens(chunk['content'], self.previous_chunk_limit)
+    def _graph_scrolls(self, document, only_chunk_ids=None):
+        # Yields (chunk, previous_chunk) for every chunk to extract, in document order
+
+        previous_chunk = None
 
+        for chunk in document['chunks']:
+            # A chunk that starts a new section doesn't need the previous one for context
+            if chunk.get('section_start'):
+                previous_chunk = None
+
+            # Unchanged chunks of a revised document are skipped, but still provide context
+            if only_chunk_ids is None or chunk['chunk_id'] in only_chunk_ids:
+                yield chunk, previous_chunk
+
+            # Get last tokens from previous chunk, reusing the chunker's tokens when we have them
+            tail_tokens = self._chunk_tails.pop(chunk['chunk_id'], None)
+            if tail_tokens is not None:
+                previous_chunk = get_last_n_tokens_from_tokens(tail_tokens, self.previous_chunk_limit)
+            else:
+                previous_chunk = get_last_n_tokens(chunk['content'], self.previous_chunk_limit)
+
+    @telemetry.stage("deduplicate_entities")
     def _deduplicate_entities(self):
 
         # Schema response format
@@ -290,10 +739,10 @@ class KnowledgeGraph:
             entities_string += f"  {entity['description']}\n\n"
 
         # Load the system prompt for entity deduplication
-        system_prompt = textwrap.dedent(deduplicate_system_entity_prompt).strip()
+        system_prompt = get_template(deduplicate_system_entity_prompt).text
 
         # Load the user prompt for entity deduplication
-        user_prompt = textwrap.dedent(deduplicate_user_entity_prompt).strip().format(entity_list=entities_string)
+        user_prompt = render(deduplicate_user_entity_prompt, entity_list=entities_string)
 
         # Submit to AI
         deduplication_mapping = json.loads(self.ai_handler.request_completion(system_prompt, user_prompt, json_output=True))
@@ -360,14 +809,15 @@ class KnowledgeGraph:
         self.global_graph['entities'] = entities
         self.global_graph['relationships'] = merged_relationships
 
+    @telemetry.stage("merge_descriptions")
     def _merge_descriptions(self):
 
         # Create a copy of the global graph
         graph = self.global_graph.copy()
 
         # Load the system prompts for entity and relationship merging
-        entity_system_prompt = textwrap.dedent(merge_descriptions_entity_system_prompt).strip()
-        relationship_system_prompt = textwrap.dedent(merge_descriptions_relationship_system_prompt).strip()
+        entity_system_prompt = get_template(merge_descriptions_entity_system_prompt).text
+        relationship_system_prompt = get_template(merge_descriptions_relationship_system_prompt).text
 
         # Merge entity descriptions
         for entity in graph["entities"]:
@@ -384,7 +834,7 @@ class KnowledgeGraph:
                 tmp_entity["type"] = entity["type"]
                 tmp_entity["description"] = entity["description"]
                 # Load the user prompt
-                prompt = textwrap.dedent(merge_descriptions_entity_user_prompt).strip().format(entity=json.dumps(tmp_entity, indent=4))
+                prompt = render(merge_descriptions_entity_user_prompt, entity=json.dumps(tmp_entity, indent=4))
                 # Submit to AI
                 new_entity = json.loads(self.ai_handler.request_completion(entity_system_prompt, prompt, json_output=True))
                 # Update the entity with the new description
@@ -405,7 +855,7 @@ class KnowledgeGraph:
                 tmp_relationship["target"] = relationship["target"]
                 tmp_relationship["description"] = relationship["description"]
                 # Load the user prompt
-                prompt = textwrap.dedent(merge_descriptions_relationship_user_prompt).strip().format(relationship=json.dumps(tmp_relationship, indent=4))
+                prompt = render(merge_descriptions_relationship_user_prompt, relationship=json.dumps(tmp_relationship, indent=4))
                 # Submit to AI
                 new_relationship = json.loads(self.ai_handler.request_completion(relationship_system_prompt, prompt, json_output=True))
                 # Update the relationship with the new description
@@ -415,38 +865,50 @@ class KnowledgeGraph:
         self.global_graph = graph
 
 
+    @telemetry.stage("document_summary")
     def _generate_document_summary(self, document):
-        
-        # In UTF
-        with open(document['markdown_path'], "r", encoding="utf-8") as file:
-            document_text = file.read()
 
         # Get UTC date in YYYY-MM-DD format
         date = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d")
 
 
         # Construct the system prompt
-        system_prompt = textwrap.dedent(document_summary_system_prompt).strip().replace("{metadata}", json.dumps(document['document_metadata'], indent=4)).replace("{scope}", self.report_scope).replace("{date}", date)
+        system_prompt = get_template(document_summary_system_prompt, style="replace").render(
+            metadata=json.dumps(document['document_metadata'], indent=4),
+            scope=self.report_scope,
+            date=date
+        )
 
-        summary = json.loads(self.ai_handler.recursive_summary(system_prompt, document_text, json_output=True))
+        # Stream the document from disk rather than reading it into memory
+        summary = json.loads(self.ai_handler.recursive_summary(system_prompt, file_path=document['markdown_path'], json_output=True, mode=self.summary_mode))
         return summary
 
     def _chunk_document(self, document):
+        chunks = _chunk_with_tails(document['markdown_path'], self.token_limit, self.previous_chunk_limit, self.chunking)
+        return self._build_chunks(document, chunks)
+
+    def _build_chunks(self, document, raw_chunks):
         chunks = []
-        with open(document['markdown_path'], "r", encoding="utf-8") as file:
-            document_text = file.read()
 
-        for i, chunk in enumerate(chunk_large_text(document_text, self.token_limit)):
-            chunk_id = hashlib.md5(chunk["content"].encode()).hexdigest()
-            chunks.append({
+        for i, raw_chunk in enumerate(raw_chunks):
+            chunk_id = hashlib.md5(raw_chunk["content"].encode()).hexdigest()
+            chunk = {
                 "project_id": self.project_id,
                 "chunk_id": chunk_id,
                 "document_id": document['document_id'],
                 "document_summary": document['document_summary'],
                 "document_metadata": document['document_metadata'],
                 "chunk_index": i,
-                "content": chunk["content"],
-            })
+                "content": raw_chunk["content"],
+            }
+
+            # Section chunks carry their place in the document structure
+            if "headings" in raw_chunk:
+                chunk["headings"] = raw_chunk["headings"]
+                chunk["section_start"] = raw_chunk["section_start"]
+
+            chunks.append(chunk)
+            self._chunk_tails[chunk_id] = raw_chunk["tail_tokens"]
 
         return chunks
     
@@ -482,6 +944,50 @@ class KnowledgeGraph:
                 if self.graph_modified is False:
                     self.graph_modified = True  # Set flag when new relationship is added
 
+    def remove_chunk_references(self, chunk_ids):
+        """
+        Removes references to chunks from the global graph. Entities and relationships left
+        without any reference are dropped. Descriptions are removed alongside their reference
+        while they are still unmerged; merged descriptions are kept as they are.
+
+        Args:
+            chunk_ids (set): The chunk_ids to remove.
+        """
+        if not chunk_ids:
+            return
+
+        def remove(items):
+            kept = []
+            for item in items:
+                references = item.get("references") or []
+                if not any(reference in chunk_ids for reference in references):
+                    kept.append(item)
+                    continue
+
+                # Unmerged descriptions are appended alongside their reference
+                if isinstance(item["description"], list) and len(item["description"]) == len(references):
+                    item["description"] = [description for description, reference in zip(item["description"], references) if reference not in chunk_ids]
+
+                item["references"] = [reference for reference in references if reference not in chunk_ids]
+                if item["references"]:
+                    kept.append(item)
+            return kept
+
+        names = {entity["name"] for entity in self.global_graph["entities"]}
+        entities = remove(self.global_graph["entities"])
+        removed_names = names - {entity["name"] for entity in entities}
+
+        # Relationships can't outlive either of their entities
+        relationships = [
+            relationship for relationship in remove(self.global_graph["relationships"])
+            if relationship["source"] not in removed_names and relationship["target"] not in removed_names
+        ]
+
+        self.global_graph["entities"] = entities
+        self.global_graph["relationships"] = relationships
+        self._retired_chunk_ids.update(chunk_ids)
+        self.graph_modified = True
+
     def get_entity_list(self):
         entities = self.global_graph.get("entities", [])
         
@@ -495,7 +1001,7 @@ class KnowledgeGraph:
         return "\n".join(entity_list)
 
 
-    def _knowledge_scroll(self, chunk, existing_entities=None, persona=None, document_summary=None, previous_chunk=None):
+    def _get_graph_prompts(self, chunk, existing_entities=None, persona=None, document_summary=None, previous_chunk=None):
         output_format = {
             "entities": [
                 {"name": "EntityName", "type": "EntityType", "description": "Comprehensive description of the entity's attributes and activities"},
@@ -505,18 +1011,29 @@ class KnowledgeGraph:
             ],
         }
 
-        system_prompt = textwrap.dedent(graph_system_prompt).strip().format(output_format=json.dumps(output_format, indent=4))
+        system_prompt = render(graph_system_prompt, output_format=json.dumps(output_format, indent=4))
 
         user_prompt = self._get_user_prompt(
             chunk['content'], 
             existing_entities, 
             persona, 
             json.dumps(document_summary, indent=4), 
-            previous_chunk=previous_chunk
+            previous_chunk=previous_chunk,
+            headings=chunk.get('headings')
         )
 
+        return system_prompt, user_prompt
+
+    @telemetry.stage("knowledge_scroll")
+    def _knowledge_scroll(self, chunk, existing_entities=None, persona=None, document_summary=None, previous_chunk=None):
+
+        system_prompt, user_prompt = self._get_graph_prompts(chunk, existing_entities, persona, document_summary, previous_chunk)
         entities = self.ai_handler.request_completion(system_prompt, user_prompt, json_output=True, model=self.graph_model)
 
+        return self._store_graph(chunk, system_prompt, user_prompt, entities)
+
+    def _store_graph(self, chunk, system_prompt, user_prompt, entities):
+
         # Store data for training
         training_data = {
             "project_id": self.project_id,
@@ -545,20 +1062,31 @@ class KnowledgeGraph:
         
         return bullet_list
     
-    def _claim_scroll(self, chunk, entities, questions, document_summary=None):
+    def _get_claim_prompts(self, chunk, entities, questions, document_summary=None):
 
-        system_prompt = textwrap.dedent(claim_system_prompt).strip()
+        system_prompt = get_template(claim_system_prompt).text
 
-        user_prompt = textwrap.dedent(claim_user_prompt).strip().format(
+        user_prompt = render(
+            claim_user_prompt,
             metadata=json.dumps(document_summary, indent=4),
             questions=questions,
             entities=entities,
             text=chunk['content']
         )
 
-        try:
-            claims = self.ai_handler.request_completion(system_prompt, user_prompt, json_output=True, model=self.claim_model)
+        return system_prompt, user_prompt
+
+    @telemetry.stage("claim_scroll")
+    def _claim_scroll(self, chunk, entities, questions, document_summary=None):
+
+        system_prompt, user_prompt = self._get_claim_prompts(chunk, entities, questions, document_summary)
+        claims = self.ai_handler.request_completion(system_prompt, user_prompt, json_output=True, model=self.claim_model)
 
+        return self._store_claims(chunk, system_prompt, user_prompt, claims)
+
+    def _store_claims(self, chunk, system_prompt, user_prompt, claims):
+
+        try:
             # Store data for training
             training_data = {
                 "project_id": self.project_id,
@@ -577,27 +1105,23 @@ class KnowledgeGraph:
             return {"claims": []}
     
     def _md5_hash(self, file_path):
-        md5_hash = hashlib.md5()
-        with open(file_path, "rb") as file:
-            for chunk in iter(lambda: file.read(4096), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
+        return _md5_file(file_path)
     
-    def _get_user_prompt(self, chunk, entities_list, persona, document_summary, previous_chunk=None):
+    def _get_user_prompt(self, chunk, entities_list, persona, document_summary, previous_chunk=None, headings=None):
 
         header = ""
+        if headings:
+            header = "## Document Section\n\n" + " > ".join(headings) + "\n\n----\n\n"
+
         if previous_chunk:
-            header = f"## Previous Chunk\n\n{previous_chunk}\n\n----\n\n"
+            header += f"## Previous Chunk\n\n{previous_chunk}\n\n----\n\n"
 
-            instruction = textwrap.dedent("""
-                I have provided you with a chunk of text to review, a previous chunk for added context, and a list of existing entities. Your task is to analyze the chunk of text and identify any entities or relationships within it.
-            """)
+            instruction = _GRAPH_PREVIOUS_CHUNK_INSTRUCTION
         else:
-            instruction = textwrap.dedent("""
-                I have provided you with a chunk of text to review, and a list of existing entities. Your task is to analyze the chunk of text and respond with a list of entities or relationships.
-            """)
+            instruction = _GRAPH_INSTRUCTION
 
-        return textwrap.dedent(graph_user_prompt).strip().format(
+        return render(
+                graph_user_prompt,
                 chunk=chunk, 
                 entities_list=entities_list, 
                 header=header, 
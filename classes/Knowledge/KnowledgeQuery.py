@@ -3,7 +3,6 @@ import torch.nn as nn
 from transformers import BertTokenizer, BertModel
 import random
 import numpy as np
-import textwrap
 import warnings
 import transformers
 import json
@@ -36,6 +35,7 @@ transformers.utils.logging.set_verbosity_error()
 try:
     # Try relative imports for deployment
     from ....modules.text import *
+    from ....modules.templates import *
     from ....modules.markdown import *
     from ....ai_handler import AIHandler
     from ....modules.elastic import *
@@ -44,6 +44,7 @@ except ImportError:
     try:
         # Fallback to absolute imports with project name for structured imports
         from ParchmentProphet.modules.text import *
+        from ParchmentProphet.modules.templates import *
         from ParchmentProphet.modules.markdown import *
         from ParchmentProphet.classes.ai_handler import AIHandler
         from ParchmentProphet.modules.elastic import *
@@ -51,6 +52,7 @@ except ImportError:
     except ImportError:
         # Fallback to simple absolute imports for local testing
         from modules.text import *
+        from modules.templates import *
         from modules.markdown import *
         from classes.ai_handler import AIHandler
         from modules.neo4j import *
@@ -184,8 +186,8 @@ class KnowledgeQuery:
                     # claims_string += f"Relevance Explanation: {claim['relevance_explanation']}\n"
                     claims_string += "\n"  # Add a blank line between claims
 
-            system_prompt = textwrap.dedent(answer_claim_system_prompt).strip()
-            user_prompt = textwrap.dedent(answer_claim_user_prompt).strip().format(question=question['question'], documents=claims_string)
+            system_prompt = get_template(answer_claim_system_prompt).text
+            user_prompt = render(answer_claim_user_prompt, question=question['question'], documents=claims_string)
 
             # Request completion from the AI
             answer = self.ai_handler.request_completion(system_prompt, user_prompt, model=self.claim_answer_model)
@@ -54,4 +54,12 @@ graph_user_prompt = """
     - Avoid duplication by matching entities to existing entities in the list provided. Even if the existing entity is misspelled, use it to maintain consistency.
 
     Now, analyze your chunk and extract all entities and relationships according to the instructions.
-"""
\ No newline at end of file
+"""
+
+graph_instruction = """
+    I have provided you with a chunk of text to review, and a list of existing entities. Your task is to analyze the chunk of text and respond with a list of entities or relationships.
+"""
+
+graph_previous_chunk_instruction = """
+    I have provided you with a chunk of text to review, a previous chunk for added context, and a list of existing entities. Your task is to analyze the chunk of text and identify any entities or relationships within it.
+"""
@@ -6,15 +6,16 @@ import hashlib
 import yaml
 from collections import OrderedDict
 import re
-import textwrap
 import datetime
 
 # Import text functions
 try:
     # Try relative imports for deployment
     from ....modules.text import *
+    from ....modules.templates import *
     from ....modules.markdown import *
     from ....ai_handler import AIHandler
+    from ..ai import telemetry
     from ....modules.elastic import *
     from ....modules.neo4j import *
     from ..Knowledge.KnowledgeQuery import KnowledgeQuery
@@ -22,16 +23,20 @@ except ImportError:
     try:
         # Fallback to absolute imports with project name for structured imports
         from ParchmentProphet.modules.text import *
+        from ParchmentProphet.modules.templates import *
         from ParchmentProphet.modules.markdown import *
         from ParchmentProphet.classes.ai_handler import AIHandler
+        from ParchmentProphet.classes.ai import telemetry
         from ParchmentProphet.modules.elastic import *
         from ParchmentProphet.modules.neo4j import *
         from ParchmentProphet.classes.Knowledge.KnowledgeQuery import KnowledgeQuery
     except ImportError:
         # Fallback to simple absolute imports for local testing
         from modules.text import *
+        from modules.templates import *
         from modules.markdown import *
         from classes.ai_handler import AIHandler
+        from classes.ai import telemetry
         from modules.neo4j import *
         from modules.elastic import *
         from classes.Knowledge.KnowledgeQuery import KnowledgeQuery
@@ -76,6 +81,9 @@ class Report:
         self.training_data['created'] = datetime.datetime.now(datetime.timezone.utc)
         self.training_data['sections'] = []
 
+        # Token usage of the last report, including prompt cache reads and writes
+        self.token_usage = {}
+
     def get_latest_models(self):
         try:
             query = {
@@ -107,6 +115,54 @@ class Report:
             }
 
     def generate_report(self):
+        """
+        Drafts every section of the report template in turn.
+
+        Returns:
+            list: The drafted sections as {"title", "content"} dicts, in template order.
+        """
+        with telemetry.project(self.project_id):
+            for event in self._report_events(stream=False):
+                if event["type"] == "report":
+                    return event["sections"]
+
+    def generate_report_stream(self):
+        """
+        Streaming variant of generate_report, so output can be shown as soon as the first
+        section starts rather than once the whole report is drafted.
+
+        Yields:
+            dict: Events in the order they happen:
+                {"type": "delta", "index", "title", "text"} for each piece of a section's text,
+                {"type": "section", "index", "title", "content"} once a section is complete, and
+                {"type": "report", "sections", "usage"} at the end, with the same sections
+                generate_report returns and the report's token usage.
+                index is the section's position in the report template.
+        """
+        # Tagged per step rather than with telemetry.project, which can't be held across a yield
+        yield from telemetry.tagged(self._report_events(stream=True), project=self.project_id)
+
+    def llm_usage(self, by=("stage", "model")):
+        """
+        Returns this project's LLM calls in this process, totalled by stage and model: calls,
+        retries, errors, tokens, cost and latency. See Telemetry.rollup.
+        """
+        return telemetry.get_telemetry().rollup(project=self.project_id, by=by)
+
+    def _draft_section(self, messages, index, title, stream):
+        # Yields the section's delta events when streaming, and returns its full content
+        if not stream:
+            with telemetry.stage("report_section"):
+                return self.ai.request_completion(messages=messages, model=self.report_gen_model, usage=self.token_usage)
+
+        parts = []
+        completion = self.ai.request_completion(messages=messages, model=self.report_gen_model, stream=True, usage=self.token_usage)
+        for text in telemetry.tagged(completion, stage="report_section"):
+            parts.append(text)
+            yield {"type": "delta", "index": index, "title": title, "text": text}
+        return "".join(parts)
+
+    def _report_events(self, stream=False):
         if not self.questionnaire:
             raise ValueError(f"No questionnaire found for questionnaire ID: {self.project.get('questionnaire_id')}")
 
@@ -123,8 +179,12 @@ class Report:
         if not self.check_if_answers_exist():
             self.generate_answers()
 
-        system_prompt = textwrap.dedent(report_generation_system_prompt).strip().format(persona=report_persona)
-        
+        system_prompt = render(report_generation_system_prompt, persona=report_persona)
+
+        # Messages are only ever appended, so each section request shares the previous one's
+        # prefix (system prompt, answers and drafted sections) and the provider's prompt cache
+        # serves it instead of processing it again
+        self.token_usage = {}
         messages = [
             {"role": "system", "content": system_prompt}
         ]
@@ -144,7 +204,8 @@ class Report:
         first_section = self.report_template["sections"][first_section_index]
         messages.append({
             "role": "user", 
-            "content": textwrap.dedent(report_generation_first_user_prompt).strip().format(
+            "content": render(
+                report_generation_first_user_prompt,
                 answers=self.format_answers(self.answers),
                 report_scope=report_scope,
                 example=first_section["example"],
@@ -162,20 +223,22 @@ class Report:
                 # Add the subsequent user prompt for non-first sections
                 messages.append({
                     "role": "user", 
-                    "content": textwrap.dedent(report_generation_subsequent_user_prompt).strip().format(
+                    "content": render(
+                        report_generation_subsequent_user_prompt,
                         example=section["example"],
                         section_brief=section["prompt"]
                     )
                 })
 
             # Generate the section
-            response = self.ai.request_completion(messages=messages, model=self.report_gen_model)
+            response = yield from self._draft_section(messages, i, section["title"], stream)
 
             # Add the generated section to drafted_sections
             drafted_sections.append({
                 "title": section["title"],
                 "content": response
             })
+            yield {"type": "section", "index": i, "title": section["title"], "content": response}
 
             # Add the AI's response to the messages
             messages.append({"role": "assistant", "content": response})
@@ -196,18 +259,20 @@ class Report:
         if delayed_section:
             messages.append({
                 "role": "user",
-                "content": textwrap.dedent(report_generation_subsequent_user_prompt).strip().format(
+                "content": render(
+                    report_generation_subsequent_user_prompt,
                     example=delayed_section["example"],
                     section_brief=delayed_section["prompt"]
                 )
             })
-            response = self.ai.request_completion(messages=messages, model=self.report_gen_model)
+            response = yield from self._draft_section(messages, delayed_section_index, delayed_section["title"], stream)
             
             # Insert the delayed section at its original position
             drafted_sections.insert(delayed_section_index, {
                 "title": delayed_section["title"],
                 "content": response
             })
+            yield {"type": "section", "index": delayed_section_index, "title": delayed_section["title"], "content": response}
 
             # Add section to training data
             self.training_data['sections'].append({
@@ -223,7 +288,7 @@ class Report:
         # Once generated, submit training data to elastic
         add_to_es(self.REPORT_TRAINNG_INDEX, self.training_data, self.project_id)
 
-        return drafted_sections
+        yield {"type": "report", "sections": drafted_sections, "usage": self.token_usage}
     
     def get_project(self):
         query = {
@@ -280,6 +345,10 @@ class Report:
                 "bool": {
                     "must": [
                         {"match": {"project_id": self.project_id}}
+                    ],
+                    "must_not": [
+                        # Claims from chunks removed by a document revision
+                        {"term": {"retired": True}}
                     ]
                 }
             },
@@ -329,6 +398,7 @@ class Report:
         result = search_es(self.ANSWER_INDEX, query)
         return result["hits"]["total"]["value"] > 0
 
+    @telemetry.stage("report_answers")
     def generate_answers(self):
         query_engine = KnowledgeQuery()
         answers = query_engine.answer_questions_from_claims(self.questionnaire, self.claims)
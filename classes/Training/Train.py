@@ -2,7 +2,6 @@ import os
 import json
 import json
 from typing import List, Dict, Any
-import textwrap
 import hashlib
 import yaml
 from collections import OrderedDict
@@ -13,6 +12,7 @@ import tempfile
 try:
     # Try relative imports for deployment
     from ....modules.text import *
+    from ....modules.templates import *
     from ....modules.markdown import *
     from ....ai_handler import AIHandler
     from ....modules.elastic import *
@@ -21,6 +21,7 @@ except ImportError:
     try:
         # Fallback to absolute imports with project name for structured imports
         from ParchmentProphet.modules.text import *
+        from ParchmentProphet.modules.templates import *
         from ParchmentProphet.modules.markdown import *
         from ParchmentProphet.classes.ai_handler import AIHandler
         from ParchmentProphet.modules.elastic import *
@@ -28,6 +29,7 @@ except ImportError:
     except ImportError:
         # Fallback to simple absolute imports for local testing
         from modules.text import *
+        from modules.templates import *
         from modules.markdown import *
         from classes.ai_handler import AIHandler
         from modules.neo4j import *
@@ -200,11 +202,12 @@ class Train:
         messages = []
         
         # Add system prompt
-        system_prompt = textwrap.dedent(report['system_prompt_template']).strip().format(persona=report['persona'])
+        system_prompt = render(report['system_prompt_template'], persona=report['persona'])
         messages.append({"role": "system", "content": system_prompt})
         
         # Add first user prompt
-        first_user_prompt = textwrap.dedent(report['first_user_prompt_template']).strip().format(
+        first_user_prompt = render(
+            report['first_user_prompt_template'],
             answers=self.format_answers(report['answers']),
             report_scope=report['report_scope'],
             example=report['sections'][0]['example'],
@@ -217,7 +220,8 @@ class Train:
         
         # Add subsequent sections
         for section in report['sections'][1:]:
-            subsequent_user_prompt = textwrap.dedent(report['subsequent_user_prompt_template']).strip().format(
+            subsequent_user_prompt = render(
+                report['subsequent_user_prompt_template'],
                 example=section['example'],
                 section_brief=section['prompt']
             )
@@ -1,10 +1,29 @@
 import os
+import json
+from json.decoder import JSONDecodeError
 import anthropic
-from PIL import Image
-import base64
-from io import BytesIO
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+# Import tokenizer functions
+try:
+    # Try relative imports for deployment
+    from ..modules.tokenizer import count_tokens_batch
+    from ..modules.images import image_dimensions, ImagePayload, as_image_payload
+except ImportError:
+    try:
+        # Fallback to absolute imports with project name for structured imports
+        from ParchmentProphet.modules.tokenizer import count_tokens_batch
+        from ParchmentProphet.modules.images import image_dimensions, ImagePayload, as_image_payload
+    except ImportError:
+        # Fallback to simple absolute imports for local testing
+        from modules.tokenizer import count_tokens_batch
+        from modules.images import image_dimensions, ImagePayload, as_image_payload
+
+from .cache import ResponseCache
+from .rate_limit import get_rate_limiter
+from .http import create_http_client
+from .telemetry import get_telemetry
+
 class AnthropicAPIError(Exception):
     """Custom exception class for handling Anthropic API errors."""
     pass
@@ -29,16 +48,23 @@ class AnthropicHandler:
         "ANTHROPIC_RETRY_WAIT_MIN": 4,
         "ANTHROPIC_RETRY_WAIT_MAX": 10,
         "ANTHROPIC_TIMEOUT": 240,
-        "ANTHROPIC_MAX_IMAGES": 5
+        "ANTHROPIC_MAX_IMAGES": 5,
+        "ANTHROPIC_REQUESTS_PER_MINUTE": 0,
+        "ANTHROPIC_TOKENS_PER_MINUTE": 0,
+        "ANTHROPIC_TOKEN_RATIO": 1.2,
+        "ANTHROPIC_PROMPT_CACHING": "true"
     }
 
+    # Anthropic allows at most four cache_control breakpoints per request
+    MAX_CACHE_BREAKPOINTS = 4
+
     @staticmethod
     def get_env_or_default(key, default):
         """Retrieve environment variable or return a default value."""
         return os.getenv(key) or default
 
     def __init__(self, api_key=None, max_output_tokens=None, max_context_tokens=None, default_model=None,
-                 retry_attempts=None, retry_wait_multiplier=None, retry_wait_min=None, retry_wait_max=None, timeout=None):
+                 retry_attempts=None, retry_wait_multiplier=None, retry_wait_min=None, retry_wait_max=None, timeout=None, cache=None, rate_limits=None, token_ratio=None, prompt_caching=None, client=None, telemetry=None):
         """
         Initialize the AnthropicHandler with optional custom configurations.
         
@@ -51,6 +77,12 @@ class AnthropicHandler:
         retry_wait_multiplier (int): Multiplier for exponential wait.
         retry_wait_min (int): Minimum wait time for retries.
         retry_wait_max (int): Maximum wait time for retries.
+        cache (ResponseCache): Response cache. Defaults to one at LLM_CACHE_PATH if set.
+        rate_limits (dict): Per-model {"requests_per_minute": ..., "tokens_per_minute": ...} quotas.
+        token_ratio (float): Anthropic tokens per local tokenizer token, used to estimate counts offline.
+        prompt_caching (bool): Mark the system prompt and latest turns with cache_control breakpoints.
+        client: Anthropic client to use instead of a new one, e.g. a local stand-in.
+        telemetry (Telemetry): Records each call's latency, usage and cost. Defaults to the process-wide one.
         """
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
 
@@ -69,11 +101,32 @@ class AnthropicHandler:
         self.retry_wait_max = retry_wait_max or int(self.get_env_or_default("ANTHROPIC_RETRY_WAIT_MAX", self.DEFAULT_VALUES["ANTHROPIC_RETRY_WAIT_MAX"]))
         self.timeout = timeout or int(self.get_env_or_default("ANTHROPIC_TIMEOUT", self.DEFAULT_VALUES["ANTHROPIC_TIMEOUT"]))
 
+        # Claude's tokenizer isn't available offline, so counts are estimated with the local tokenizer
+        # scaled by this ratio, erring high so the context check stays safe
+        self.token_ratio = token_ratio or float(self.get_env_or_default("ANTHROPIC_TOKEN_RATIO", self.DEFAULT_VALUES["ANTHROPIC_TOKEN_RATIO"]))
+
         # Image settings
         self.max_images = int(self.get_env_or_default("ANTHROPIC_MAX_IMAGES", self.DEFAULT_VALUES["ANTHROPIC_MAX_IMAGES"]))
 
         # Initialize the Anthropic client
-        self.client = anthropic.Anthropic(api_key=self.api_key, timeout=timeout)
+        self.client = client or anthropic.Anthropic(api_key=self.api_key, timeout=self.timeout, http_client=create_http_client(self.timeout))
+
+        # Prompt caching, so a prefix shared by consecutive requests is processed and billed once
+        if prompt_caching is None:
+            prompt_caching = str(self.get_env_or_default("ANTHROPIC_PROMPT_CACHING", self.DEFAULT_VALUES["ANTHROPIC_PROMPT_CACHING"])).lower() in ("1", "true", "yes")
+        self.prompt_caching = prompt_caching
+
+        # Response cache, enabled by passing one in or by setting LLM_CACHE_PATH
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+
+        # Per-call latency, token usage and cost
+        self.telemetry = telemetry or get_telemetry()
+
+        # Client-side quotas, shared by every handler in the process; the env limits apply to
+        # models without an entry in rate_limits
+        self.rate_limits = rate_limits or {}
+        self.requests_per_minute = int(self.get_env_or_default("ANTHROPIC_REQUESTS_PER_MINUTE", self.DEFAULT_VALUES["ANTHROPIC_REQUESTS_PER_MINUTE"]))
+        self.tokens_per_minute = int(self.get_env_or_default("ANTHROPIC_TOKENS_PER_MINUTE", self.DEFAULT_VALUES["ANTHROPIC_TOKENS_PER_MINUTE"]))
 
     def retry_decorator(self):
         """
@@ -87,7 +140,7 @@ class AnthropicHandler:
             wait=wait_exponential(multiplier=self.retry_wait_multiplier, min=self.retry_wait_min, max=self.retry_wait_max)
         )
 
-    def submit(self, messages, system_prompt="", model=None, temperature=0.2, top_p=None, max_tokens=None):
+    def submit(self, messages, system_prompt="", model=None, temperature=0.2, top_p=None, max_tokens=None, use_cache=True, stream=False, cache_prompt=None, usage=None):
         """
         Submit a request to the Anthropic API with retry logic.
         
@@ -98,42 +151,50 @@ class AnthropicHandler:
         temperature (float): Sampling temperature for the model.
         top_p (float): Nucleus sampling parameter.
         max_tokens (int): Maximum tokens for the response.
+        use_cache (bool): Whether to use the response cache for this call.
+        stream (bool): Return a generator of text deltas as they arrive. Only opening the
+            stream is retried.
+        cache_prompt (bool): Add prompt cache breakpoints. Defaults to the handler's prompt_caching.
+        usage (dict): If given, the request's input_tokens, output_tokens, cache_read_tokens and
+            cache_write_tokens are added to it.
 
         Returns:
-        str: The response text from the API.
+        str: The response text from the API, or a generator of its deltas when streaming.
         """
+        cache_prompt = self.prompt_caching if cache_prompt is None else cache_prompt
+
+        if stream:
+            return self._submit_stream(messages, system_prompt, model, temperature, top_p, max_tokens, use_cache, cache_prompt, usage)
+
+        # Identical requests are answered from the cache
+        cache_key = self._cache_key(messages, system_prompt, model, temperature, top_p, max_tokens, use_cache)
+        if cache_key is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                return content
+
+        call = self.telemetry.start("anthropic", model if model else self.default_model)
 
         @self.retry_decorator()
         def _submit():
-            # Input validation
-            if temperature < 0 or temperature > 1:
-                raise ValueError("Temperature must be between 0 and 1")
-            if top_p is not None and (top_p < 0 or top_p > 1):
-                raise ValueError("Top_p must be between 0 and 1")
-            if max_tokens is not None and max_tokens <= 0:
-                raise ValueError("Max_tokens must be positive")
-
-            # Calculate the total number of tokens
-            total_tokens = self.count_tokens(messages)
-
-            if total_tokens > (self.max_context_tokens - self.max_output_tokens):
-                raise ValueError(f"The total token count ({total_tokens}) exceeds the allowed limit ({self.max_context_tokens}). This takes into account the maximum output token count: {self.max_output_tokens}.")
-
-            # Define settings for the request
-            settings = {
-                "model": model if model else self.default_model,
-                "max_tokens": max_tokens if max_tokens else self.max_output_tokens,
-                "temperature": temperature,
-                "system": system_prompt,
-                "messages": messages
-            }
-
-            if top_p is not None:
-                settings["top_p"] = top_p
+            call.attempt()
+            total_tokens, settings = self._prepare(messages, system_prompt, model, temperature, top_p, max_tokens, cache_prompt)
+
+            # Wait for quota, costing the prompt plus the most the model may generate
+            limiter = self._get_rate_limiter(settings["model"])
+            reservation = limiter.acquire(total_tokens + settings["max_tokens"]) if limiter else None
 
             # Make the request
             try:
                 response = self.client.messages.create(**settings)
+
+                # Correct the estimate with the actual usage
+                response_usage = self._read_usage(getattr(response, "usage", None))
+                if limiter and response_usage is not None:
+                    limiter.reconcile(reservation, sum(response_usage.values()))
+                self._add_usage(usage, response_usage)
+                call.finish(response_usage)
+
                 return response.content[0].text
             except anthropic.APITimeoutError:
                 raise AnthropicAPIError("Request timed out")
@@ -142,17 +203,244 @@ class AnthropicHandler:
             except Exception as e:
                 raise AnthropicAPIError(f"Unexpected error: {str(e)}")
 
-        return _submit()
+        try:
+            content = _submit()
+        except Exception as error:
+            call.finish(error=error)
+            raise
+
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
+
+        return content
+
+    def _cache_key(self, messages, system_prompt="", model=None, temperature=0.2, top_p=None, max_tokens=None, use_cache=True):
+        if self.cache is None or not use_cache:
+            return None
+
+        return self.cache.key(
+            "anthropic",
+            model if model else self.default_model,
+            messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens if max_tokens else self.max_output_tokens,
+            system=system_prompt
+        )
+
+    def request_completion(self, system_prompt="", prompt="", model=None, messages=[], temperature=0.2, top_p=None, max_tokens=None, json_output=False, use_cache=True, stream=False, usage=None):
+        """
+        OpenAI-style completion over submit, so callers written against request_completion work
+        with either provider. System messages in messages are moved into the system prompt.
+
+        Parameters:
+        system_prompt (str): The system prompt, used when messages is empty.
+        prompt (str): The user prompt, used when messages is empty.
+        messages (list): OpenAI-style messages, which may include system messages.
+        json_output (bool): Require the response to be valid JSON. Anthropic has no JSON mode,
+            so the response is checked instead.
+        usage (dict): If given, token usage including prompt cache reads and writes is added to it.
+
+        Returns:
+        str: The response text, or a generator of its deltas when streaming.
+        """
+        if not messages:
+            messages = [{"role": "user", "content": prompt}]
+        else:
+            system_prompt = "\n\n".join([message["content"] for message in messages if message["role"] == "system"] + ([system_prompt] if system_prompt else []))
+            messages = [message for message in messages if message["role"] != "system"]
+
+        content = self.submit(messages, system_prompt, model, temperature, top_p, max_tokens, use_cache=use_cache, stream=stream, usage=usage)
+
+        if json_output and not stream:
+            try:
+                json.loads(content)
+            except JSONDecodeError:
+                raise ValueError(f"Failed to get a valid JSON response. Last response: {content}")
+
+        return content
+
+    @staticmethod
+    def _read_usage(response_usage):
+        if response_usage is None:
+            return None
+
+        return {
+            "input_tokens": response_usage.input_tokens or 0,
+            "output_tokens": response_usage.output_tokens or 0,
+            "cache_read_tokens": getattr(response_usage, "cache_read_input_tokens", None) or 0,
+            "cache_write_tokens": getattr(response_usage, "cache_creation_input_tokens", None) or 0,
+        }
+
+    @staticmethod
+    def _add_usage(usage, response_usage):
+        if usage is None or response_usage is None:
+            return
+        for key, value in response_usage.items():
+            usage[key] = usage.get(key, 0) + value
+
+    def _cache_breakpoints(self, settings):
+        """
+        Marks the system prompt and the last user turns with cache_control breakpoints. A
+        conversation that grows by appending turns then reads its earlier prefix from the cache
+        on every request, and writes only the new turns.
+
+        Parameters:
+        settings (dict): Request settings, whose system and messages are replaced with marked copies.
+        """
+        breakpoints = self.MAX_CACHE_BREAKPOINTS
+
+        if settings["system"]:
+            settings["system"] = [{"type": "text", "text": settings["system"], "cache_control": {"type": "ephemeral"}}]
+            breakpoints -= 1
+
+        # The newest user turn is written to the cache; the one before is where this request reads from
+        messages = [dict(message) for message in settings["messages"]]
+        user_indices = [index for index, message in enumerate(messages) if message["role"] == "user"]
+
+        for index in user_indices[-min(2, breakpoints):] if breakpoints > 0 else []:
+            content = messages[index]["content"]
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}]
+            else:
+                content = [dict(part) for part in content]
+
+            if content:
+                content[-1]["cache_control"] = {"type": "ephemeral"}
+            messages[index]["content"] = content
+
+        settings["messages"] = messages
+
+    def _prepare(self, messages, system_prompt="", model=None, temperature=0.2, top_p=None, max_tokens=None, cache_prompt=False):
+        # Validates a request and returns its prompt token count and settings
+
+        # Input validation
+        if temperature < 0 or temperature > 1:
+            raise ValueError("Temperature must be between 0 and 1")
+        if top_p is not None and (top_p < 0 or top_p > 1):
+            raise ValueError("Top_p must be between 0 and 1")
+        if max_tokens is not None and max_tokens <= 0:
+            raise ValueError("Max_tokens must be positive")
+
+        # Calculate the total number of tokens
+        total_tokens = self.count_tokens(messages)
+
+        if total_tokens > (self.max_context_tokens - self.max_output_tokens):
+            raise ValueError(f"The total token count ({total_tokens}) exceeds the allowed limit ({self.max_context_tokens}). This takes into account the maximum output token count: {self.max_output_tokens}.")
+
+        # Define settings for the request
+        settings = {
+            "model": model if model else self.default_model,
+            "max_tokens": max_tokens if max_tokens else self.max_output_tokens,
+            "temperature": temperature,
+            "system": system_prompt,
+            "messages": messages
+        }
+
+        if top_p is not None:
+            settings["top_p"] = top_p
+
+        if cache_prompt:
+            self._cache_breakpoints(settings)
+
+        return total_tokens, settings
+
+    def _submit_stream(self, messages, system_prompt="", model=None, temperature=0.2, top_p=None, max_tokens=None, use_cache=True, cache_prompt=False, usage=None):
+        """Generator behind submit(stream=True), yielding text deltas as they arrive."""
+
+        cache_key = self._cache_key(messages, system_prompt, model, temperature, top_p, max_tokens, use_cache)
+        if cache_key is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                yield content
+                return
+
+        total_tokens, settings = self._prepare(messages, system_prompt, model, temperature, top_p, max_tokens, cache_prompt)
+
+        limiter = self._get_rate_limiter(settings["model"])
+        call = self.telemetry.start("anthropic", settings["model"])
+
+        @self.retry_decorator()
+        def _open():
+            # Wait for quota, then open the stream; deltas already yielded can't be retried
+            call.attempt()
+            reservation = limiter.acquire(total_tokens + settings["max_tokens"]) if limiter else None
+            try:
+                return self.client.messages.create(stream=True, **settings), reservation
+            except anthropic.APITimeoutError:
+                raise AnthropicAPIError("Request timed out")
+            except anthropic.APIError as e:
+                raise AnthropicAPIError(f"API Error: {str(e)}")
+
+        try:
+            stream, reservation = _open()
+        except Exception as error:
+            call.finish(error=error)
+            raise
+
+        parts = []
+        response_usage = None
+        try:
+            for event in stream:
+                if event.type == "message_start":
+                    response_usage = self._read_usage(event.message.usage)
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    call.token()
+                    parts.append(event.delta.text)
+                    yield event.delta.text
+                elif event.type == "message_delta" and response_usage is not None:
+                    response_usage["output_tokens"] = event.usage.output_tokens
+        except anthropic.APITimeoutError as error:
+            call.finish(response_usage, error=error)
+            raise AnthropicAPIError("Request timed out")
+        except anthropic.APIError as e:
+            call.finish(response_usage, error=e)
+            raise AnthropicAPIError(f"API Error: {str(e)}")
+        finally:
+            stream.close()
+            call.finish(response_usage)
+
+        # Correct the estimate with the actual usage
+        if limiter and response_usage is not None:
+            limiter.reconcile(reservation, sum(response_usage.values()))
+        self._add_usage(usage, response_usage)
+
+        if cache_key is not None:
+            self.cache.set(cache_key, "".join(parts))
+
+    def close(self):
+        """Closes the client's pooled connections."""
+        self.client.close()
+
+    def _get_rate_limiter(self, model):
+        """
+        Return the shared rate limiter for a model, or None if it has no limits.
+
+        Parameters:
+        model (str): The model name.
+
+        Returns:
+        RateLimiter: The limiter shared by every handler for this model.
+        """
+        limits = self.rate_limits.get(model, {})
+        return get_rate_limiter(
+            "anthropic",
+            model,
+            limits.get("requests_per_minute", self.requests_per_minute),
+            limits.get("tokens_per_minute", self.tokens_per_minute)
+        )
 
     def count_tokens(self, messages):
         """
-        Count the total number of tokens in multiple messages, considering both text and images.
+        Estimate the total number of tokens in multiple messages, considering both text and images.
+        Text is counted locally in one cached batch, and image sizes are read from their headers,
+        so no API call or image decode is made.
         
         Parameters:
         messages (list): A list of message dictionaries to count tokens for.
 
         Returns:
-        int: The total token count across all messages.
+        int: The estimated total token count across all messages.
         """
 
         def calculate_image_tokens(width, height):
@@ -160,37 +448,32 @@ class AnthropicHandler:
             pixels = width * height
             return int(pixels / 750)  # Approximate token count for images
 
-        def count_content_tokens(content):
-            """Count tokens in the content of a single message."""
+        texts = []
+        image_tokens = 0
+
+        for message in messages:
+            # Count tokens for the role
+            texts.append(message.get("role", ""))
+
+            # Count tokens for the content
+            content = message.get("content", [])
             if not content:
-                return 0
+                continue
 
-            total = 0
             if isinstance(content, list):
                 for part in content:
                     if part.get("type") == "text":
-                        total += self.client.count_tokens(part["text"])
+                        texts.append(part["text"])
                     elif part.get("type") == "image":
-                        image_data = base64.b64decode(part["source"]["data"])
-                        img = Image.open(BytesIO(image_data))
-                        total += calculate_image_tokens(img.width, img.height)
+                        image_tokens += calculate_image_tokens(*image_dimensions(part["source"]["data"]))
             elif isinstance(content, str):
-                total += self.client.count_tokens(content)
+                texts.append(content)
             else:
                 raise ValueError("Unexpected content type in message")
 
-            return total
-
-        total_tokens = 0
-        for message in messages:
-            # Count tokens for the role
-            total_tokens += self.client.count_tokens(message.get("role", ""))
-            
-            # Count tokens for the content
-            content = message.get("content", [])
-            total_tokens += count_content_tokens(content)
+        text_tokens = sum(count_tokens_batch(texts, self.default_model))
 
-        return total_tokens
+        return int(text_tokens * self.token_ratio + 0.5) + image_tokens
 
     def construct_message(self, prompt, base64_images=None):
         """
@@ -198,7 +481,7 @@ class AnthropicHandler:
 
         Parameters:
         prompt (str): The text prompt to include in the message.
-        base64_images (list): A list of base64-encoded image data strings.
+        base64_images (list): A list of base64-encoded image data strings or ImagePayloads.
 
         Returns:
         list: A list containing the constructed message.
@@ -219,22 +502,25 @@ class AnthropicHandler:
         # Validate base64_images input
         if base64_images is not None:
             if not isinstance(base64_images, list):
-                raise InvalidImageInputError("base64_images must be a list of strings.")
+                raise InvalidImageInputError("base64_images must be a list of strings or ImagePayloads.")
             
             if len(base64_images) > self.max_images:
                 raise TooManyImagesError(f"Too many images provided. Maximum allowed is {self.max_images}.")
 
             # Add images
             for base64_image in base64_images:
-                if not isinstance(base64_image, str):
-                    raise InvalidImageInputError("Each image in base64_images must be a string.")
+                if not isinstance(base64_image, (str, ImagePayload)):
+                    raise InvalidImageInputError("Each image in base64_images must be a string or an ImagePayload.")
+
+                # Label the image with its actual format
+                image = as_image_payload(base64_image)
                 
                 content.append({
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": base64_image
+                        "media_type": image.media_type,
+                        "data": image.base64
                     }
                 })
 
@@ -0,0 +1,249 @@
+import os
+import json
+import base64
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Setting LLM_CACHE_PATH enables the on-disk response cache for every handler
+DEFAULT_VALUES = {
+    "LLM_CACHE_PATH": None,
+    "LLM_CACHE_MAX_BYTES": 1 << 30,
+    "LLM_CACHE_TTL": 0,
+}
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+class MemoryCacheBackend:
+    """In-process LRU backend, bounded by the total size of the stored responses."""
+
+    def __init__(self, max_bytes=None, ttl=None):
+        self.max_bytes = max_bytes or int(_env("LLM_CACHE_MAX_BYTES"))
+        self.ttl = ttl if ttl is not None else float(_env("LLM_CACHE_TTL"))
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, size, created = entry
+            if self.ttl and time.time() - created > self.ttl:
+                self._size -= size
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+
+            size = len(value.encode("utf-8"))
+            self._entries[key] = (value, size, time.time())
+            self._size += size
+
+            # Evict least recently used entries
+            while self._size > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def info(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk backend in a single SQLite file, shared safely between threads and processes.
+    Entries are evicted least recently used first once the stored responses exceed max_bytes.
+    """
+
+    def __init__(self, path=None, max_bytes=None, ttl=None):
+        self.path = path or _env("LLM_CACHE_PATH")
+        if not self.path:
+            raise ValueError("No path provided for the SQLite response cache")
+
+        self.max_bytes = max_bytes or int(_env("LLM_CACHE_MAX_BYTES"))
+        self.ttl = ttl if ttl is not None else float(_env("LLM_CACHE_TTL"))
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+
+                # Expired entries go first, then the least recently used until we fit
+                if self.ttl:
+                    self._connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+
+                total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    evict = []
+                    for row_key, row_size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((row_key,))
+                        total -= row_size
+                    self._connection.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+    def info(self):
+        with self._lock:
+            entries, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes, "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of completions. The key is a hash of everything that determines
+    the response: provider, model, messages and sampling settings.
+
+    Args:
+        backend (optional): Any object with get(key), set(key, value), clear() and info().
+            Defaults to a SQLiteCacheBackend at LLM_CACHE_PATH.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or SQLiteCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Returns a SQLite backed cache when LLM_CACHE_PATH is set, otherwise None."""
+        if not _env("LLM_CACHE_PATH"):
+            return None
+        return cls()
+
+    @staticmethod
+    def key(provider, model, messages, temperature=None, top_p=None, json_output=False, max_tokens=None, **extra):
+        payload = {
+            "provider": provider,
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "json_output": bool(json_output),
+            "max_tokens": max_tokens,
+        }
+        payload.update(extra)
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(encoded.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if value is None:
+            return
+        self.backend.set(key, value)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        info = self.backend.info()
+        with self._lock:
+            info.update({"hits": self.hits, "misses": self.misses})
+        return info
+
+
+class EmbeddingCache(ResponseCache):
+    """
+    Cache of embedding vectors keyed by provider, model and a hash of the text. Vectors are
+    stored as float32 bytes in the same backends as responses.
+    """
+
+    @staticmethod
+    def key(provider, model, text):
+        encoded = json.dumps(["embedding", provider, model, text], ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, key):
+        value = super().get(key)
+        if value is None:
+            return None
+        return np.frombuffer(base64.b64decode(value), dtype=np.float32)
+
+    def set(self, key, vector):
+        if vector is None:
+            return
+        super().set(key, base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii"))
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+try:
+    from ..modules.text import match_file_mode
+except ImportError:
+    try:
+        from ParchmentProphet.modules.text import match_file_mode
+    except ImportError:
+        from modules.text import match_file_mode
+
+# Journals for jobs without an output file (e.g. summaries) are kept here. They hold the
+# job's outputs, so the default is in the user's own cache directory
+DEFAULT_VALUES = {
+    "LLM_CHECKPOINT_DIR": os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "parchmentprophet", "checkpoints"),
+}
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+def job_key(file_path=None, data=None, **settings):
+    """
+    Hashes a job's input and everything that shapes its output, so a journal is only
+    resumed by an identical job.
+
+    Args:
+        file_path (str, optional): The input file, hashed by content.
+        data (str, optional): The input text, when there is no file.
+        **settings: Prompts, model and chunking settings of the job.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+
+    if file_path is not None:
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    elif data is not None:
+        digest.update(data.encode("utf-8", "surrogatepass"))
+
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CheckpointJournal:
+    """
+    Append-only JSONL record of the completed steps of a long job, so a re-run resumes after
+    the last one instead of starting again.
+
+    Each record is flushed and fsynced as it is written. A record cut short by a crash is
+    ignored on load, so the journal never holds a partial step.
+
+    Journals hold full model outputs, so they are only readable by their owner, as is a
+    directory created for them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    @classmethod
+    def for_job(cls, name, key, directory=None):
+        """Returns the journal for a job, named by its kind and key, in directory or LLM_CHECKPOINT_DIR."""
+        return cls(os.path.join(directory or _env("LLM_CHECKPOINT_DIR"), f"{name}.{key[:32]}.checkpoint"))
+
+    def load(self):
+        """Returns every complete record, in the order they were written."""
+        records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "a", encoding="utf-8") as file:
+            # Drop a record left incomplete by a crash, so the new one starts on its own line
+            if file.tell() and not self._ends_with_newline():
+                self._truncate_partial()
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def _truncate_partial(self):
+        with open(self.path, "rb+") as file:
+            data = file.read()
+            file.truncate(data.rfind(b"\n") + 1)
+
+    def outputs(self):
+        """Returns the recorded outputs, keyed by the tuple each was recorded under."""
+        return {tuple(record["key"]): record["output"] for record in self.load()}
+
+    def record(self, key, output):
+        """Records the output of the step identified by key, a tuple of JSON-safe values."""
+        self.append({"key": list(key), "output": output})
+
+    def complete(self):
+        """Removes the journal once the job has finished."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def atomic_write(output_path):
+    """
+    Writes through a temporary file beside output_path, which replaces it only once the block
+    finishes without error, so output_path never holds a partial result. The result keeps the
+    permissions of the file it replaces, or gets those of a new file.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    file = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, prefix=".", suffix=".partial", delete=False)
+
+    try:
+        with file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        match_file_mode(file.name, output_path)
+        os.replace(file.name, output_path)
+    except BaseException:
+        try:
+            os.remove(file.name)
+        except FileNotFoundError:
+            pass
+        raise
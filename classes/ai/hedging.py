@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Hedging is opt-in: pass a HedgePolicy to the handler, or set LLM_HEDGE
+DEFAULT_VALUES = {
+    "LLM_HEDGE": "false",
+    "LLM_HEDGE_PERCENTILE": 0.95,
+    "LLM_HEDGE_MIN_SAMPLES": 20,
+    "LLM_HEDGE_INITIAL_DELAY": 30,
+    "LLM_HEDGE_MIN_DELAY": 2,
+    "LLM_HEDGE_MAX_DELAY": 120,
+    "LLM_HEDGE_WINDOW": 200,
+    "LLM_HEDGE_FALLBACK_PROVIDER": "",
+    "LLM_HEDGE_FALLBACK_MODEL": "",
+}
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+# Handlers without an async method run here rather than on the event loop's default executor,
+# which asyncio.run waits for on exit, so an abandoned request doesn't hold up the winner
+_sync_executor = ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+
+
+def hedging_enabled():
+    return str(_env("LLM_HEDGE")).lower() in ("1", "true", "yes")
+
+
+class HedgePolicy:
+    """
+    Hedged requests for tail latency. A call that hasn't answered by the threshold, the given
+    percentile of recent latencies for its model, gets a duplicate request: to the same handler,
+    or to a fallback provider or model. The first success wins and the other is cancelled.
+
+    With a fallback, a call that fails outright (after its own retries) is also failed over to it.
+
+    Until min_samples latencies have been seen for a model, initial_delay is used instead. The
+    threshold is kept within min_delay and max_delay, so a burst of fast calls can't make every
+    call hedge. Counters are kept for monitoring and reported by info().
+    """
+
+    def __init__(self, percentile=None, fallback=None, min_samples=None, initial_delay=None, min_delay=None, max_delay=None, window=None):
+        """
+        Args:
+            percentile (float, optional): Latency quantile after which to hedge, e.g. 0.95.
+            fallback (optional): Where duplicates go. None sends them to the same handler and
+                model. A dict of {"ai_provider": ..., "model": ..., **config} loads a handler with
+                AIHandler.load(ai_provider, **config) and requests model from it; a handler
+                instance (e.g. a local stand-in) is used directly. Defaults to
+                LLM_HEDGE_FALLBACK_PROVIDER and LLM_HEDGE_FALLBACK_MODEL, if set.
+            min_samples (int, optional): Latencies needed before the percentile is trusted.
+            initial_delay (float, optional): Threshold in seconds until then.
+            min_delay (float, optional): Lowest threshold in seconds.
+            max_delay (float, optional): Highest threshold in seconds.
+            window (int, optional): Recent latencies kept per model.
+        """
+        self.percentile = percentile or float(_env("LLM_HEDGE_PERCENTILE"))
+        self.min_samples = min_samples or int(_env("LLM_HEDGE_MIN_SAMPLES"))
+        self.initial_delay = initial_delay if initial_delay is not None else float(_env("LLM_HEDGE_INITIAL_DELAY"))
+        self.min_delay = min_delay if min_delay is not None else float(_env("LLM_HEDGE_MIN_DELAY"))
+        self.max_delay = max_delay if max_delay is not None else float(_env("LLM_HEDGE_MAX_DELAY"))
+        self.window = window or int(_env("LLM_HEDGE_WINDOW"))
+
+        if fallback is None and _env("LLM_HEDGE_FALLBACK_PROVIDER"):
+            fallback = {"ai_provider": _env("LLM_HEDGE_FALLBACK_PROVIDER"), "model": _env("LLM_HEDGE_FALLBACK_MODEL") or None}
+        self.fallback = fallback
+        self._fallback_handler = None
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.hedges = 0
+            self.hedge_wins = 0
+            self.failovers = 0
+
+    def observe(self, model, latency):
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def delay(self, model):
+        """Seconds to wait for a call to model before hedging it."""
+        with self._lock:
+            latencies = sorted(self._latencies.get(model, ()))
+
+        if len(latencies) < self.min_samples:
+            threshold = self.initial_delay
+        else:
+            threshold = latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+
+        return min(self.max_delay, max(self.min_delay, threshold))
+
+    def fallback_target(self, handler, request):
+        """
+        Returns (handler, request) for the duplicate of request, or the primary handler and
+        request if the fallback can't take the request (e.g. an image sent to a handler without
+        image support). A fallback of another provider without a model of its own is sent the
+        request without one, so it uses its default model.
+        """
+        fallback = self.fallback
+        if fallback is None:
+            return handler, request
+
+        if isinstance(fallback, dict):
+            if self._fallback_handler is None:
+                try:
+                    from ..ai_handler import AIHandler
+                except ImportError:
+                    from classes.ai_handler import AIHandler
+
+                config = {key: value for key, value in fallback.items() if key not in ("ai_provider", "model")}
+                self._fallback_handler = AIHandler.load(fallback.get("ai_provider", "openai"), **config)
+            target = self._fallback_handler
+            model = fallback.get("model")
+        else:
+            target = fallback
+            model = None
+
+        # Keep only the arguments the fallback accepts, giving up on it if one that matters is dropped
+        parameters = inspect.signature(target.request_completion).parameters
+        fallback_request = {key: value for key, value in request.items() if key in parameters}
+        if any(value is not None for key, value in request.items() if key not in parameters):
+            return handler, request
+
+        if model:
+            fallback_request["model"] = model
+        elif type(target) is not type(handler):
+            # The request's model belongs to another provider, so use the fallback's default
+            fallback_request.pop("model", None)
+        return target, fallback_request
+
+    async def run(self, primary, backup, model, failover=False):
+        """
+        Awaits primary(), and backup() as well if primary takes longer than delay(model).
+
+        Args:
+            primary (callable): Returns the awaitable of the original request.
+            backup (callable): Returns the awaitable of the duplicate request.
+            model (str): The primary's model, whose latencies set the threshold.
+            failover (bool, optional): Call backup if primary fails before it is hedged.
+
+        Returns:
+            The first successful result. The other request is cancelled.
+        """
+        with self._lock:
+            self.calls += 1
+
+        started = time.monotonic()
+        first = asyncio.ensure_future(primary())
+        second = None
+
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.delay(model))
+
+            if first in done:
+                if first.exception() is None:
+                    self.observe(model, time.monotonic() - started)
+                    return first.result()
+                if not failover:
+                    return first.result()
+
+                with self._lock:
+                    self.failovers += 1
+                return await backup()
+
+            with self._lock:
+                self.hedges += 1
+            second = asyncio.ensure_future(backup())
+
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                if first in done and first.exception() is None:
+                    self.observe(model, time.monotonic() - started)
+
+                for task in (first, second):
+                    if task in done and task.exception() is None:
+                        if task is second:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+
+            # Both failed, so report the original request's error
+            return first.result()
+
+        finally:
+            losers = [task for task in (first, second) if task is not None and not task.done()]
+            if first in losers:
+                # Cut short, so its latency is at least this long
+                self.observe(model, time.monotonic() - started)
+
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    def info(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+            }
+
+
+def completion_coroutine(handler, request):
+    """
+    Returns a coroutine completing request with handler: its async method when it has one,
+    otherwise its sync method on a worker thread, which runs to the end if cancelled but whose
+    result is discarded.
+    Hedging is turned off for the request, so a hedge is never hedged again.
+    """
+    if hasattr(handler, "request_completion_async"):
+        method = handler.request_completion_async
+        if "hedge" in inspect.signature(method).parameters:
+            request = {**request, "hedge": False}
+        return method(**request)
+
+    if "hedge" in inspect.signature(handler.request_completion).parameters:
+        request = {**request, "hedge": False}
+    return _run_in_thread(handler.request_completion, request)
+
+
+async def _run_in_thread(fn, kwargs):
+    # In a copy of this context, so the call keeps its telemetry tags
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_sync_executor, functools.partial(context.run, fn, **kwargs))
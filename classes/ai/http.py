@@ -0,0 +1,54 @@
+import os
+import importlib.util
+import httpx
+
+# Connection pool settings shared by every provider client
+DEFAULT_VALUES = {
+    "LLM_HTTP_MAX_CONNECTIONS": 100,
+    "LLM_HTTP_MAX_KEEPALIVE": 20,
+    "LLM_HTTP_KEEPALIVE_EXPIRY": 30,
+    "LLM_HTTP_CONNECT_TIMEOUT": 5,
+    "LLM_HTTP2": "auto",
+}
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+def http2_enabled():
+    """HTTP/2 is used when LLM_HTTP2 allows it and the optional h2 package is installed."""
+    setting = str(_env("LLM_HTTP2")).lower()
+    if setting in ("0", "false", "no"):
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def pool_limits(max_connections=None, max_keepalive=None, keepalive_expiry=None):
+    return httpx.Limits(
+        max_connections=max_connections or int(_env("LLM_HTTP_MAX_CONNECTIONS")),
+        max_keepalive_connections=max_keepalive or int(_env("LLM_HTTP_MAX_KEEPALIVE")),
+        keepalive_expiry=keepalive_expiry or float(_env("LLM_HTTP_KEEPALIVE_EXPIRY"))
+    )
+
+
+def create_http_client(timeout=600, is_async=False, **limits):
+    """
+    Builds an httpx client with a bounded keep-alive pool, for an API client to share across
+    every request it makes.
+
+    Args:
+        timeout (float, optional): Read timeout in seconds. Defaults to 600.
+        is_async (bool, optional): Build an httpx.AsyncClient. Defaults to False.
+        **limits: max_connections, max_keepalive and keepalive_expiry, overriding the
+            LLM_HTTP_* environment settings.
+
+    Returns:
+        httpx.Client or httpx.AsyncClient: The pooled client.
+    """
+    client_class = httpx.AsyncClient if is_async else httpx.Client
+    return client_class(
+        limits=pool_limits(**limits),
+        timeout=httpx.Timeout(timeout, connect=float(_env("LLM_HTTP_CONNECT_TIMEOUT"))),
+        http2=http2_enabled()
+    )
@@ -1,14 +1,17 @@
 import os
-from openai import OpenAI
-import tiktoken
+import openai
+import numpy as np
+from openai import OpenAI, AsyncOpenAI
 import json
 from json.decoder import JSONDecodeError
 from pdf2image import convert_from_path
-from PIL import Image
 import io
-import base64
-from io import BytesIO
 import time
+import asyncio
+import itertools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Import text functions
@@ -16,20 +19,47 @@ try:
     # Try relative imports for deployment
     from ..modules.text import *
     from ..modules.markdown import *
+    from ..modules.tokenizer import count_tokens_batch
+    from ..modules.images import as_image_payload
 except ImportError:
     try:
         # Fallback to absolute imports with project name for structured imports
         from ParchmentProphet.modules.text import *
         from ParchmentProphet.modules.markdown import *
+        from ParchmentProphet.modules.tokenizer import count_tokens_batch
+        from ParchmentProphet.modules.images import as_image_payload
     except ImportError:
         # Fallback to simple absolute imports for local testing
         from modules.text import *
         from modules.markdown import *
+        from modules.tokenizer import count_tokens_batch
+        from modules.images import as_image_payload
+
+from .cache import ResponseCache, EmbeddingCache
+from .rate_limit import get_rate_limiter
+from .retry import RetryPolicy
+from .http import create_http_client
+from .checkpoint import CheckpointJournal, job_key, atomic_write
+from .telemetry import get_telemetry
+from .hedging import HedgePolicy, hedging_enabled, completion_coroutine
+
+
+def retry_reason(error):
+    # Rate limits, timeouts, dropped connections and 5xx are transient; everything else is final
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection"
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return "server_error"
+    return None
 
 
 class OpenAIHandler:
     
-    def __init__(self, api_key=None, max_output_tokens=None, max_context_tokens=None, default_model=None):
+    def __init__(self, api_key=None, max_output_tokens=None, max_context_tokens=None, default_model=None, max_concurrency=None, cache=None, rate_limits=None, retry_policy=None, client=None, embedding_cache=None, telemetry=None, hedge_policy=None, async_client=None):
         # This constructor initializes the AIHandler.
 
         # Instantiate variables
@@ -45,8 +75,47 @@ class OpenAIHandler:
             "gpt-4o-2024-08-06"
         ]
 
-        # Initialize the OpenAI
-        self.client = OpenAI(api_key=self.api_key)
+        # Maximum concurrent requests made by the async methods
+        self.max_concurrency = max_concurrency or int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+
+        # Retries of rate limits, timeouts and 5xx; the SDK's own retries are disabled so this
+        # policy alone decides. Configured by LLM_RETRY_ATTEMPTS, _BASE_DELAY, _MAX_DELAY and _DEADLINE
+        self.retry_policy = retry_policy or RetryPolicy(retry_reason)
+
+        # Initialize the OpenAI, unless a client (e.g. one pointed at a local stand-in) is given.
+        # Its pooled connections are kept alive between requests
+        self.client = client or OpenAI(api_key=self.api_key, max_retries=0, http_client=create_http_client())
+
+        # The async client is created on first use, per event loop, so a handler shared
+        # between threads gives each thread's loop its own, unless one (e.g. a local stand-in) is given
+        self._async_client = async_client
+        self._async_state = {}
+        self._async_lock = threading.Lock()
+
+        # Sync hedged requests share one event loop on a background thread, started on first
+        # use, so they reuse one async client and its connections
+        self._hedge_loop = None
+        self._hedge_thread = None
+
+        # Response cache, enabled by passing one in or by setting LLM_CACHE_PATH
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache.from_env()
+
+        # Per-call latency, token usage and cost, shared process-wide unless one is given
+        self.telemetry = telemetry or get_telemetry()
+
+        # Opt-in hedging of slow completions, by passing a HedgePolicy or setting LLM_HEDGE
+        self.hedge_policy = hedge_policy or (HedgePolicy() if hedging_enabled() else None)
+
+        # Embedding requests are split to stay within the endpoint's per-request limits
+        self.embedding_batch_size = int(os.getenv("OPENAI_EMBEDDING_BATCH_SIZE", 2048))
+        self.embedding_batch_tokens = int(os.getenv("OPENAI_EMBEDDING_BATCH_TOKENS", 250000))
+
+        # Client-side quotas, shared by every handler in the process. rate_limits maps a model to
+        # {"requests_per_minute": ..., "tokens_per_minute": ...}; the env limits apply to other models
+        self.rate_limits = rate_limits or {}
+        self.requests_per_minute = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 0))
+        self.tokens_per_minute = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 0))
 
     def get_max_output_tokens(self):
         return self.max_output_tokens
@@ -55,16 +124,7 @@ class OpenAIHandler:
         return self.max_context_tokens
 
     
-    def request_completion(self, system_prompt="", prompt="", model=None, messages = [], temperature=0.2, top_p=None, max_tokens=None, json_output=False, image=None):
-
-        def get_image_dimensions(image_base64):
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(BytesIO(image_data))
-            return image.width, image.height
-
-        ####################################################################
-        # Construct the messages object
-        ####################################################################
+    def _build_messages(self, system_prompt="", prompt="", messages=[], image=None):
 
         # If messages are blank
         if messages == [] and image == None:
@@ -91,49 +151,38 @@ class OpenAIHandler:
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}}
+                        {"type": "image_url", "image_url": {"url": image.data_url}}
                     ]
                 },
             ]
 
         # Else, messages are passed directly in
+        return messages
 
-        ####################################################################
-        # Calculate the total number of tokens in all messages
-        ####################################################################
+    def _check_token_limit(self, messages, model=None, image=None):
 
-        # Load the tokenizer for the specified model
-        enc = tiktoken.encoding_for_model(model if model else self.default_model)
-        
-        def count_tokens(message_content):
-            if isinstance(message_content, list):
-                return sum(len(enc.encode(part["text"])) if part["type"] == "text" else 0 for part in message_content)
+        # Collect the text of every message part
+        message_texts = []
+        for message in messages:
+            if isinstance(message["content"], list):
+                message_texts.extend(part["text"] for part in message["content"] if part["type"] == "text")
             else:
-                return len(enc.encode(message_content))
+                message_texts.append(message["content"])
 
-        # Calculate the total number of tokens in all messages
-        total_tokens = sum(count_tokens(message["content"]) for message in messages)
+        # Count all parts in one batch; repeated parts such as system prompts come from the cache
+        total_tokens = sum(count_tokens_batch(message_texts, model if model else self.default_model))
 
-        # Add the tokens for the image if present
+        # Add the tokens for the image if present, from the dimensions the payload already holds
         if image is not None:
-            image_width, image_height = get_image_dimensions(image)
-
-            if image_width <= 512 and image_height <= 512:
-                total_tokens += 85
-            else:
-                # Calculate number of 512x512 tiles
-                tiles_x = (image_width + 511) // 512  # ceiling division
-                tiles_y = (image_height + 511) // 512  # ceiling division
-                total_tiles = tiles_x * tiles_y
-                total_tokens += 85 + (170 * total_tiles)
+            total_tokens += image.openai_tokens()
 
         # Check if the total tokens exceed the allowed context tokens minus max output tokens
         if total_tokens > (self.max_context_tokens - self.max_output_tokens):
             raise ValueError(f"The total token count of all messages ({total_tokens}) exceeds the allowed limit ({self.max_context_tokens}). This takes into account the maximum output token count: {self.max_output_tokens}.")
-        
-        ####################################################################
-        # Define settings for the request
-        ####################################################################
+
+        return total_tokens
+
+    def _completion_settings(self, model=None, temperature=0.2, top_p=None, max_tokens=None, json_output=False):
 
         settings = {
             "model": model if model else self.default_model,
@@ -147,42 +196,627 @@ class OpenAIHandler:
         if json_output:
             settings["response_format"] = {"type": "json_object"}
 
-        # Make the request
-        response = self.client.chat.completions.create(messages=messages, **settings)
+        return settings
+
+    def _read_response(self, response, attempt=1):
 
         # Check if the output was truncated due to length
         if response.choices[0].finish_reason == "length":
+            if attempt > 1:
+                raise ValueError("The model's output was truncated due to length constraints on the second attempt.")
             raise ValueError("The model's output was truncated due to length constraints. Consider increasing max_tokens or simplifying your request.")
 
-        content = sanitise_text(response.choices[0].message.content)
+        return sanitise_text(response.choices[0].message.content)
+
+    def _get_rate_limiter(self, model):
+        limits = self.rate_limits.get(model, {})
+        return get_rate_limiter(
+            "openai",
+            model,
+            limits.get("requests_per_minute", self.requests_per_minute),
+            limits.get("tokens_per_minute", self.tokens_per_minute)
+        )
+
+    @staticmethod
+    def _usage_tokens(response):
+        usage = getattr(response, "usage", None)
+        return getattr(usage, "total_tokens", None)
+
+    @staticmethod
+    def _response_usage(response):
+        # A response's token usage, or None. Prompt caching is automatic for a prefix repeated
+        # across requests, so cached tokens are reported as cache reads
+        response_usage = getattr(response, "usage", None)
+        if response_usage is None:
+            return None
+
+        details = getattr(response_usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+        return {
+            "input_tokens": response_usage.prompt_tokens - cached_tokens,
+            "output_tokens": getattr(response_usage, "completion_tokens", None) or 0,
+            "cache_read_tokens": cached_tokens,
+            "cache_write_tokens": 0,
+        }
 
-        if json_output:
-            try:
-                json.loads(content)  # Attempt to parse the response as JSON
+    @classmethod
+    def _add_usage(cls, usage, response):
+        # Adds a response's token usage to the caller's usage dict
+        response_usage = cls._response_usage(response)
+        if usage is None or response_usage is None:
+            return
+
+        for key, value in response_usage.items():
+            usage[key] = usage.get(key, 0) + value
+
+    @staticmethod
+    def _timeout_settings(timeout):
+        # Keep a single attempt from outliving the call's retry deadline
+        return {"timeout": max(timeout, 1.0)} if timeout is not None else {}
+
+    def _create(self, messages, settings, prompt_tokens, timer=None):
+        # The call is recorded in telemetry here, unless the caller passes its own timer
+        # (e.g. a stream, whose usage only arrives at the end)
+        limiter = self._get_rate_limiter(settings["model"])
+        call = timer or self.telemetry.start("openai", settings["model"])
+
+        def attempt(timeout):
+            call.attempt()
+
+            # The cost is the prompt plus the most the model may generate, corrected by the actual usage
+            reservation = limiter.acquire(prompt_tokens + settings["max_tokens"]) if limiter else None
+
+            response = self.client.chat.completions.create(messages=messages, **settings, **self._timeout_settings(timeout))
+
+            if limiter:
+                limiter.reconcile(reservation, self._usage_tokens(response))
+            return response
+
+        try:
+            response = self.retry_policy.call(attempt)
+        except Exception as error:
+            call.finish(error=error)
+            raise
+
+        if timer is None:
+            call.finish(self._response_usage(response))
+        return response
+
+    async def _create_async(self, async_client, messages, settings, prompt_tokens):
+        limiter = self._get_rate_limiter(settings["model"])
+        call = self.telemetry.start("openai", settings["model"])
+
+        async def attempt(timeout):
+            call.attempt()
+
+            reservation = await limiter.acquire_async(prompt_tokens + settings["max_tokens"]) if limiter else None
+
+            response = await async_client.chat.completions.create(messages=messages, **settings, **self._timeout_settings(timeout))
+
+            if limiter:
+                limiter.reconcile(reservation, self._usage_tokens(response))
+            return response
+
+        try:
+            response = await self.retry_policy.call_async(attempt)
+        except BaseException as error:
+            # Including cancellation, e.g. the losing request of a hedge
+            call.finish(error=error)
+            raise
+
+        call.finish(self._response_usage(response))
+        return response
+
+    def retry_info(self):
+        """
+        Returns the retry counters for monitoring: calls made, retries taken (in total and by
+        reason, e.g. "rate_limit" or "server_error") and calls that ultimately failed.
+        """
+        return self.retry_policy.info()
+
+    def _cache_key(self, messages, settings, use_cache=True):
+        if self.cache is None or not use_cache:
+            return None
+
+        return self.cache.key(
+            "openai",
+            settings["model"],
+            messages,
+            temperature=settings["temperature"],
+            top_p=settings.get("top_p"),
+            json_output="response_format" in settings,
+            max_tokens=settings["max_tokens"]
+        )
+
+    @staticmethod
+    def _is_json(content):
+        try:
+            json.loads(content)  # Attempt to parse the response as JSON
+            return True
+        except JSONDecodeError:
+            return False
+
+    def request_completion(self, system_prompt="", prompt="", model=None, messages = [], temperature=0.2, top_p=None, max_tokens=None, json_output=False, image=None, use_cache=True, stream=False, usage=None, hedge=None):
+
+        # With a hedge policy, a slow request is duplicated and the first answer wins (not for streams).
+        # hedge=False opts a call out
+        hedged = hedge is not False and self.hedge_policy is not None and not stream
+        if hedged:
+            request = {"system_prompt": system_prompt, "prompt": prompt, "model": model, "messages": messages, "temperature": temperature, "top_p": top_p,
+                       "max_tokens": max_tokens, "json_output": json_output, "image": image, "use_cache": use_cache, "usage": usage}
+
+        # image is an ImagePayload or a base64 string
+        image = as_image_payload(image) if image is not None else None
+        messages = self._build_messages(system_prompt, prompt, messages, image)
+        settings = self._completion_settings(model, temperature, top_p, max_tokens, json_output)
+
+        # Return a generator of text deltas instead of the whole completion
+        if stream:
+            return self._stream_completion(messages, settings, model, image, use_cache, usage)
+
+        # Identical requests are answered from the cache
+        cache_key = self._cache_key(messages, settings, use_cache)
+        if cache_key is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
                 return content
-            except JSONDecodeError:
-                # If the first attempt fails, try one more time
-                response = self.client.chat.completions.create(messages=messages, **settings)
 
-                # Check again if the output was truncated due to length
-                if response.choices[0].finish_reason == "length":
-                    raise ValueError("The model's output was truncated due to length constraints on the second attempt.")
+        # Hedged requests run on the async client, so the losing one can be cancelled
+        if hedged:
+            return self._run_on_hedge_loop(self._hedged_completion(request))
 
-                content = sanitise_text(response.choices[0].message.content)
-                
-                try:
-                    json.loads(content)  # Attempt to parse the second response as JSON
-                    return content
-                except JSONDecodeError:
-                    # If the second attempt also fails, raise an error with the details
-                    raise ValueError(f"Failed to get a valid JSON response after two attempts. Last response: {content}")
+        prompt_tokens = self._check_token_limit(messages, model, image)
+
+        # Make the request
+        response = self._create(messages, settings, prompt_tokens)
+        self._add_usage(usage, response)
+        content = self._read_response(response)
+
+        if json_output and not self._is_json(content):
+            # If the first attempt fails, try one more time
+            response = self._create(messages, settings, prompt_tokens)
+            self._add_usage(usage, response)
+            content = self._read_response(response, attempt=2)
+
+            if not self._is_json(content):
+                # If the second attempt also fails, raise an error with the details
+                raise ValueError(f"Failed to get a valid JSON response after two attempts. Last response: {content}")
+
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
         
         return content
+
+    def _stream_completion(self, messages, settings, model=None, image=None, use_cache=True, usage=None):
+        # Deltas are yielded as they arrive, so unlike request_completion an invalid JSON
+        # response can't be retried and is raised once the stream ends
+
+        cache_key = self._cache_key(messages, settings, use_cache)
+        if cache_key is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                yield content
+                return
+
+        prompt_tokens = self._check_token_limit(messages, model, image)
+
+        # Only opening the stream is retried. Usage arrives in the last chunk, after the
+        # rate limiter has settled, so the limiter keeps its estimate
+        timer = self.telemetry.start("openai", settings["model"])
+        response = self._create(messages, {**settings, "stream": True, "stream_options": {"include_usage": True}}, prompt_tokens, timer)
+
+        parts = []
+        finish_reason = None
+        tokens = None
+        try:
+            for chunk in response:
+                self._add_usage(usage, chunk)
+                tokens = self._response_usage(chunk) or tokens
+
+                if not chunk.choices:
+                    continue
+
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    timer.token()
+                    delta = sanitise_text(choice.delta.content)
+                    parts.append(delta)
+                    yield delta
+
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        except Exception as error:
+            timer.finish(tokens, error=error)
+            raise
+        finally:
+            timer.finish(tokens)
+
+        if finish_reason == "length":
+            raise ValueError("The model's output was truncated due to length constraints. Consider increasing max_tokens or simplifying your request.")
+
+        content = "".join(parts)
+        if "response_format" in settings and not self._is_json(content):
+            raise ValueError(f"Failed to get a valid JSON response. Last response: {content}")
+
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
+
+    def _get_async_state(self):
+        # AsyncOpenAI's connection pool and the semaphore are tied to the event loop they
+        # were first used on, so each loop gets its own pair
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            # Drop the clients of loops that ended without aclose(); they can't be closed any more
+            for finished in [other for other in self._async_state if other.is_closed()]:
+                del self._async_state[finished]
+
+            state = self._async_state.get(loop)
+            if state is None:
+                async_client = self._async_client or AsyncOpenAI(api_key=self.api_key, max_retries=0, http_client=create_http_client(is_async=True))
+                state = self._async_state[loop] = (async_client, asyncio.Semaphore(self.max_concurrency))
+        return state
+
+    def close(self):
+        """
+        Closes the pooled connections of the sync client, and of the async clients whose event
+        loops are still open. A client passed in as async_client is left to its owner.
+        """
+        self.client.close()
+        self._stop_hedge_loop()
+        with self._async_lock:
+            states, self._async_state = self._async_state, {}
+
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+
+        for loop, (async_client, _) in states.items():
+            if async_client is self._async_client or loop.is_closed():
+                continue
+            if loop is current:
+                # Can't wait on the loop we're running in, so leave the close to it
+                loop.create_task(async_client.close())
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(async_client.close(), loop).result()
+            else:
+                loop.run_until_complete(async_client.close())
+
+    async def aclose(self):
+        """
+        Closes the async client of the running event loop. Call it before a loop of your own
+        ends; complete_many does so for the loops it creates.
+        """
+        with self._async_lock:
+            state = self._async_state.pop(asyncio.get_running_loop(), None)
+
+        if state is not None and state[0] is not self._async_client:
+            await state[0].close()
+
+    async def request_completion_async(self, system_prompt="", prompt="", model=None, messages = [], temperature=0.2, top_p=None, max_tokens=None, json_output=False, image=None, use_cache=True, usage=None, hedge=None):
+        """
+        Asynchronous request_completion. At most max_concurrency requests are in flight at once
+        per event loop; the cache, token limit checks, JSON retry and hedging are the same as the sync version.
+        """
+        if hedge is not False and self.hedge_policy is not None:
+            return await self._hedged_completion({
+                "system_prompt": system_prompt, "prompt": prompt, "model": model, "messages": messages, "temperature": temperature, "top_p": top_p,
+                "max_tokens": max_tokens, "json_output": json_output, "image": image, "use_cache": use_cache, "usage": usage
+            })
+
+        image = as_image_payload(image) if image is not None else None
+        messages = self._build_messages(system_prompt, prompt, messages, image)
+        settings = self._completion_settings(model, temperature, top_p, max_tokens, json_output)
+
+        cache_key = self._cache_key(messages, settings, use_cache)
+        if cache_key is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                return content
+
+        prompt_tokens = self._check_token_limit(messages, model, image)
+
+        async_client, semaphore = self._get_async_state()
+
+        async with semaphore:
+            response = await self._create_async(async_client, messages, settings, prompt_tokens)
+            self._add_usage(usage, response)
+            content = self._read_response(response)
+
+            if json_output and not self._is_json(content):
+                # If the first attempt fails, try one more time
+                response = await self._create_async(async_client, messages, settings, prompt_tokens)
+                self._add_usage(usage, response)
+                content = self._read_response(response, attempt=2)
+
+                if not self._is_json(content):
+                    raise ValueError(f"Failed to get a valid JSON response after two attempts. Last response: {content}")
+
+        if cache_key is not None:
+            self.cache.set(cache_key, content)
+
+        return content
+
+    async def gather_completions(self, requests, return_exceptions=False):
+        """
+        Runs many completion requests concurrently, bounded by max_concurrency.
+
+        Args:
+            requests (list): One dict of request_completion keyword arguments per request.
+            return_exceptions (bool, optional): Return a failed request's exception in its place
+                instead of raising it. Defaults to False.
+
+        Returns:
+            list: The completions, in the same order as requests.
+        """
+        return await asyncio.gather(
+            *(self.request_completion_async(**request) for request in requests),
+            return_exceptions=return_exceptions
+        )
+
+    def complete_many(self, requests, return_exceptions=False):
+        """
+        Synchronous facade over gather_completions, for callers that aren't async.
+
+        Args:
+            requests (list): One dict of request_completion keyword arguments per request.
+            return_exceptions (bool, optional): Return a failed request's exception in its place
+                instead of raising it. Defaults to False.
+
+        Returns:
+            list: The completions, in the same order as requests.
+        """
+        if not requests:
+            return []
+
+        return self._run_sync(self.gather_completions(requests, return_exceptions=return_exceptions))
+
+    def _run_sync(self, coroutine):
+        # Runs a coroutine to completion from synchronous code, on a new event loop whose
+        # async client is closed before the loop ends
+        coroutine = self._closing(coroutine)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # Already inside an event loop (e.g. a notebook), so run ours on a separate thread,
+        # in a copy of this context so the requests keep its telemetry tags
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+    async def _closing(self, coroutine):
+        try:
+            return await coroutine
+        finally:
+            await self.aclose()
+
+    def _run_on_hedge_loop(self, coroutine):
+        # Runs a coroutine from synchronous code on the handler's background loop. The task
+        # takes a copy of this context, so the request keeps its telemetry tags
+        with self._async_lock:
+            if self._hedge_loop is None:
+                self._hedge_loop = asyncio.new_event_loop()
+                self._hedge_thread = threading.Thread(target=self._hedge_loop.run_forever, name="openai-hedge", daemon=True)
+                self._hedge_thread.start()
+            loop = self._hedge_loop
+
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def _stop_hedge_loop(self):
+        with self._async_lock:
+            loop, thread = self._hedge_loop, self._hedge_thread
+            self._hedge_loop = self._hedge_thread = None
+
+        if loop is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    async def _hedged_completion(self, request):
+        # The request is duplicated, to the policy's fallback or to this handler, once it runs
+        # past the latency threshold. A fallback also takes over if the request fails
+        policy = self.hedge_policy
+        target, backup_request = policy.fallback_target(self, request)
+
+        return await policy.run(
+            lambda: completion_coroutine(self, request),
+            lambda: completion_coroutine(target, backup_request),
+            request.get("model") or self.default_model,
+            failover=target is not self
+        )
+
+    def hedge_info(self):
+        """
+        Returns the hedging counters: calls made under the policy, hedges fired, hedges that
+        answered first and failovers. None if hedging is off.
+        """
+        return self.hedge_policy.info() if self.hedge_policy is not None else None
+
+    def run_batch(self, requests, poll_interval=None, timeout=None, completion_window="24h"):
+        """
+        Runs many completion requests as one offline batch job. The requests are written to a
+        JSONL file, uploaded and submitted together, and the job is polled until it finishes.
+        Batch jobs have their own, much larger quota, so this suits latency-insensitive bulk work.
+
+        Cached requests are answered without being submitted. Requests that fail in the batch,
+        or return invalid JSON when json_output is set, are retried once through request_completion.
+
+        The job is run through self.client's files and batches endpoints, so passing a client
+        pointed at a local stand-in (e.g. OpenAI(base_url=...)) runs it without the real API.
+
+        Args:
+            requests (list): One dict of request_completion keyword arguments per request.
+            poll_interval (float, optional): Seconds between job status checks. Defaults to
+                OPENAI_BATCH_POLL_INTERVAL or 30.
+            timeout (float, optional): Seconds to wait for the job before cancelling it. Defaults
+                to OPENAI_BATCH_TIMEOUT or 86400.
+            completion_window (str, optional): The job's completion window. Defaults to "24h".
+
+        Returns:
+            list: The completions, in the same order as requests.
+
+        Raises:
+            TimeoutError: If the job doesn't finish within timeout.
+            ValueError: If the job fails, expires or is cancelled.
+        """
+        poll_interval = poll_interval if poll_interval is not None else float(os.getenv("OPENAI_BATCH_POLL_INTERVAL", 30))
+        timeout = timeout if timeout is not None else float(os.getenv("OPENAI_BATCH_TIMEOUT", 86400))
+
+        results = [None] * len(requests)
+        pending = {}
+        lines = []
+
+        for index, request in enumerate(requests):
+            image = as_image_payload(request["image"]) if request.get("image") is not None else None
+            messages = self._build_messages(request.get("system_prompt", ""), request.get("prompt", ""), request.get("messages", []), image)
+            settings = self._completion_settings(request.get("model"), request.get("temperature", 0.2), request.get("top_p"), request.get("max_tokens"), request.get("json_output", False))
+
+            cache_key = self._cache_key(messages, settings, request.get("use_cache", True))
+            if cache_key is not None:
+                content = self.cache.get(cache_key)
+                if content is not None:
+                    results[index] = content
+                    continue
+
+            self._check_token_limit(messages, request.get("model"), image)
+
+            custom_id = f"request-{index}"
+            pending[custom_id] = (index, cache_key)
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"messages": messages, **settings}
+            }))
+
+        if not pending:
+            return results
+
+        # Submit the job
+        batch_file = self.retry_policy.call(lambda _: self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        ))
+        batch = self.retry_policy.call(lambda _: self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=completion_window
+        ))
+
+        # Wait for the job to finish
+        start_time = time.time()
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.time() - start_time > timeout:
+                message = f"Batch job {batch.id} did not complete within {timeout} seconds."
+                try:
+                    self.retry_policy.call(lambda _: self.client.batches.cancel(batch.id))
+                except Exception as cancel_error:
+                    # The job may still be running, but the timeout is what the caller needs to hear about
+                    raise TimeoutError(f"{message} Cancelling it failed: {cancel_error}") from cancel_error
+                raise TimeoutError(message)
+
+            time.sleep(poll_interval)
+            batch = self.retry_policy.call(lambda _: self.client.batches.retrieve(batch.id))
+
+        if batch.status != "completed":
+            raise ValueError(f"Batch job {batch.id} ended with status '{batch.status}'.")
+
+        # Map the output back to the requests by custom_id
+        if batch.output_file_id:
+            output = self.retry_policy.call(lambda _: self.client.files.content(batch.output_file_id))
+
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+
+                result = json.loads(line)
+                index, cache_key = pending.get(result["custom_id"], (None, None))
+                response = result.get("response") or {}
+
+                # Billed even when the output goes unused
+                body = response.get("body") or {}
+                if body.get("usage"):
+                    self._record_batch_usage(body)
+
+                if index is None or result.get("error") or response.get("status_code") != 200:
+                    continue
+
+                choice = response["body"]["choices"][0]
+                if choice["finish_reason"] == "length":
+                    continue
+
+                content = sanitise_text(choice["message"]["content"])
+                if requests[index].get("json_output") and not self._is_json(content):
+                    continue
+
+                results[index] = content
+                del pending[result["custom_id"]]
+
+                if cache_key is not None:
+                    self.cache.set(cache_key, content)
+
+        # Anything the job didn't answer is requested directly
+        for index, _ in pending.values():
+            results[index] = self.request_completion(**requests[index])
+
+        return results
     
-    def smart_transcribe(self, file_path, output_path, system_prompt_path, token_reduction=0.95, temperature=0.13, top_p=None, prompt_header="", prompt_memory_header="", prompt_structure_header=""):
+    def _record_batch_usage(self, body):
+        usage = body["usage"]
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.telemetry.record("openai", body.get("model"), "batch", {
+            "input_tokens": usage.get("prompt_tokens", 0) - cached_tokens,
+            "output_tokens": usage.get("completion_tokens", 0),
+            "cache_read_tokens": cached_tokens,
+        })
+
+    @staticmethod
+    def _checkpoint(enabled, name, directory=None, **job):
+        """Returns the journal for a job, keyed by a hash of its input and settings, or None if disabled."""
+        if not enabled:
+            return None
+        return CheckpointJournal.for_job(name, job_key(**job), directory)
+
+    def _complete_resumable(self, keys, requests, journal=None, completed=None):
+        """
+        complete_many for resumable jobs: requests whose key is in completed are not sent again,
+        and each new result is journalled as soon as the batch returns, so one failure doesn't
+        lose the requests that succeeded alongside it.
+        """
+        completed = completed if completed is not None else {}
+        results = [completed.get(key) for key in keys]
+        missing = [i for i, key in enumerate(keys) if key not in completed]
+
+        outcomes = self.complete_many([requests[i] for i in missing], return_exceptions=journal is not None)
+
+        error = None
+        for i, outcome in zip(missing, outcomes):
+            if isinstance(outcome, BaseException):
+                error = error or outcome
+                continue
+
+            results[i] = outcome
+            if journal is not None:
+                journal.record(keys[i], outcome)
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def smart_transcribe(self, file_path, output_path, system_prompt_path, token_reduction=0.95, temperature=0.13, top_p=None, prompt_header="", prompt_memory_header="", prompt_structure_header="", mode="sequential", overlap_tokens=None, checkpoint=True):
         """
         Transcribes a given text file using the AI model's capabilities.
 
+        Each chunk's transcription is journalled beside output_path as it completes, so if the
+        run fails, calling again with the same file, prompt and settings resumes after the last
+        completed chunk. output_path is only replaced once the transcription is complete.
+
         Args:
             file_path (str): The path to the input text file.
             output_path (str): The path to save the transcribed output.
@@ -192,15 +826,18 @@ class OpenAIHandler:
             top_p (float, optional): The top_p parameter for the AI model. Defaults to None.
             prompt_header (str, optional): The prompt header to be used. Defaults to an empty string.
             prompt_memory_header (str, optional): The prompt memory header to be used. Defaults to an empty string.
+            mode (str, optional): "sequential" gives each chunk the previous chunk and its
+                transcription. "parallel" transcribes chunks concurrently, each with the end of
+                the previous chunk as an overlap, and stitches the outputs where they align.
+                Defaults to "sequential".
+            overlap_tokens (int, optional): Overlap given to each chunk in parallel mode.
+                Defaults to OPENAI_TRANSCRIBE_OVERLAP_TOKENS or 200.
+            checkpoint (bool, optional): Journal progress so a failed run can resume. Defaults to True.
 
         Raises:
             Exception: If the sum of max_output_tokens and exceeds max_context_tokens.
         """
 
-        # Read the file into memory
-        with open(file_path, 'r', encoding='utf-8') as file:
-            file_contents = file.read()
-
         if prompt_header == "":
             prompt_header = "Transcribe the above text chunk as directed."
 
@@ -220,83 +857,241 @@ class OpenAIHandler:
             pass
 
 
+        if mode not in ("sequential", "parallel"):
+            raise ValueError(f"Unsupported transcription mode: {mode}")
+
         # Grab chunks of text using 95% of the output token size
         token_limit = int(self.max_output_tokens * token_reduction)
 
         system_prompt = load_prompt(system_prompt_path)
 
+        if mode == "parallel":
+            overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("OPENAI_TRANSCRIBE_OVERLAP_TOKENS", 200))
+
+        journal = self._checkpoint(
+            checkpoint, os.path.basename(output_path), os.path.dirname(os.path.abspath(output_path)),
+            file_path=file_path, system_prompt=system_prompt, model=self.default_model, token_limit=token_limit, temperature=temperature, top_p=top_p,
+            prompt_header=prompt_header, prompt_memory_header=prompt_memory_header, prompt_structure_header=prompt_structure_header, mode=mode, overlap_tokens=overlap_tokens
+        )
+
+        if mode == "parallel":
+            title_structure_memory = self._parallel_transcribe(file_path, output_path, system_prompt, token_limit, overlap_tokens, temperature, top_p, prompt_header, journal)
+            if journal is not None:
+                journal.complete()
+            return title_structure_memory
+
         # Check if the sum of max_output_tokens and chunk_memory is less than max_context_tokens
         if (self.max_output_tokens * 2) + count_tokens(prompt_header) + count_tokens(prompt_memory_header) + count_tokens(prompt_structure_header) + count_tokens(system_prompt) + 100 >= self.max_context_tokens: # 100 tokens added for generic other content
             raise Exception(f"Total context tokens exceed max available: {self.max_context_tokens}. Please reduce the token count.")
 
-        # Create or overwrite the output file
-        with open(output_path, 'w') as f:
-            pass  # File is created or cleared
-
         previous_transcription = ""
-        chunk_index = 0
-        chunks = list(chunk_large_text(file_contents, token_limit))
-        num_chunks = len(chunks)
         title_structure_memory = []
+        title_structure_memory_str = ""
 
-        # Loop through the chunks
-        for chunk in chunks:
-            if previous_transcription:
+        # Transcriptions of chunks completed by an earlier run
+        completed = journal.outputs() if journal is not None else {}
 
-                # Create message object to pass to the completion request
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"{sanitise_text(previous_chunk)}\n----\n{prompt_header}"},
-                    {"role": "assistant", "content": f"{sanitise_text(previous_transcription)}"},
-                    {"role": "user", "content": f"{sanitise_text(chunk)}\n----\n{prompt_memory_header}"}
-                ]
+        # Stream chunks from disk, looking one chunk ahead to detect the last one
+        chunks = chunk_file(file_path, token_limit)
+        chunk = next(chunks, None)
+        index = 0
 
-                # iAdd in the title structure memory if requested
-                if prompt_memory_header is not False:
-                    messages.insert(3, {"role": "user", "content": f"{title_structure_memory_str}\n----\n{prompt_structure_header}"})
+        # Only the first chunk has a prompt of its own; later ones are given as messages. A resumed
+        # run may skip the first chunk, so start with an empty prompt
+        prompt = ""
 
-            else:
-                messages = []
-                prompt = f"{sanitise_text(chunk)}\n----\n{prompt_header}"
+        # Write through one buffered handle to a temporary file, which replaces the output file when complete
+        with atomic_write(output_path) as f:
+
+            # Loop through the chunks
+            while chunk is not None:
+                next_chunk = next(chunks, None)
+
+                if (index,) in completed:
+                    result = completed[(index,)]
+
+                elif previous_transcription:
+
+                    # Create message object to pass to the completion request
+                    messages = [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"{sanitise_text(previous_chunk['content'])}\n----\n{prompt_header}"},
+                        {"role": "assistant", "content": f"{sanitise_text(previous_transcription)}"},
+                        {"role": "user", "content": f"{sanitise_text(chunk['content'])}\n----\n{prompt_memory_header}"}
+                    ]
 
-            # Get the result from the completion request
-            result = self.request_completion(system_prompt, prompt, messages=messages, temperature=temperature, top_p=top_p)
+                    # iAdd in the title structure memory if requested
+                    if prompt_memory_header is not False:
+                        messages.insert(3, {"role": "user", "content": f"{title_structure_memory_str}\n----\n{prompt_structure_header}"})
 
-            # Extract titles from the transcribed result
-            result_titles = extract_markdown_titles(result)
+                else:
+                    messages = []
+                    prompt = f"{sanitise_text(chunk['content'])}\n----\n{prompt_header}"
 
-            # Update the title structure memory
-            title_structure_memory.extend(result_titles)
-            title_structure_memory_str = "\n".join([f"- {title}" for title in title_structure_memory])
+                # Get the result from the completion request, unless an earlier run already did
+                if (index,) not in completed:
+                    result = self.request_completion(system_prompt, prompt, messages=messages, temperature=temperature, top_p=top_p)
+                    if journal is not None:
+                        journal.record((index,), result)
 
-            # Append the result to the output file
-            with open(output_path, 'a') as f:
-                if chunk_index < num_chunks - 1:
+                # Extract titles from the transcribed result
+                result_titles = extract_markdown_titles(result)
+
+                # Update the title structure memory, extending the outline with the new titles only
+                title_structure_memory.extend(result_titles)
+                if result_titles:
+                    new_titles = "\n".join([f"- {title}" for title in result_titles])
+                    title_structure_memory_str = f"{title_structure_memory_str}\n{new_titles}" if title_structure_memory_str else new_titles
+
+                # Append the result to the output file
+                if next_chunk is not None:
                     if not result.endswith("\n\n"):
                         result += "\n\n"
                 f.write(result)
 
-            previous_chunk = chunk
-            previous_transcription = result
-            chunk_index += 1
+                previous_chunk = chunk
+                previous_transcription = result
+                chunk = next_chunk
+                index += 1
+
+        if journal is not None:
+            journal.complete()
+
+        return title_structure_memory
+
+    def _parallel_transcribe(self, file_path, output_path, system_prompt, token_limit, overlap_tokens=None, temperature=0.13, top_p=None, prompt_header="", journal=None):
+        overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("OPENAI_TRANSCRIBE_OVERLAP_TOKENS", 200))
+
+        # Leave room in the output for the overlap transcribed at the start of each chunk
+        chunk_limit = token_limit - overlap_tokens
+        if chunk_limit <= 0:
+            raise ValueError(f"overlap_tokens ({overlap_tokens}) must be smaller than the chunk token limit ({token_limit}).")
+
+        # Chunks are requested a window at a time, so memory stays bounded and output is
+        # written as soon as each window is stitched
+        window = self.max_concurrency * 2
+
+        title_structure_memory = []
+        previous_content = None
+        pending = None  # The last transcription, whose end may still be replaced by the next one
+        completed = journal.outputs() if journal is not None else {}
+
+        chunks = enumerate(chunk_file(file_path, chunk_limit))
+
+        with atomic_write(output_path) as f:
+
+            def write(text):
+                title_structure_memory.extend(extract_markdown_titles(text))
+                f.write(text)
+
+            while True:
+                window_chunks = list(itertools.islice(chunks, window))
+                if not window_chunks:
+                    break
+
+                keys = []
+                requests = []
+                for index, chunk in window_chunks:
+                    content = chunk['content']
+                    if previous_content and overlap_tokens > 0:
+                        overlap = get_last_n_tokens(previous_content, overlap_tokens)
+                        if overlap:
+                            content = f"{overlap}\n{content}"
+
+                    keys.append((index,))
+                    requests.append({
+                        "system_prompt": system_prompt,
+                        "prompt": f"{sanitise_text(content)}\n----\n{prompt_header}",
+                        "temperature": temperature,
+                        "top_p": top_p
+                    })
+                    previous_content = chunk['content']
+
+                for result in self._complete_resumable(keys, requests, journal, completed):
+                    if pending is not None:
+                        stitched = stitch_overlap(pending, result)
+
+                        if stitched is None:
+                            # The outputs don't align, so keep both in full as separate blocks
+                            if not pending.endswith("\n\n"):
+                                pending += "\n\n"
+                        else:
+                            pending, result = stitched
+                            if pending and not pending.endswith("\n"):
+                                pending += "\n"
+
+                        write(pending)
+
+                    pending = result
+
+            if pending is not None:
+                write(pending)
 
         return title_structure_memory
     
     # Take a document exceeding max token limit and recursively summarise it
-    def recursive_summary(self, system_prompt, data, temperature=0.2, model=None, json_output=False):
+    # Pass file_path instead of data to stream the document from disk
+    def recursive_summary(self, system_prompt, data=None, temperature=0.2, model=None, json_output=False, file_path=None, mode="sequential", fan_in=None, checkpoint=True):
+        """
+        Summarises a document too large for one request.
+
+        "sequential" folds each chunk into the running summary in turn. "map_reduce" summarises
+        every chunk independently and concurrently, then merges the partial summaries in a tree
+        of at most fan_in summaries per request until one remains, so a document of N chunks
+        takes O(log N) rounds of requests instead of N.
+
+        Completed steps are journalled in LLM_CHECKPOINT_DIR, so if the run fails, calling again
+        with the same document, prompt and settings resumes after the last completed step.
+
+        Args:
+            mode (str, optional): "sequential" or "map_reduce". Defaults to "sequential".
+            fan_in (int, optional): Most partial summaries merged per request in map_reduce mode.
+                Defaults to OPENAI_SUMMARY_FAN_IN or 8.
+            checkpoint (bool, optional): Journal progress so a failed run can resume. Defaults to True.
+
+        Returns:
+            str: The final JSON summary.
+        """
+        if mode not in ("sequential", "map_reduce"):
+            raise ValueError(f"Unsupported summary mode: {mode}")
 
         chunk_size = self.max_context_tokens - (self.max_output_tokens * 2) # One for output, one for previous summary
-        first_iteration = True
+        model = model if model else self.default_model
+
+        if file_path is not None:
+            chunks = chunk_file(file_path, chunk_size)
+        else:
+            chunks = chunk_large_text(data, chunk_size)
+
+        if mode == "map_reduce":
+            fan_in = fan_in or int(os.getenv("OPENAI_SUMMARY_FAN_IN", 8))
 
-        for chunk in chunk_large_text(data, chunk_size):
+        journal = self._checkpoint(
+            checkpoint, "summary",
+            file_path=file_path, data=data, system_prompt=system_prompt, model=model, chunk_size=chunk_size, temperature=temperature, mode=mode, fan_in=fan_in
+        )
+
+        if mode == "map_reduce":
+            output = self._map_reduce_summary(system_prompt, chunks, temperature, model, fan_in, journal)
+            if journal is not None:
+                journal.complete()
+            return output
+
+        # Running summaries from an earlier run, resumed after the last one
+        completed = journal.outputs() if journal is not None else {}
+
+        for index, chunk in enumerate(chunks):
+
+            if (index,) in completed:
+                output = completed[(index,)]
+                continue
 
             # Construct message object
-            if first_iteration:
+            if index == 0:
                 messages = [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": chunk['content']}
                 ]
-                first_iteration = False
 
             else:
                 messages = [
@@ -305,27 +1100,153 @@ class OpenAIHandler:
                     {"role": "user", "content": f"Next document chunk\n----\n{chunk['content']}"}
                 ]
 
-            output = self.request_completion(messages=messages, temperature=temperature, model=model if model else self.default_model, json_output=True)
+            output = self.request_completion(messages=messages, temperature=temperature, model=model, json_output=True)
+            if journal is not None:
+                journal.record((index,), output)
+
+        if journal is not None:
+            journal.complete()
 
         return output
 
-    def vectorise(self, texts, model="text-embedding-3-small"):
+    def _map_reduce_summary(self, system_prompt, chunks, temperature, model, fan_in=None, journal=None):
+        fan_in = fan_in or int(os.getenv("OPENAI_SUMMARY_FAN_IN", 8))
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+
+        # Summaries from an earlier run, keyed by (round, index)
+        completed = journal.outputs() if journal is not None else {}
+
+        # Map: summarise every chunk on its own
+        requests = [
+            {"messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": chunk['content']}], "temperature": temperature, "model": model, "json_output": True}
+            for chunk in chunks
+        ]
+        summaries = self._complete_resumable([(0, i) for i in range(len(requests))], requests, journal, completed)
+        level = 0
+
+        # Reduce: merge neighbouring summaries, keeping document order, until one remains
+        token_budget = self.max_context_tokens - (self.max_output_tokens * 2)
+        while len(summaries) > 1:
+            groups = []
+            group = []
+            group_tokens = 0
+
+            for summary, tokens in zip(summaries, count_tokens_batch(summaries, model)):
+                if group and (len(group) >= fan_in or group_tokens + tokens > token_budget):
+                    groups.append(group)
+                    group = []
+                    group_tokens = 0
+
+                group.append(summary)
+                group_tokens += tokens
+
+            groups.append(group)
+
+            if len(groups) == len(summaries):
+                raise ValueError("Partial summaries are too long to merge within the context window.")
+
+            level += 1
+            summaries = self._complete_resumable([(level, i) for i in range(len(groups))], [
+                {"messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": "Summaries of consecutive parts of the document, in order\n----\n" + "\n----\n".join(group)}
+                ], "temperature": temperature, "model": model, "json_output": True}
+                for group in groups
+            ], journal, completed)
+
+        return summaries[0] if summaries else None
+
+    def vectorise(self, texts, model="text-embedding-3-small", use_cache=True):
         """
         Converts a given text string or an array of text strings into their corresponding embedding vectors using the OpenAI embeddings API.
 
+        Identical texts are embedded once and cached vectors are reused. The rest are split into
+        batches within the endpoint's item and token limits, which are requested concurrently.
+
         Args:
             texts (str or list): The input text(s) to be converted into embedding vector(s).
             model (str): The embedding model to be used. Defaults to "text-embedding-3-small".
+            use_cache (bool, optional): Use the embedding cache, if one is enabled. Defaults to True.
 
         Returns:
-            list: A list of embedding vectors corresponding to the input text(s).
+            numpy.ndarray: A contiguous float32 array with one row per input text.
         """
         if isinstance(texts, str):
             texts = [texts]
 
         texts = [text.replace("\n", " ") for text in texts]
-        response = self.client.embeddings.create(input=texts, model=model)
-        return [data.embedding for data in response.data]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Embed each distinct text once
+        unique_texts = list(dict.fromkeys(texts))
+        vectors = {}
+
+        cache = self.embedding_cache if use_cache else None
+        if cache is not None:
+            for text in unique_texts:
+                vector = cache.get(cache.key("openai", model, text))
+                if vector is not None:
+                    vectors[text] = vector
+
+        missing = [text for text in unique_texts if text not in vectors]
+        if missing:
+            batches = self._embedding_batches(missing, model)
+
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                # Workers run in a copy of this context, so their calls keep its telemetry tags
+                context = contextvars.copy_context()
+                for batch, embeddings in zip(batches, executor.map(lambda batch: context.copy().run(self._embed, batch, model), batches)):
+                    for text, vector in zip(batch, embeddings):
+                        vectors[text] = vector
+                        if cache is not None:
+                            cache.set(cache.key("openai", model, text), vector)
+
+        return np.ascontiguousarray(np.stack([vectors[text] for text in texts]), dtype=np.float32)
+
+    def _embedding_batches(self, texts, model):
+        # Packs texts in order into batches within the item and token limits
+        batches = []
+        batch = []
+        batch_tokens = 0
+
+        for text, tokens in zip(texts, count_tokens_batch(texts, model)):
+            if batch and (len(batch) >= self.embedding_batch_size or batch_tokens + tokens > self.embedding_batch_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+
+            batch.append(text)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed(self, texts, model):
+        limiter = self._get_rate_limiter(model)
+        tokens = sum(count_tokens_batch(texts, model))
+        call = self.telemetry.start("openai", model, kind="embedding")
+
+        def attempt(timeout):
+            call.attempt()
+            reservation = limiter.acquire(tokens) if limiter else None
+            response = self.client.embeddings.create(input=texts, model=model, **self._timeout_settings(timeout))
+            if limiter:
+                limiter.reconcile(reservation, self._usage_tokens(response))
+            return response
+
+        try:
+            response = self.retry_policy.call(attempt)
+        except Exception as error:
+            call.finish(error=error)
+            raise
+        call.finish(self._response_usage(response))
+
+        # The response is ordered by index, which may not match the input order
+        data = sorted(response.data, key=lambda item: item.index)
+        return [np.asarray(item.embedding, dtype=np.float32) for item in data]
             
     def fine_tune_model(self, training_file_path, base_model="gpt-4o", suffix=None, hyperparameters=None, timeout=3600):
         """
@@ -360,13 +1281,15 @@ class OpenAIHandler:
             "details": {}
         }
 
-        # Upload the training file
-        try:
+        # The SDK's retries are disabled, so each call goes through the retry policy. The file is
+        # reopened on every attempt, as a failed upload may have read part of it
+        def upload(_):
             with open(training_file_path, "rb") as file:
+                return self.client.files.create(file=file, purpose="fine-tune")
 
-
-
-                file_upload = self.client.files.create(file=file, purpose="fine-tune")
+        # Upload the training file
+        try:
+            file_upload = self.retry_policy.call(upload)
             print(f"Training file uploaded with ID: {file_upload.id}")
             result["details"]["file_id"] = file_upload.id
         except Exception as e:
@@ -385,14 +1308,14 @@ class OpenAIHandler:
             if hyperparameters:
                 job_params["hyperparameters"] = hyperparameters
 
-            fine_tuning_job = self.client.fine_tuning.jobs.create(**job_params)
+            fine_tuning_job = self.retry_policy.call(lambda _: self.client.fine_tuning.jobs.create(**job_params))
             result["details"]["job_id"] = fine_tuning_job.id
             print(f"Fine-tuning job created with ID: {fine_tuning_job.id}")
 
             # Wait for the fine-tuning job to complete or timeout
             start_time = time.time()
             while True:
-                job_status = self.client.fine_tuning.jobs.retrieve(fine_tuning_job.id)
+                job_status = self.retry_policy.call(lambda _: self.client.fine_tuning.jobs.retrieve(fine_tuning_job.id))
                 print(f"Fine-tuning status: {job_status.status}")
                 result["status"] = job_status.status
                 
@@ -420,7 +1343,7 @@ class OpenAIHandler:
         finally:
             # Delete the training file
             try:
-                self.client.files.delete(file_upload.id)
+                self.retry_policy.call(lambda _: self.client.files.delete(file_upload.id))
                 print(f"Training file with ID {file_upload.id} has been deleted.")
             except Exception as delete_error:
                 print(f"Failed to delete training file: {str(delete_error)}")
@@ -0,0 +1,191 @@
+import time
+import asyncio
+import warnings
+import threading
+
+
+class TokenBucket:
+    """
+    A bucket holding up to capacity units and refilling at capacity per minute.
+
+    Units are taken immediately and the balance may go negative; the caller then waits for the
+    deficit to refill. Waiters are therefore served in the order they arrived, and traffic is
+    paced at the refill rate instead of bursting and stalling.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.balance = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.balance = min(self.capacity, self.balance + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount, now):
+        # Returns how long to wait before the taken units are covered
+        self.refill(now)
+        self.balance -= amount
+        return max(0.0, -self.balance / self.rate)
+
+    def give(self, amount, now):
+        self.refill(now)
+        self.balance = min(self.capacity, self.balance + amount)
+
+    def resize(self, capacity, now):
+        # Changes the limit without refilling: the balance carries over, capped at the new capacity
+        self.refill(now)
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+        self.balance = min(self.capacity, self.balance)
+
+
+class Reservation:
+    """Record of what an acquire took, so it can be reconciled with the actual usage."""
+
+    def __init__(self, limiter, tokens):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.reconciled = False
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limiter for one model.
+
+    Both limits are optional; a limiter with neither never waits. acquire is for threads and
+    acquire_async for coroutines, and both share the same buckets.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self._lock = threading.Lock()
+        self._requests = None
+        self._tokens = None
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        """Sets the limits. Existing buckets keep their balance, so reconfiguring never refills the quota."""
+        now = time.monotonic()
+        with self._lock:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self._requests = self._resized(self._requests, requests_per_minute, now)
+            self._tokens = self._resized(self._tokens, tokens_per_minute, now)
+
+    @staticmethod
+    def _resized(bucket, capacity, now):
+        if not capacity:
+            return None
+        if bucket is None:
+            return TokenBucket(capacity)
+        bucket.resize(capacity, now)
+        return bucket
+
+    def _reserve(self, tokens):
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            if self._requests is not None:
+                wait = max(wait, self._requests.take(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.take(tokens, now))
+        return Reservation(self, tokens), wait
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until a request costing tokens fits within the limits.
+
+        Args:
+            tokens (int, optional): Expected tokens, i.e. prompt tokens plus max_tokens.
+
+        Returns:
+            Reservation: Pass to reconcile once the actual usage is known.
+        """
+        reservation, wait = self._reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return reservation
+
+    async def acquire_async(self, tokens=0):
+        """Asynchronous acquire, which waits without blocking the event loop."""
+        reservation, wait = self._reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return reservation
+
+    def reconcile(self, reservation, actual_tokens):
+        """
+        Corrects the token bucket once the actual usage of a request is known, returning the
+        unused part of the estimate (or taking the overrun).
+
+        Args:
+            reservation (Reservation): The reservation returned by acquire.
+            actual_tokens (int): Total tokens the request used, or None if unknown.
+        """
+        if reservation is None or reservation.reconciled or actual_tokens is None:
+            return
+
+        reservation.reconciled = True
+        with self._lock:
+            if self._tokens is not None:
+                self._tokens.give(reservation.tokens - actual_tokens, time.monotonic())
+
+    def info(self):
+        now = time.monotonic()
+        with self._lock:
+            info = {"requests_per_minute": self.requests_per_minute, "tokens_per_minute": self.tokens_per_minute}
+            if self._requests is not None:
+                self._requests.refill(now)
+                info["requests_available"] = self._requests.balance
+            if self._tokens is not None:
+                self._tokens.refill(now)
+                info["tokens_available"] = self._tokens.balance
+            return info
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(provider, model, requests_per_minute=None, tokens_per_minute=None):
+    """
+    Returns the process-wide limiter for a provider and model, so every handler instance
+    shares one quota. Returns None when neither limit is set.
+
+    If handlers ask for different limits for the same model, the stricter of each is kept and
+    a warning is issued; the quota is never refilled by the change.
+
+    Args:
+        provider (str): The provider name, e.g. "openai".
+        model (str): The model name.
+        requests_per_minute (int, optional): Requests allowed per minute.
+        tokens_per_minute (int, optional): Tokens allowed per minute.
+
+    Returns:
+        RateLimiter: The shared limiter, or None.
+    """
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+
+    key = (provider, model)
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        elif (limiter.requests_per_minute, limiter.tokens_per_minute) != (requests_per_minute, tokens_per_minute):
+            stricter = (_stricter(limiter.requests_per_minute, requests_per_minute), _stricter(limiter.tokens_per_minute, tokens_per_minute))
+            warnings.warn(
+                f"Conflicting rate limits for {provider} {model}: {requests_per_minute} requests and {tokens_per_minute} tokens "
+                f"per minute requested, {limiter.requests_per_minute} and {limiter.tokens_per_minute} configured. Using {stricter[0]} and {stricter[1]}."
+            )
+            if stricter != (limiter.requests_per_minute, limiter.tokens_per_minute):
+                limiter.configure(*stricter)
+        return limiter
+
+
+def _stricter(limit, other):
+    # An unset limit allows anything, so any set limit is stricter
+    if not limit or not other:
+        return limit or other
+    return min(limit, other)
@@ -0,0 +1,172 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+DEFAULT_VALUES = {
+    "LLM_RETRY_ATTEMPTS": 6,
+    "LLM_RETRY_BASE_DELAY": 1,
+    "LLM_RETRY_MAX_DELAY": 60,
+    "LLM_RETRY_DEADLINE": 600,
+}
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+class RetryDeadlineExceeded(Exception):
+    """Raised when a call could not succeed before its deadline."""
+    pass
+
+
+def retry_after_seconds(error):
+    """
+    Reads the server's requested delay from an error's response headers, if it has one.
+    Supports retry-after-ms as well as retry-after in seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds to wait, or None if the server didn't say.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for transient API errors.
+
+    The n-th retry waits a random time between 0 and min(max_delay, base_delay * 2**n), unless
+    the server sent Retry-After, which is honoured instead. No call runs past its deadline,
+    measured from the first attempt. Counters are kept for monitoring and reported by info().
+    """
+
+    def __init__(self, is_retryable, max_attempts=None, base_delay=None, max_delay=None, deadline=None):
+        """
+        Args:
+            is_retryable (callable): Takes an exception and returns a short reason string
+                (e.g. "rate_limit") if it should be retried, or None if not.
+            max_attempts (int, optional): Attempts per call, including the first.
+            base_delay (float, optional): Backoff ceiling for the first retry, in seconds.
+            max_delay (float, optional): Largest backoff ceiling, in seconds.
+            deadline (float, optional): Total seconds a call may take across attempts. 0 disables it.
+        """
+        self.is_retryable = is_retryable
+        self.max_attempts = max_attempts or int(_env("LLM_RETRY_ATTEMPTS"))
+        self.base_delay = base_delay or float(_env("LLM_RETRY_BASE_DELAY"))
+        self.max_delay = max_delay or float(_env("LLM_RETRY_MAX_DELAY"))
+        self.deadline = deadline if deadline is not None else float(_env("LLM_RETRY_DEADLINE"))
+
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.retries = 0
+            self.failures = 0
+            self.reasons = {}
+
+    def _record(self, reason=None, failed=False):
+        with self._lock:
+            if reason is not None:
+                self.retries += 1
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+            if failed:
+                self.failures += 1
+
+    def remaining(self, started):
+        """Seconds left before the deadline of a call started at started, or None if unbounded."""
+        if not self.deadline:
+            return None
+        return self.deadline - (time.monotonic() - started)
+
+    def _next_delay(self, error, attempt, started):
+        # Returns the delay before the next attempt, or raises if the error shouldn't be retried
+        reason = self.is_retryable(error)
+        if reason is None:
+            self._record(failed=True)
+            raise error
+
+        if attempt >= self.max_attempts:
+            self._record(failed=True)
+            raise error
+
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+        remaining = self.remaining(started)
+        if remaining is not None and delay >= remaining:
+            self._record(failed=True)
+            raise RetryDeadlineExceeded(f"Gave up after {attempt} attempt(s); the next retry would pass the {self.deadline}s deadline.") from error
+
+        self._record(reason)
+        return delay
+
+    def call(self, fn):
+        """
+        Calls fn(timeout) until it succeeds, retrying transient errors. timeout is the time left
+        before the deadline, or None, so the request itself can't outlive it.
+        """
+        with self._lock:
+            self.calls += 1
+
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return fn(self.remaining(started))
+            except Exception as error:
+                delay = self._next_delay(error, attempt, started)
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, fn):
+        """Asynchronous call, where fn(timeout) returns an awaitable."""
+        with self._lock:
+            self.calls += 1
+
+        started = time.monotonic()
+        attempt = 1
+        while True:
+            try:
+                return await fn(self.remaining(started))
+            except Exception as error:
+                delay = self._next_delay(error, attempt, started)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def info(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "reasons": dict(self.reasons),
+            }
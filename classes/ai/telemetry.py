@@ -0,0 +1,488 @@
+import os
+import json
+import math
+import time
+import warnings
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_VALUES = {
+    # Append every call record to this JSONL file, if set
+    "LLM_TELEMETRY_JSONL": "",
+    # JSON file of prices merged over DEFAULT_PRICES, in the same shape
+    "LLM_TELEMETRY_PRICES": "",
+    # Latencies kept per rollup group for percentiles
+    "LLM_TELEMETRY_LATENCY_SAMPLES": 1000,
+}
+
+# USD per million tokens. Models are matched by their longest prefix, so dated snapshots
+# (e.g. gpt-4o-2024-08-06) use their family's price unless listed separately
+DEFAULT_PRICES = {
+    "gpt-4o": {"input": 2.50, "output": 10.00, "cache_read": 1.25},
+    "gpt-4o-2024-05-13": {"input": 5.00, "output": 15.00},
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60, "cache_read": 0.075},
+    "ft:gpt-4o": {"input": 3.75, "output": 15.00, "cache_read": 1.875},
+    "ft:gpt-4o-mini": {"input": 0.30, "output": 1.20, "cache_read": 0.15},
+    "text-embedding-3-small": {"input": 0.02},
+    "text-embedding-3-large": {"input": 0.13},
+    "claude-3-5-sonnet": {"input": 3.00, "output": 15.00, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-3-opus": {"input": 15.00, "output": 75.00, "cache_read": 1.50, "cache_write": 18.75},
+    "claude-3-haiku": {"input": 0.25, "output": 1.25, "cache_read": 0.03, "cache_write": 0.30},
+}
+
+# Batch jobs are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+
+# Stage and project tags of the calls made in the current context. Async tasks inherit them;
+# threads don't, so work handed to a pool should run in contextvars.copy_context()
+_stage = contextvars.ContextVar("llm_stage", default=None)
+_project = contextvars.ContextVar("llm_project", default=None)
+
+
+def _env(key):
+    return os.getenv(key) or DEFAULT_VALUES[key]
+
+
+@contextmanager
+def stage(name):
+    """
+    Tags the LLM calls made inside the block with a pipeline stage, e.g. "knowledge_scroll".
+    Also usable as a method decorator.
+    """
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+@contextmanager
+def project(project_id):
+    """Tags the LLM calls made inside the block with a project, for per-project rollups."""
+    token = _project.set(project_id)
+    try:
+        yield
+    finally:
+        _project.reset(token)
+
+
+@contextmanager
+def _tags(stage_name=None, project_id=None):
+    tokens = [(var, var.set(value)) for var, value in ((_stage, stage_name), (_project, project_id)) if value is not None]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def tagged(iterator, stage=None, project=None):
+    """
+    Iterates over iterator with the given stage and project tags set while it runs, e.g. a
+    streamed completion or a generator of report events.
+
+    stage() and project() can't be held open around a yield: the tags would leak into the
+    consumer, interleaved generators would tag each other's calls, and a generator resumed
+    in another context couldn't reset them. Here they are set and reset around each step.
+
+    Returns:
+        The iterator's return value, so it can be used with yield from.
+    """
+    iterator = iter(iterator)
+    try:
+        while True:
+            with _tags(stage, project):
+                try:
+                    item = next(iterator)
+                except StopIteration as stop:
+                    return stop.value
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            with _tags(stage, project):
+                close()
+
+
+def load_prices():
+    prices = dict(DEFAULT_PRICES)
+    path = _env("LLM_TELEMETRY_PRICES")
+    if path:
+        with open(path, "r") as file:
+            prices.update(json.load(file))
+    return prices
+
+
+def call_cost(prices, model, tokens, kind="completion"):
+    """
+    Returns the USD cost of a call's token usage, or None if the model has no price.
+
+    Args:
+        prices (dict): Prices per million tokens by model prefix.
+        model (str): The model name.
+        tokens (dict): input_tokens, output_tokens, cache_read_tokens and cache_write_tokens.
+        kind (str, optional): "completion", "embedding" or "batch". Defaults to "completion".
+    """
+    matches = [prefix for prefix in prices if model and model.startswith(prefix)]
+    if not matches:
+        return None
+
+    price = prices[max(matches, key=len)]
+    input_price = price.get("input", 0)
+
+    cost = (
+        tokens.get("input_tokens", 0) * input_price
+        + tokens.get("output_tokens", 0) * price.get("output", 0)
+        + tokens.get("cache_read_tokens", 0) * price.get("cache_read", input_price)
+        + tokens.get("cache_write_tokens", 0) * price.get("cache_write", input_price)
+    ) / 1_000_000
+
+    if kind == "batch":
+        cost *= BATCH_DISCOUNT
+    return cost
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class MemorySink:
+    """
+    Aggregates call records in memory by (project, stage, provider, model, kind), so rollups
+    stay the same size however many calls are made. Percentiles use the most recent latencies.
+    """
+
+    GROUP_FIELDS = ("project", "stage", "provider", "model", "kind")
+
+    def __init__(self, latency_samples=None):
+        self.latency_samples = latency_samples or int(_env("LLM_TELEMETRY_LATENCY_SAMPLES"))
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def write(self, record):
+        key = tuple(record.get(field) for field in self.GROUP_FIELDS)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = {
+                    "calls": 0, "errors": 0, "retries": 0, "cost": 0.0, "unpriced_calls": 0,
+                    **{field: 0 for field in TOKEN_FIELDS},
+                    "timed_calls": 0, "total_latency": 0.0, "max_latency": 0.0, "latencies": deque(maxlen=self.latency_samples),
+                    "total_time_to_first_token": 0.0, "streamed_calls": 0,
+                }
+
+            group["calls"] += 1
+            group["retries"] += record.get("retries") or 0
+            if record.get("error"):
+                group["errors"] += 1
+
+            for field in TOKEN_FIELDS:
+                group[field] += record.get(field) or 0
+
+            if record.get("cost") is None:
+                group["unpriced_calls"] += 1
+            else:
+                group["cost"] += record["cost"]
+
+            latency = record.get("latency")
+            if latency is not None:
+                group["timed_calls"] += 1
+                group["total_latency"] += latency
+                group["max_latency"] = max(group["max_latency"], latency)
+                group["latencies"].append(latency)
+
+            if record.get("time_to_first_token") is not None:
+                group["total_time_to_first_token"] += record["time_to_first_token"]
+                group["streamed_calls"] += 1
+
+    def rollup(self, project=None, by=("stage", "model")):
+        """
+        Totals the recorded calls, grouped by the given record fields.
+
+        Args:
+            project (str, optional): Only include calls tagged with this project.
+            by (tuple, optional): Fields of GROUP_FIELDS to group by. () gives a single total.
+                Defaults to ("stage", "model").
+
+        Returns:
+            list: One dict per group, holding its by fields, calls, errors, retries, token
+                counts, cost (USD), unpriced_calls, and total, max, mean, p50 and p95 latency and
+                mean time to first token of streamed calls, in seconds. Sorted by cost, highest first.
+        """
+        with self._lock:
+            groups = [(dict(zip(self.GROUP_FIELDS, key)), dict(group, latencies=list(group["latencies"]))) for key, group in self._groups.items()]
+
+        totals = {}
+        for fields, group in groups:
+            if project is not None and fields["project"] != project:
+                continue
+
+            key = tuple(fields[field] for field in by)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = group
+                continue
+
+            for field, value in group.items():
+                if field == "max_latency":
+                    total[field] = max(total[field], value)
+                else:
+                    total[field] += value
+
+        rows = []
+        for key, total in totals.items():
+            latencies = total.pop("latencies")
+            streamed = total.pop("streamed_calls")
+            time_to_first_token = total.pop("total_time_to_first_token")
+            timed = total.pop("timed_calls")
+
+            row = dict(zip(by, key))
+            row.update(total)
+            row["mean_latency"] = total["total_latency"] / timed if timed else None
+            row["p50_latency"] = _percentile(latencies, 0.5)
+            row["p95_latency"] = _percentile(latencies, 0.95)
+            row["mean_time_to_first_token"] = time_to_first_token / streamed if streamed else None
+            rows.append(row)
+
+        return sorted(rows, key=lambda row: row["cost"], reverse=True)
+
+    def latency_percentile(self, q, **fields):
+        """Returns the q-quantile of recent latencies of the calls matching fields (e.g. model=...), or None."""
+        with self._lock:
+            latencies = [
+                latency
+                for key, group in self._groups.items()
+                if all(dict(zip(self.GROUP_FIELDS, key)).get(field) == value for field, value in fields.items())
+                for latency in group["latencies"]
+            ]
+        return _percentile(latencies, q)
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+
+
+class JSONLSink:
+    """Appends every call record to a JSONL file, for offline analysis."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+
+class PrometheusSink:
+    """
+    Keeps Prometheus counters and a latency histogram of the calls, labelled by provider,
+    model, kind, stage and project. exposition() renders them in the text exposition format,
+    e.g. for an HTTP /metrics endpoint or the node exporter's textfile collector.
+    """
+
+    LABELS = ("provider", "model", "kind", "stage", "project")
+    BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+    def __init__(self, namespace="llm"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def _inc(self, name, labels, value):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def write(self, record):
+        labels = tuple((label, record.get(label) or "") for label in self.LABELS)
+
+        with self._lock:
+            self._inc("requests_total", labels, 1)
+            self._inc("retries_total", labels, record.get("retries") or 0)
+            if record.get("error"):
+                self._inc("request_errors_total", labels, 1)
+
+            for field in TOKEN_FIELDS:
+                self._inc("tokens_total", labels + (("type", field[:-len("_tokens")]),), record.get(field) or 0)
+
+            if record.get("cost") is not None:
+                self._inc("cost_usd_total", labels, record["cost"])
+
+            latency = record.get("latency")
+            if latency is not None:
+                histogram = self._histograms.get(labels)
+                if histogram is None:
+                    histogram = self._histograms[labels] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+                for i, bound in enumerate(self.BUCKETS):
+                    if latency <= bound:
+                        histogram["buckets"][i] += 1
+                histogram["sum"] += latency
+                histogram["count"] += 1
+
+    @staticmethod
+    def _labels(labels):
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def exposition(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {labels: dict(histogram, buckets=list(histogram["buckets"])) for labels, histogram in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{self.namespace}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in counters.items():
+                if counter == name:
+                    lines.append(f"{metric}{self._labels(labels)} {value}")
+
+        if histograms:
+            metric = f"{self.namespace}_request_duration_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in histograms.items():
+                for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                    lines.append(f"{metric}_bucket{self._labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{metric}_bucket{self._labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{metric}_sum{self._labels(labels)} {histogram['sum']}")
+                lines.append(f"{metric}_count{self._labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+class CallTimer:
+    """
+    Times one API call and records it when finished. The stage and project are read when the
+    call starts, so a streamed call is tagged by where it was opened, not where it was consumed.
+    """
+
+    def __init__(self, telemetry, provider, model, kind="completion"):
+        self.telemetry = telemetry
+        self.provider = provider
+        self.model = model
+        self.kind = kind
+        self.stage = _stage.get()
+        self.project = _project.get()
+        self.attempts = 0
+        self.first_token = None
+        self.finished = False
+        self._started = time.monotonic()
+
+    def attempt(self):
+        """Counts an attempt; every attempt after the first is a retry."""
+        self.attempts += 1
+
+    def token(self):
+        """Marks the arrival of streamed output, keeping the time of the first."""
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self._started
+
+    def finish(self, tokens=None, error=None):
+        """Records the call, once. tokens holds the provider's usage as TOKEN_FIELDS counts."""
+        if self.finished:
+            return
+        self.finished = True
+
+        self.telemetry.record(
+            self.provider, self.model, self.kind, tokens,
+            latency=time.monotonic() - self._started,
+            time_to_first_token=self.first_token,
+            retries=max(0, self.attempts - 1),
+            error=error,
+            stage=self.stage,
+            project=self.project
+        )
+
+
+class Telemetry:
+    """
+    Records one entry per LLM API call (stage, project, model, token usage, cost, latency,
+    time to first token and retries) and passes it to every sink. An in-memory aggregate is
+    always kept for rollup(); other sinks, e.g. JSONLSink or PrometheusSink, are added with
+    add_sink. A sink only needs a write(record) method.
+    """
+
+    def __init__(self, sinks=None, prices=None):
+        self.memory = MemorySink()
+        self.prices = prices if prices is not None else load_prices()
+        self._lock = threading.Lock()
+        self._sinks = [self.memory] + list(sinks or [])
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+        return sink
+
+    def remove_sink(self, sink):
+        with self._lock:
+            self._sinks = [other for other in self._sinks if other is not sink]
+
+    def start(self, provider, model, kind="completion"):
+        return CallTimer(self, provider, model, kind)
+
+    def record(self, provider, model, kind="completion", tokens=None, latency=None, time_to_first_token=None, retries=0, error=None, stage=None, project=None):
+        """
+        Records a call. stage and project default to the current context's tags.
+
+        Returns:
+            dict: The record passed to the sinks.
+        """
+        tokens = tokens or {}
+        record = {
+            "timestamp": time.time(),
+            "provider": provider,
+            "model": model,
+            "kind": kind,
+            "stage": stage if stage is not None else _stage.get(),
+            "project": project if project is not None else _project.get(),
+            **{field: tokens.get(field, 0) for field in TOKEN_FIELDS},
+            "cost": call_cost(self.prices, model, tokens, kind),
+            "latency": latency,
+            "time_to_first_token": time_to_first_token,
+            "retries": retries,
+            "error": type(error).__name__ if error is not None else None,
+        }
+
+        # Telemetry must never fail the call it describes
+        for sink in self._sinks:
+            try:
+                sink.write(record)
+            except Exception as sink_error:
+                warnings.warn(f"Telemetry sink {type(sink).__name__} failed: {sink_error}")
+
+        return record
+
+    def rollup(self, project=None, by=("stage", "model")):
+        """Totals of the calls recorded in this process; see MemorySink.rollup."""
+        return self.memory.rollup(project, by)
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """
+    Returns the process-wide Telemetry shared by every handler, creating it on first use
+    with a JSONLSink when LLM_TELEMETRY_JSONL is set.
+    """
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            path = _env("LLM_TELEMETRY_JSONL")
+            _telemetry = Telemetry([JSONLSink(path)] if path else None)
+        return _telemetry
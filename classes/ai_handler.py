@@ -1,4 +1,6 @@
 import abc
+import atexit
+import threading
 
 class AIHandler(abc.ABC):
     def __init__(self):
@@ -13,7 +15,7 @@ class AIHandler(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def recursive_summary(self, system_prompt, data, temperature, model):
+    def recursive_summary(self, system_prompt, data, temperature, model, json_output, file_path, mode, checkpoint):
         pass
 
     @abc.abstractmethod
@@ -28,13 +30,53 @@ class AIHandler(abc.ABC):
     def fine_tune_model(self, training_file_path, base_model="gpt-4o", suffix=None, hyperparameters=None, timeout=3600):
         pass
 
+    # Shared handlers by (provider, config), so the whole process reuses warm connections
+    _handlers = {}
+    _handlers_lock = threading.Lock()
+
     @classmethod
-    def load(cls, ai_provider='openai'):
-        if ai_provider.lower() == 'openai':
-            from .ai.openai import OpenAIHandler
-            return OpenAIHandler()
-        elif ai_provider.lower() == 'anthropic':
-            from .ai.anthropic import AnthropicHandler
-            return AnthropicHandler()
-        else:
-            raise ValueError("Unsupported AI provider")
\ No newline at end of file
+    def load(cls, ai_provider='openai', **config):
+        """
+        Returns the process-wide handler for a provider and configuration, creating it on first
+        use. Handlers are thread-safe, so every caller can share one and its connection pool.
+
+        Args:
+            ai_provider (str, optional): "openai" or "anthropic". Defaults to "openai".
+            **config: Keyword arguments for the handler's constructor. Each distinct
+                configuration gets its own handler.
+
+        Returns:
+            The shared OpenAIHandler or AnthropicHandler.
+        """
+        provider = ai_provider.lower()
+        if provider not in ('openai', 'anthropic'):
+            raise ValueError("Unsupported AI provider")
+
+        key = (provider, repr(sorted(config.items())))
+        with cls._handlers_lock:
+            handler = cls._handlers.get(key)
+            if handler is None:
+                if provider == 'openai':
+                    from .ai.openai import OpenAIHandler
+                    handler = OpenAIHandler(**config)
+                else:
+                    from .ai.anthropic import AnthropicHandler
+                    handler = AnthropicHandler(**config)
+                cls._handlers[key] = handler
+            return handler
+
+    @classmethod
+    def shutdown(cls):
+        """Closes the connections of every shared handler and empties the registry. Runs at exit."""
+        with cls._handlers_lock:
+            handlers = list(cls._handlers.values())
+            cls._handlers.clear()
+
+        for handler in handlers:
+            try:
+                handler.close()
+            except Exception:
+                pass
+
+
+atexit.register(AIHandler.shutdown)
@@ -3,8 +3,6 @@ import tempfile
 import pdfminer.high_level
 from pdfminer.layout import LAParams
 from pdf2image import convert_from_path
-import io
-import base64
 
 from ..document_handler import DocumentHandler#
 from ..ai_handler import AIHandler
@@ -13,11 +11,11 @@ from ..ai_handler import AIHandler
 try:
     # Try relative imports for deployment
     from ....modules.text import *
+    from ....modules.images import ImagePayload
 except ImportError:
     # Fallback to absolute imports for local testing
     from ParchmentProphet.modules.text import *
-
-ai = AIHandler.load()
+    from ParchmentProphet.modules.images import ImagePayload
 
 class PDFHandler(DocumentHandler):
 
@@ -143,7 +141,14 @@ class PDFHandler(DocumentHandler):
                     pass
             return None
         
-    def image_ocr(self, skip=0, system_prompt_path=None, prompt_path=None):
+    def image_ocr(self, skip=0, system_prompt_path=None, prompt_path=None, image_format=None, quality=None, grayscale=None, min_short_side=None):
+        """
+        Transcribes each page of the PDF from an image of it.
+
+        Pages are re-encoded (JPEG by default) and scaled down to the fewest vision tiles that
+        keep text legible; image_format, quality, grayscale and min_short_side are passed to
+        ImagePayload.from_pil, whose defaults come from the IMAGE_* environment variables.
+        """
 
         if system_prompt_path is None:
             system_prompt = """
@@ -177,19 +182,14 @@ class PDFHandler(DocumentHandler):
             if index < skip:
                 continue
 
-            # Convert the PIL image to a byte array
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-
-            # Encode the byte array to base64
-            base64_image = base64.b64encode(img_byte_arr).decode('utf-8')
+            # Encode the page once, carrying its format and dimensions to the handler
+            payload = ImagePayload.from_pil(image, image_format=image_format, quality=quality, grayscale=grayscale, min_short_side=min_short_side)
 
             # Make the request to the OpenAI API with the image
-            response = ai.request_completion(
+            response = AIHandler.load().request_completion(
                 system_prompt=system_prompt,
                 prompt=prompt,
-                image=base64_image
+                image=payload
             )
 
             combined_text += response + "\n\n"
@@ -74,3 +74,12 @@ def bulk_delete_by_query(index_name, query):
     """
     return es.delete_by_query(index=index_name, body=query)
 
+def bulk_update_by_query(index_name, body):
+    """
+    Update multiple documents that match the given query in the specified index.
+    
+    :param index_name: The name of the index to update
+    :param body: The update body, containing the query to match documents and the script to apply
+    :return: A dictionary containing the update results
+    """
+    return es.update_by_query(index=index_name, body=body, conflicts="proceed")
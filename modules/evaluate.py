@@ -26,8 +26,6 @@ try:
 except ImportError:
     from classes.ai_handler import AIHandler
 
-ai = AIHandler()
-
 nltk.download('punkt', quiet=True)
 nltk.download('stopwords', quiet=True)
 nltk.download('words', quiet=True)
@@ -351,7 +349,7 @@ def compute_distance_and_angle(human_text, ai_text, model="text-embedding-3-smal
     Returns:
         tuple: A tuple containing the Euclidean distance and cosine similarity angle.
     """
-    embeddings = ai.vectorise([human_text, ai_text], model=model)
+    embeddings = AIHandler.load().vectorise([human_text, ai_text], model=model)
     human_vector = np.array(embeddings[0])
     ai_vector = np.array(embeddings[1])
 
@@ -372,16 +370,19 @@ def compute_average_vector_scores(samples, model="text-embedding-3-small"):
     Returns:
         tuple: A tuple containing the average, min, max, and standard deviation for Euclidean distance and cosine similarity angle.
     """
-    distances = []
-    angles = []
-
+    # Embed every sample in one call, which batches and deduplicates the texts
+    texts = []
     for sample in samples:
-        human_text = sample["human_generated"]
-        ai_text = sample["ai_generated"]
+        texts.append(sample["human_generated"])
+        texts.append(sample["ai_generated"])
+
+    embeddings = AIHandler.load().vectorise(texts, model=model)
+    human_vectors = embeddings[0::2]
+    ai_vectors = embeddings[1::2]
 
-        distance, angle = compute_distance_and_angle(human_text, ai_text, model=model)
-        distances.append(distance)
-        angles.append(angle)
+    distances = np.linalg.norm(human_vectors - ai_vectors, axis=1)
+    cosine_sims = np.sum(human_vectors * ai_vectors, axis=1) / (np.linalg.norm(human_vectors, axis=1) * np.linalg.norm(ai_vectors, axis=1))
+    angles = np.arccos(np.clip(cosine_sims, -1.0, 1.0))
 
     avg_distance = np.mean(distances)
     min_distance = np.min(distances)
@@ -0,0 +1,304 @@
+import os
+import math
+import base64
+import struct
+from io import BytesIO
+
+# Defaults for payloads built from rendered images, e.g. PDF pages
+DEFAULT_VALUES = {
+    "IMAGE_FORMAT": "jpeg",
+    "IMAGE_QUALITY": 85,
+    "IMAGE_GRAYSCALE": "false",
+    "IMAGE_MIN_SHORT_SIDE": 768,
+}
+
+# Vision models read images in 512px tiles, after fitting them within 2048px and scaling the
+# short side down to 768px, so anything larger is uploaded only to be discarded
+TILE_SIZE = 512
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+
+_MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+# Base64 characters decoded per attempt when looking for an image header. Most headers sit in
+# the first few bytes; JPEGs with large EXIF or ICC blocks need more before their frame header
+_HEADER_READS = (4096, 65536, 1 << 20)
+
+
+def _png_dimensions(data):
+    # The IHDR chunk always comes first: 8-byte signature, length, type, then width and height
+    if len(data) >= 24 and data[12:16] == b"IHDR":
+        return struct.unpack(">II", data[16:24])
+    return None
+
+
+def _gif_dimensions(data):
+    if len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+    return None
+
+
+def _jpeg_dimensions(data):
+    # Walk the marker segments until a start-of-frame, which holds the dimensions
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+
+        marker = data[offset + 1]
+
+        # Padding and markers without a length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+
+        length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+
+        # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+
+        offset += 2 + length
+
+    return None
+
+
+def _webp_dimensions(data):
+    if len(data) < 30:
+        return None
+
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def image_dimensions_from_bytes(data):
+    """
+    Reads the width and height of a PNG, JPEG, GIF or WebP image from its header bytes,
+    without decoding the image.
+
+    Args:
+        data (bytes): The start of the image file.
+
+    Returns:
+        tuple: (width, height), or None if the format isn't recognised or data is too short.
+    """
+    image_format = image_format_from_bytes(data)
+    if image_format == "png":
+        return _png_dimensions(data)
+    if image_format == "jpeg":
+        return _jpeg_dimensions(data)
+    if image_format == "gif":
+        return _gif_dimensions(data)
+    if image_format == "webp":
+        return _webp_dimensions(data)
+    return None
+
+
+def image_format_from_bytes(data):
+    """Returns "png", "jpeg", "gif" or "webp" from an image's signature, or None."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def image_dimensions(image_base64):
+    """
+    Returns the width and height of a base64-encoded image. Only as much of the string as
+    the header needs is decoded; PIL is used as a fallback for other formats.
+
+    Args:
+        image_base64 (str): The base64-encoded image.
+
+    Returns:
+        tuple: (width, height).
+    """
+    for length in _HEADER_READS:
+        # Decode whole 4-character groups only
+        prefix = image_base64[:length - length % 4]
+        dimensions = image_dimensions_from_bytes(base64.b64decode(prefix))
+        if dimensions is not None:
+            return dimensions
+        if len(prefix) >= len(image_base64):
+            break
+
+    from PIL import Image
+    image = Image.open(BytesIO(base64.b64decode(image_base64)))
+    return image.width, image.height
+
+
+def openai_image_tokens(width, height):
+    """Vision tokens for a high-detail OpenAI image: 85 plus 170 per 512px tile."""
+    if width <= TILE_SIZE and height <= TILE_SIZE:
+        return 85
+    return 85 + 170 * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def anthropic_image_tokens(width, height):
+    """Approximate Anthropic vision tokens, one per 750 pixels."""
+    return int(width * height / 750)
+
+
+def fit_to_tiles(width, height, min_short_side=None):
+    """
+    Picks the size to send an image at: no larger than the model will use, and with the
+    fewest 512px tiles that keep the short side at or above min_short_side, so text stays
+    legible. Within that tile count the largest size is chosen.
+
+    Args:
+        width (int): The image width.
+        height (int): The image height.
+        min_short_side (int, optional): Legibility floor for the short side, in pixels.
+            Defaults to IMAGE_MIN_SHORT_SIDE or 768.
+
+    Returns:
+        tuple: The (width, height) to scale to, never larger than the original.
+    """
+    min_short_side = min_short_side or int(os.getenv("IMAGE_MIN_SHORT_SIDE") or DEFAULT_VALUES["IMAGE_MIN_SHORT_SIDE"])
+
+    # The largest scale the model would keep, and the smallest that stays legible
+    upper = min(1.0, MAX_LONG_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    lower = min(upper, min_short_side / min(width, height))
+
+    # Grow from the legibility floor to the edge of its tiles
+    tiles_x = math.ceil(width * lower / TILE_SIZE)
+    tiles_y = math.ceil(height * lower / TILE_SIZE)
+    scale = min(upper, tiles_x * TILE_SIZE / width, tiles_y * TILE_SIZE / height)
+
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+class ImagePayload:
+    """
+    An encoded image for a vision request. The bytes, format and dimensions are worked out
+    once, so handlers can build data URLs and estimate tokens without decoding the image again.
+    """
+
+    def __init__(self, data=None, image_format=None, width=None, height=None, base64_data=None):
+        self._data = data
+        self._base64 = base64_data
+        self.format = image_format or image_format_from_bytes(self.data)
+        if width is None or height is None:
+            width, height = image_dimensions_from_bytes(self.data) or _pil_dimensions(self.data)
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_base64(cls, image_base64):
+        """
+        Wraps an already base64-encoded image, keeping the original string. Only the header is
+        decoded for the format and dimensions; the rest is decoded if data is used.
+        """
+        header = base64.b64decode(image_base64[:_HEADER_READS[0]])
+        width, height = image_dimensions(image_base64)
+        return cls(image_format=image_format_from_bytes(header), width=width, height=height, base64_data=image_base64)
+
+    @classmethod
+    def from_pil(cls, image, image_format=None, quality=None, grayscale=None, downscale=True, min_short_side=None):
+        """
+        Encodes a PIL image, e.g. a rendered PDF page.
+
+        Args:
+            image (PIL.Image.Image): The image.
+            image_format (str, optional): "jpeg", "webp" or "png". Defaults to IMAGE_FORMAT or "jpeg".
+            quality (int, optional): JPEG/WebP quality. Defaults to IMAGE_QUALITY or 85.
+            grayscale (bool, optional): Drop colour, which most scanned text doesn't need.
+                Defaults to IMAGE_GRAYSCALE or False.
+            downscale (bool, optional): Scale down with fit_to_tiles. Defaults to True.
+            min_short_side (int, optional): Legibility floor passed to fit_to_tiles.
+
+        Returns:
+            ImagePayload: The encoded image.
+        """
+        from PIL import Image
+
+        image_format = (image_format or os.getenv("IMAGE_FORMAT") or DEFAULT_VALUES["IMAGE_FORMAT"]).lower()
+        if image_format == "jpg":
+            image_format = "jpeg"
+        if image_format not in ("jpeg", "webp", "png"):
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        quality = quality or int(os.getenv("IMAGE_QUALITY") or DEFAULT_VALUES["IMAGE_QUALITY"])
+        if grayscale is None:
+            grayscale = str(os.getenv("IMAGE_GRAYSCALE") or DEFAULT_VALUES["IMAGE_GRAYSCALE"]).lower() in ("1", "true", "yes")
+
+        if downscale:
+            size = fit_to_tiles(image.width, image.height, min_short_side)
+            if size != (image.width, image.height):
+                image = image.resize(size, Image.LANCZOS)
+
+        if grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L") and image_format == "jpeg":
+            image = image.convert("RGB")
+
+        buffer = BytesIO()
+        if image_format == "png":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=image_format.upper(), quality=quality)
+
+        return cls(buffer.getvalue(), image_format, image.width, image.height)
+
+    def reencode(self, **options):
+        """Returns a copy re-encoded with from_pil's options, e.g. a lower quality or grayscale."""
+        from PIL import Image
+        return ImagePayload.from_pil(Image.open(BytesIO(self.data)), **options)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = base64.b64decode(self._base64)
+        return self._data
+
+    @property
+    def media_type(self):
+        return _MEDIA_TYPES.get(self.format, "image/jpeg")
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    @property
+    def data_url(self):
+        return f"data:{self.media_type};base64,{self.base64}"
+
+    def openai_tokens(self):
+        return openai_image_tokens(self.width, self.height)
+
+    def anthropic_tokens(self):
+        return anthropic_image_tokens(self.width, self.height)
+
+
+def _pil_dimensions(data):
+    from PIL import Image
+    image = Image.open(BytesIO(data))
+    return image.width, image.height
+
+
+def as_image_payload(image):
+    """Returns image as an ImagePayload, wrapping a base64 string if needed."""
+    if isinstance(image, ImagePayload):
+        return image
+    return ImagePayload.from_base64(image)
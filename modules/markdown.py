@@ -1,7 +1,8 @@
 import re
 import json
 from bs4 import BeautifulSoup
-from .text import sanitise_text
+from .text import sanitise_text, chunk_large_text, count_tokens
+from .tokenizer import get_encoding
 
 
 def extract_markdown_titles(markdown_text):
@@ -26,6 +27,259 @@ def extract_markdown_titles(markdown_text):
 
     return titles
 
+_HEADING_PATTERN = re.compile(r'^(#{1,6})\s*(.+)$')
+_FENCE_PATTERN = re.compile(r'^\s*(```|~~~)')
+
+def _markdown_paragraphs(lines):
+    """
+    Builds the heading/paragraph boundary index of a markdown document in a single pass.
+
+    Args:
+        lines (iterable): The document's lines, including their line endings.
+
+    Yields:
+        dict: One entry per paragraph or heading line, with its character offsets, the text
+        before it since the previous entry ("leading"), its heading path and whether it
+        starts a section.
+    """
+    headings = []
+    position = 0
+    leading = []
+    paragraph = []
+    paragraph_start = 0
+    section_start = True
+    in_fence = False
+
+    def flush():
+        text = "".join(paragraph)
+        content = text.rstrip()
+        entry = {
+            "start": paragraph_start,
+            "end": paragraph_start + len(content),
+            "leading": "".join(leading),
+            "content": content,
+            "headings": list(headings),
+            "section_start": section_start,
+        }
+        leading.clear()
+        leading.append(text[len(content):])
+        paragraph.clear()
+        return entry
+
+    for line in lines:
+        line_start = position
+        position += len(line)
+        stripped = line.strip()
+
+        if _FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+
+        heading = None if in_fence else _HEADING_PATTERN.match(line.rstrip("\r\n"))
+
+        # Headings and blank lines close the current paragraph
+        if (heading or (not stripped and not in_fence)) and paragraph:
+            yield flush()
+            section_start = False
+
+        if heading:
+            level = len(heading.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, f"{heading.group(1)} {heading.group(2).strip()}"))
+
+            paragraph_start = line_start
+            paragraph.append(line)
+            section_start = True
+            yield flush()
+            section_start = False
+        elif stripped or in_fence:
+            if not paragraph:
+                paragraph_start = line_start
+            paragraph.append(line)
+        else:
+            leading.append(line)
+
+    if paragraph:
+        yield flush()
+
+def _pack_markdown_chunks(paragraphs, token_limit, model, return_tokens):
+    # Units are whole sections where they fit, otherwise single paragraphs, otherwise
+    # token-limited pieces of a paragraph. Units are packed greedily into chunks.
+    enc = get_encoding(model)
+
+    def split(content, first_budget):
+        # The first piece may be given a smaller budget so it fits alongside its heading
+        if first_budget >= token_limit:
+            yield from chunk_large_text(content, token_limit, model)
+            return
+
+        first = next(chunk_large_text(content, first_budget, model))
+        yield first
+        for piece in chunk_large_text(content[first["end_loc"]:], token_limit, model):
+            yield dict(piece, start_loc=piece["start_loc"] + first["end_loc"], end_loc=piece["end_loc"] + first["end_loc"])
+
+    def pieces(paragraph, first_budget):
+        tokens = count_tokens(paragraph["content"], model)
+        if tokens <= first_budget:
+            return [dict(paragraph, tokens=tokens)]
+
+        # A single paragraph over the limit is split on lines and sentences
+        result = []
+        previous_end = 0
+        for piece in split(paragraph["content"], first_budget):
+            leading = paragraph["leading"] if not result else paragraph["content"][previous_end:piece["start_loc"]]
+            result.append({
+                "start": paragraph["start"] + piece["start_loc"],
+                "end": paragraph["start"] + piece["end_loc"],
+                "leading": leading,
+                "content": piece["content"],
+                "headings": paragraph["headings"],
+                "section_start": paragraph["section_start"] and not result,
+                "tokens": count_tokens(piece["content"], model),
+            })
+            previous_end = piece["end_loc"]
+        return result
+
+    def units():
+        section = []
+        section_tokens = 0
+        oversized = False
+        heading_tokens = None
+
+        for paragraph in paragraphs:
+            if paragraph["section_start"]:
+                if section:
+                    yield section
+                section = []
+                section_tokens = 0
+                oversized = False
+
+            # Leave room for the heading so it isn't stranded in a chunk of its own
+            first_budget = token_limit
+            if heading_tokens is not None and token_limit - heading_tokens - 1 > 0:
+                first_budget = token_limit - heading_tokens - 1
+
+            paragraph_pieces = pieces(paragraph, first_budget)
+            heading_tokens = None
+            if paragraph["section_start"] and _HEADING_PATTERN.match(paragraph["content"]):
+                heading_tokens = paragraph_pieces[0]["tokens"]
+            if oversized:
+                for piece in paragraph_pieces:
+                    yield [piece]
+                continue
+
+            section.extend(paragraph_pieces)
+            section_tokens += sum(piece["tokens"] + 1 for piece in paragraph_pieces)
+
+            # The section can no longer be kept whole, so it starts a new chunk and is packed piece by piece
+            if section_tokens > token_limit:
+                oversized = True
+                yield None
+                for piece in section:
+                    yield [piece]
+                section = []
+
+        if section:
+            yield section
+
+    def make_chunk(chunk_pieces):
+        content = chunk_pieces[0]["content"] + "".join(piece["leading"] + piece["content"] for piece in chunk_pieces[1:])
+        content_tokens = enc.encode(content)
+
+        # Joining pieces can shift token boundaries, fall back to the line chunker if it overflowed
+        if len(content_tokens) > token_limit:
+            for piece in chunk_large_text(content, token_limit, model, return_tokens=True):
+                chunk = {
+                    "content": piece["content"],
+                    "start_loc": chunk_pieces[0]["start"] + piece["start_loc"],
+                    "end_loc": chunk_pieces[0]["start"] + piece["end_loc"],
+                    "headings": [title for _, title in chunk_pieces[0]["headings"]],
+                    "section_start": chunk_pieces[0]["section_start"] and piece["start_loc"] == 0,
+                }
+                if return_tokens:
+                    chunk["tokens"] = piece["tokens"]
+                yield chunk
+            return
+
+        chunk = {
+            "content": content,
+            "start_loc": chunk_pieces[0]["start"],
+            "end_loc": chunk_pieces[-1]["end"],
+            "headings": [title for _, title in chunk_pieces[0]["headings"]],
+            "section_start": chunk_pieces[0]["section_start"],
+        }
+        if return_tokens:
+            chunk["tokens"] = content_tokens
+        yield chunk
+
+    current = []
+    current_tokens = 0
+    for unit in units():
+        if unit is None:
+            if current:
+                yield from make_chunk(current)
+            current = []
+            current_tokens = 0
+            continue
+
+        unit_tokens = sum(piece["tokens"] + 1 for piece in unit)
+        if current and current_tokens + unit_tokens > token_limit:
+            yield from make_chunk(current)
+            current = []
+            current_tokens = 0
+
+        current.extend(unit)
+        current_tokens += unit_tokens
+
+    if current:
+        yield from make_chunk(current)
+
+def chunk_markdown(markdown_text, token_limit, model="gpt-4", return_tokens=False):
+    """
+    Splits markdown into chunks of at most token_limit tokens along its section structure.
+
+    Whole sections are packed into a chunk while they fit. A section larger than the limit
+    starts a new chunk and is packed paragraph by paragraph, and a paragraph larger than the
+    limit is split with chunk_large_text.
+
+    Args:
+        markdown_text (str): The markdown text to chunk.
+        token_limit (int): The maximum number of tokens per chunk.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+        return_tokens (bool, optional): Include the chunk's token ids under "tokens". Defaults to False.
+
+    Yields:
+        dict: {"content", "start_loc", "end_loc", "headings", "section_start"} where headings is the
+        heading path of the chunk's first line (e.g. ['# Title 1', '## Subtitle 1']) and
+        section_start is True when the chunk begins at the start of a section.
+    """
+    token_limit = int(token_limit)
+    if token_limit <= 0:
+        raise ValueError("token_limit must be positive")
+
+    paragraphs = _markdown_paragraphs(markdown_text.splitlines(keepends=True))
+    yield from _pack_markdown_chunks(paragraphs, token_limit, model, return_tokens)
+
+def chunk_markdown_file(file_path, token_limit, model="gpt-4", return_tokens=False):
+    """
+    Streams structure-aware chunks from a markdown file, as chunk_markdown does for a string.
+
+    Args:
+        file_path (str): The path to the UTF-8 markdown file.
+        token_limit (int): The maximum number of tokens per chunk.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+        return_tokens (bool, optional): Include the chunk's token ids under "tokens". Defaults to False.
+
+    Yields:
+        dict: As chunk_markdown, with character offsets into the file.
+    """
+    token_limit = int(token_limit)
+    if token_limit <= 0:
+        raise ValueError("token_limit must be positive")
+
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        yield from _pack_markdown_chunks(_markdown_paragraphs(file), token_limit, model, return_tokens)
+
 # return markdown as a dictionary, in the format of {# major heading -> content, ...}
 def parse_markdown(markdown):
 
@@ -115,6 +115,31 @@ def delete_from_neo4j(chunk_id, project_id):
             DETACH DELETE e
         """, chunk_id=chunk_id, project_id=project_id)
 
+def remove_references(tx, chunk_ids, project_id):
+    # Drop the chunk references from relationships, deleting any left without a source
+    tx.run("""
+        MATCH (:Entity {project_id: $project_id})-[r:RELATED_TO]->(:Entity {project_id: $project_id})
+        WHERE any(ref IN r.references WHERE ref IN $chunk_ids)
+        SET r.references = [ref IN r.references WHERE NOT ref IN $chunk_ids]
+        WITH r
+        WHERE size(r.references) = 0
+        DELETE r
+    """, chunk_ids=chunk_ids, project_id=project_id)
+
+    # Then from entities, deleting any left without a source
+    tx.run("""
+        MATCH (e:Entity {project_id: $project_id})
+        WHERE any(ref IN e.references WHERE ref IN $chunk_ids)
+        SET e.references = [ref IN e.references WHERE NOT ref IN $chunk_ids]
+        WITH e
+        WHERE size(e.references) = 0
+        DETACH DELETE e
+    """, chunk_ids=chunk_ids, project_id=project_id)
+
+def remove_chunk_references(chunk_ids, project_id):
+    with driver.session() as session:
+        session.write_transaction(remove_references, list(chunk_ids), project_id)
+
 def search_neo4j(query, project_id):
     with driver.session() as session:
         # Modify the query to include project_id filter
@@ -0,0 +1,203 @@
+import os
+import re
+import string
+import textwrap
+import threading
+from collections import OrderedDict
+
+# Number of compiled templates kept per process. Module-level prompts are a handful, but
+# templates read back from training data can be arbitrary strings
+PROMPT_TEMPLATE_CACHE_SIZE = int(os.getenv("PROMPT_TEMPLATE_CACHE_SIZE", 256))
+
+# Placeholders for the "replace" style, used by prompts that contain literal JSON braces
+_REPLACE_PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+_CONVERSIONS = {"r": repr, "s": str, "a": ascii}
+
+_templates = OrderedDict()
+_prompt_files = {}
+_registry_lock = threading.Lock()
+
+
+class PromptTemplate:
+    """
+    A prompt dedented, stripped and parsed once, then rendered with a single pass over its parts.
+
+    Two placeholder styles are supported:
+
+    - "format": str.format syntax, with literal braces escaped as {{ and }}.
+    - "replace": every {name} is a placeholder and any other brace is literal text.
+
+    The static prefix is the text before the first placeholder. It is identical for every
+    render, so callers can cache or count it once and only account for the dynamic suffix.
+    """
+
+    def __init__(self, template, style="format"):
+        if style not in ("format", "replace"):
+            raise ValueError(f"Unknown template style: {style}")
+
+        self.style = style
+        self.text = textwrap.dedent(template).strip()
+
+        # Each part is (literal, field_name, conversion, format_spec); field_name is None for trailing text
+        self._parts = []
+        self._simple = True
+
+        if style == "format":
+            try:
+                for literal, field_name, format_spec, conversion in string.Formatter().parse(self.text):
+                    if field_name is not None and not field_name.isidentifier():
+                        # Attribute or index lookups are left to str.format
+                        self._simple = False
+                    self._parts.append((literal, field_name, conversion, format_spec))
+            except ValueError:
+                # Prompts that are only ever used as plain text may contain unbalanced braces;
+                # rendering them raises the same error str.format would
+                self._simple = False
+                self._parts = [(self.text, None, None, None)]
+        else:
+            position = 0
+            for match in _REPLACE_PLACEHOLDER.finditer(self.text):
+                self._parts.append((self.text[position:match.start()], match.group(1), None, None))
+                position = match.end()
+            self._parts.append((self.text[position:], None, None, None))
+
+        self.fields = tuple(dict.fromkeys(part[1] for part in self._parts if part[1] is not None))
+
+        # Escaped braces split the literal text, so join everything up to the first placeholder
+        prefix = []
+        for literal, field_name, _, _ in self._parts:
+            prefix.append(literal)
+            if field_name is not None:
+                break
+        self.prefix = "".join(prefix)
+
+    def _render_parts(self, parts, values):
+        rendered = []
+        for literal, field_name, conversion, format_spec in parts:
+            rendered.append(literal)
+            if field_name is None:
+                continue
+
+            value = values[field_name]
+            if conversion:
+                value = _CONVERSIONS[conversion](value)
+            if format_spec:
+                value = format(value, format_spec)
+            elif not isinstance(value, str):
+                value = format(value)
+            rendered.append(value)
+
+        return "".join(rendered)
+
+    def render(self, **values):
+        """
+        Renders the template.
+
+        Args:
+            **values: A value for every placeholder in the template.
+
+        Returns:
+            str: The rendered prompt.
+        """
+        if not self._simple:
+            return self.text.format(**values)
+        return self._render_parts(self._parts, values)
+
+    def render_parts(self, **values):
+        """
+        Renders the template split into its static prefix and dynamic suffix.
+
+        Args:
+            **values: A value for every placeholder in the template.
+
+        Returns:
+            tuple: (prefix, suffix), where prefix + suffix equals render(**values).
+        """
+        if not self.fields:
+            return self.prefix, ""
+
+        rendered = self.render(**values)
+        return self.prefix, rendered[len(self.prefix):]
+
+    def __repr__(self):
+        return f"PromptTemplate(style={self.style!r}, fields={self.fields!r})"
+
+
+def get_template(template, style="format"):
+    """
+    Returns the compiled template for a prompt string, compiling it at most once.
+
+    Args:
+        template (str): The raw prompt, as written in the prompts modules.
+        style (str, optional): "format" or "replace". Defaults to "format".
+
+    Returns:
+        PromptTemplate: The compiled template.
+    """
+    key = (template, style)
+    with _registry_lock:
+        compiled = _templates.get(key)
+        if compiled is not None:
+            _templates.move_to_end(key)
+            return compiled
+
+    compiled = PromptTemplate(template, style)
+
+    with _registry_lock:
+        compiled = _templates.setdefault(key, compiled)
+        _templates.move_to_end(key)
+        while len(_templates) > PROMPT_TEMPLATE_CACHE_SIZE:
+            _templates.popitem(last=False)
+
+    return compiled
+
+
+def render(template, **values):
+    """
+    Compiles (once) and renders a "format" style prompt.
+
+    Args:
+        template (str): The raw prompt.
+        **values: A value for every placeholder in the prompt.
+
+    Returns:
+        str: The rendered prompt.
+    """
+    return get_template(template).render(**values)
+
+
+def read_prompt_file(file_path):
+    """
+    Reads a prompt file, reusing the cached content until the file's mtime or size changes.
+
+    Args:
+        file_path (str): Path to the prompt file.
+
+    Returns:
+        str: The file content.
+
+    Raises:
+        OSError: If the file can't be read.
+    """
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _prompt_files.get(file_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(file_path, 'r') as file:
+        content = file.read()
+
+    with _registry_lock:
+        _prompt_files[file_path] = (version, content)
+
+    return content
+
+
+def clear_templates():
+    """Empties the compiled template and prompt file caches."""
+    with _registry_lock:
+        _templates.clear()
+        _prompt_files.clear()
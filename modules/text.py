@@ -1,61 +1,159 @@
-import tiktoken
+import os
 import re
+import bisect
+import tempfile
+import array
+import itertools
+import difflib
+from . import tokenizer
+from . import templates
+from .tokenizer import get_encoding, token_byte_lengths
+
+# Unicode punctuation mapped to its ASCII equivalent
+_PUNCTUATION_MAP = {
+    '‚': ',',  # Single low-9 quotation mark
+    '„': '"',  # Double low-9 quotation mark
+    '‹': '<',  # Single left-pointing angle quotation mark
+    '›': '>',  # Single right-pointing angle quotation mark
+    '«': '"',  # Left-pointing double angle quotation mark
+    '»': '"',  # Right-pointing double angle quotation mark
+    '‐': '-',  # Hyphen
+    '–': '-',  # En dash
+    '—': '--', # Em dash
+    '⁄': '/',  # Fraction slash
+    '’': "'",  # Right single quotation mark
+    '‘': "'",  # left single quotation mark
+    '”': '"',  # right double quotation mark
+    '“': '"',  # left double quotation mark
+    '′': "'",  # Prime
+    '″': '"',  # Double prime
+    '‴': "'",  # Triple prime
+    '⁗': '?',  # Double question mark
+    '⁓': '~',  # Swung dash
+    '…': '...', # Horizontal ellipsis
+}
 
 def sanitise_text(text):
-    # Define a dictionary mapping Unicode punctuation to their ASCII equivalents
-    punctuation_map = {
-        '‚': ',',  # Single low-9 quotation mark
-        '„': '"',  # Double low-9 quotation mark
-        '‹': '<',  # Single left-pointing angle quotation mark
-        '›': '>',  # Single right-pointing angle quotation mark
-        '«': '"',  # Left-pointing double angle quotation mark
-        '»': '"',  # Right-pointing double angle quotation mark
-        '‐': '-',  # Hyphen
-        '–': '-',  # En dash
-        '—': '--', # Em dash
-        '⁄': '/',  # Fraction slash
-        '’': "'",  # Right single quotation mark
-        '‘': "'",  # left single quotation mark
-        '”': '"',  # right double quotation mark
-        '“': '"',  # left double quotation mark
-        '′': "'",  # Prime
-        '″': '"',  # Double prime
-        '‴': "'",  # Triple prime
-        '⁗': '?',  # Double question mark
-        '⁓': '~',  # Swung dash
-        '…': '...', # Horizontal ellipsis
-    }
-
-    # Replace Unicode punctuation with their ASCII equivalents
-    sanitized_text = ''.join(punctuation_map.get(char, char) for char in text)
-
-    return sanitized_text
+    # Pure ASCII text has nothing to replace
+    if text.isascii():
+        return text
+
+    # Replace Unicode punctuation with their ASCII equivalents. Each pass is a C-level search,
+    # and characters that don't occur are skipped without copying the text
+    for char, replacement in _PUNCTUATION_MAP.items():
+        if char in text:
+            text = text.replace(char, replacement)
+
+    return text
+
+def sanitise_stream(source, destination, block_size=1 << 20):
+    """
+    Sanitises text from a file-like object into another, one block at a time.
+
+    Replacements are per character, so blocks can be sanitised independently and memory
+    stays bounded by block_size.
+
+    Args:
+        source: A text file-like object to read from.
+        destination: A text file-like object to write to.
+        block_size (int, optional): Number of characters per block. Defaults to 1M.
+
+    Returns:
+        int: The number of characters written.
+    """
+    written = 0
+    for block in iter(lambda: source.read(block_size), ""):
+        written += destination.write(sanitise_text(block))
+    return written
+
+def sanitise_file(file_path, output_path=None, block_size=1 << 20):
+    """
+    Sanitises a UTF-8 text file block by block.
+
+    Without an output_path the file is replaced in place: the sanitised text is written to a
+    temporary file in the same directory, which is then atomically moved over the original.
+
+    Args:
+        file_path (str): The file to sanitise.
+        output_path (str, optional): Where to write the result. Defaults to replacing file_path.
+        block_size (int, optional): Number of characters per block. Defaults to 1M.
+
+    Returns:
+        str: The path of the sanitised file.
+    """
+    target_path = output_path or file_path
+    directory = os.path.dirname(os.path.abspath(target_path))
+
+    with open(file_path, "r", encoding="utf-8", newline="") as source:
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", dir=directory, delete=False) as destination:
+            try:
+                sanitise_stream(source, destination, block_size)
+            except BaseException:
+                destination.close()
+                os.unlink(destination.name)
+                raise
+
+    match_file_mode(destination.name, target_path)
+    os.replace(destination.name, target_path)
+    return target_path
+
+
+def _read_umask():
+    # Toggling the umask to read it races with files created on other threads, so this is only done at import
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+def _current_umask():
+    """Returns the process umask without changing it, read from /proc where available."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    return _UMASK
+
+
+def match_file_mode(path, target_path):
+    """
+    Gives path the permissions of target_path, or of a new file if target_path doesn't exist,
+    so a temporary file (created private to its owner) can be moved over it.
+    """
+    try:
+        mode = os.stat(target_path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~_current_umask()
+    os.chmod(path, mode)
 
 
 def load_prompt(input_file_path, replacement_dict={}):
 
     try:
-        with open(input_file_path, 'r') as file:
-            # Read the file content
-            content = file.read()
-            
+        # File content is cached until the file changes
+        content = templates.read_prompt_file(input_file_path)
+
     # If not file exists, treat the input as the content
-    except (FileNotFoundError, OSError):
+    except (FileNotFoundError, OSError, ValueError):
         content = input_file_path
-    
-    # Iterate over the dictionary to replace placeholders
-    for placeholder, replacement in replacement_dict.items():
-        # Format the placeholder with double curly brackets
-        wrapped_placeholder = "{{" + placeholder + "}}"
-        # Replace the placeholder with the replacement value
-        content = content.replace(wrapped_placeholder, replacement)
-    
-    return content
+
+    if not replacement_dict:
+        return content
+
+    # Replace every {{placeholder}} in a single pass over the content
+    placeholders = {"{{" + placeholder + "}}": replacement for placeholder, replacement in replacement_dict.items()}
+    pattern = re.compile("|".join(re.escape(placeholder) for placeholder in sorted(placeholders, key=len, reverse=True)))
+
+    return pattern.sub(lambda match: placeholders[match.group(0)], content)
 
 def count_tokens(str, model="gpt-4"):
-    # Get token encoding for GPT-4
-    enc = tiktoken.encoding_for_model(model)
-    return len(enc.encode(str))
+    # Counts are cached process-wide by the tokenizer registry
+    return tokenizer.count_tokens(str, model)
 
 def find_best_break_point(text, max_index):
     # Define regex pattern for break points
@@ -68,86 +166,316 @@ def find_best_break_point(text, max_index):
     # If no break point found, return max_index
     return max_index
 
-def chunk_large_text(text, token_limit):
-    current_chunk = ""
-    start_loc = 0
-
-    for line in text.splitlines():
-        if not line:
-            continue
-        
-        temp_chunk = current_chunk + "\n" + line if current_chunk else line
-        token_count = count_tokens(temp_chunk)
-        
-        if token_count > token_limit:
-            if not current_chunk:
-                # If a single line exceeds the token limit, split it
-                break_index = find_best_break_point(line, len(line))
-                yield {
-                    "content": line[:break_index].strip(),
-                    "start_loc": start_loc,
-                    "end_loc": start_loc + break_index
-                }
-                start_loc += break_index
-                current_chunk = line[break_index:].strip()
+# Preferred break points inside a chunk window, strongest first. A newline is
+# always preferred; the rest only apply when a single line exceeds the window.
+_BREAK_PATTERNS = [
+    re.compile(rb'[.!?](?=\s)'),
+    re.compile(rb'[;:,](?=\s)'),
+    re.compile(rb'\s'),
+]
+_NON_WHITESPACE = re.compile(rb'\S')
+
+def _token_byte_offsets(enc, tokens):
+    # Byte offset of the start of each token, plus the total length at the end
+    lengths = token_byte_lengths(enc)
+    return array.array('q', itertools.accumulate(map(lengths.__getitem__, tokens), initial=0))
+
+def _find_break(data, start, end):
+    # Break after the last newline in the window if there is one
+    newline = data.rfind(b"\n", start, end)
+    if newline > start:
+        return newline + 1
+
+    # Otherwise fall back to sentence, clause and finally word boundaries
+    for pattern in _BREAK_PATTERNS:
+        last_match = None
+        for last_match in pattern.finditer(data, start, end):
+            pass
+        if last_match is not None and last_match.end() > start:
+            return last_match.end()
+
+    # No break point found, cut at the token boundary but never inside a character
+    while end > start and 0x80 <= data[end] < 0xC0:
+        end -= 1
+    if end == start:
+        end += 1
+        while end < len(data) and 0x80 <= data[end] < 0xC0:
+            end += 1
+    return end
+
+def _chunk_spans(enc, text, token_limit, final=True):
+    # Yields (start_char, start_byte, content, content_tokens) for each chunk of text. When final
+    # is False the text is a window onto a longer stream, so the last chunk is held back as it may
+    # still grow, and the generator returns the (char, byte) position from which chunking resumes.
+    data = text.encode("utf-8")
+    tokens = enc.encode(text)
+    token_offsets = _token_byte_offsets(enc, tokens)
+    num_tokens = len(tokens)
+
+    position = 0
+    char_position = 0
+    while True:
+        # Skip whitespace between chunks so it doesn't consume the budget
+        match = _NON_WHITESPACE.search(data, position)
+        if not match:
+            break
+        char_position += match.start() - position
+        position = match.start()
+
+        # First token starting at or after the current position
+        start_token = bisect.bisect_left(token_offsets, position)
+        window = token_limit
+
+        while True:
+            limit_token = start_token + window
+            if limit_token >= num_tokens:
+                if not final:
+                    return char_position, position
+                end = len(data)
             else:
-                # Yield the current chunk before it exceeds the limit
-                yield {
-                    "content": current_chunk.strip(),
-                    "start_loc": start_loc,
-                    "end_loc": start_loc + len(current_chunk)
-                }
-                start_loc += len(current_chunk)
-                current_chunk = line
-        else:
-            current_chunk = temp_chunk
-    
-    # Yield the last chunk if there's any content left
-    if current_chunk:
-        yield {
-            "content": current_chunk.strip(),
+                end = _find_break(data, position, max(token_offsets[limit_token], position))
+
+            raw = data[position:end].decode("utf-8")
+            content = raw.strip()
+            content_tokens = enc.encode(content)
+            token_count = len(content_tokens)
+            if token_count <= token_limit or window <= 1:
+                break
+
+            # Token boundaries moved when the chunk was re-encoded, shrink and retry
+            window = max(1, window - (token_count - token_limit))
+
+        if content:
+            leading = raw[:len(raw) - len(raw.lstrip())]
+            yield char_position + len(leading), position + len(leading.encode("utf-8")), content, content_tokens
+
+        char_position += len(raw)
+        position = end
+
+    return char_position, position
+
+def chunk_large_text(text, token_limit, model="gpt-4", return_tokens=False):
+    """
+    Splits text into chunks of at most token_limit tokens, breaking on line boundaries where possible.
+
+    The text is encoded once and chunk windows are cut from the token byte offsets, so the cost is
+    linear in the length of the text. Lines longer than the limit are split on sentence, clause or
+    word boundaries, and as a last resort on a token boundary. Each chunk is re-counted before it
+    is yielded so that no chunk ever exceeds token_limit.
+
+    Args:
+        text (str): The text to chunk.
+        token_limit (int): The maximum number of tokens per chunk.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+        return_tokens (bool, optional): Include the chunk's token ids under "tokens". Defaults to False.
+
+    Yields:
+        dict: {"content", "start_loc", "end_loc"} where text[start_loc:end_loc] == content.
+    """
+    token_limit = int(token_limit)
+    if token_limit <= 0:
+        raise ValueError("token_limit must be positive")
+
+    for start_loc, _, content, content_tokens in _chunk_spans(get_encoding(model), text, token_limit):
+        chunk = {
+            "content": content,
             "start_loc": start_loc,
-            "end_loc": start_loc + len(current_chunk)
+            "end_loc": start_loc + len(content)
         }
+        if return_tokens:
+            chunk["tokens"] = content_tokens
+        yield chunk
 
-def get_first_n_tokens(text, n_tokens):
-    current_chunk = ""
-    lines = text.splitlines()  # Split the text into a list of lines
-    
-    for line in lines:
-        if not line:
-            continue  # Skip empty lines
-        
-        temp_chunk = line.strip() if not current_chunk else current_chunk + "\n" + line.strip()
-        token_count = count_tokens(temp_chunk)
-        
-        if token_count <= n_tokens:
-            current_chunk = temp_chunk
+def chunk_file(file_path, token_limit, model="gpt-4", buffer_size=1 << 20, return_tokens=False):
+    """
+    Streams chunks of at most token_limit tokens from a text file without reading it into memory.
+
+    The file is decoded as UTF-8 incrementally in blocks of buffer_size characters and chunked exactly as
+    chunk_large_text would, so memory stays bounded by the buffer and a single chunk rather than
+    the size of the file. Newlines are not translated, so offsets match the file on disk.
+
+    Args:
+        file_path (str): The path to the text file.
+        token_limit (int): The maximum number of tokens per chunk.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+        buffer_size (int, optional): Number of characters read per block. Defaults to 1M.
+        return_tokens (bool, optional): Include the chunk's token ids under "tokens". Defaults to False.
+
+    Yields:
+        dict: {"content", "start_loc", "end_loc", "start_byte", "end_byte"}, with character and
+        byte offsets into the file.
+    """
+    token_limit = int(token_limit)
+    if token_limit <= 0:
+        raise ValueError("token_limit must be positive")
+
+    enc = get_encoding(model)
+
+    # Each block must comfortably hold a full chunk or the buffer is re-encoded for nothing
+    buffer_size = max(int(buffer_size), token_limit * 16)
+
+    buffer = ""
+    base_char = 0
+    base_byte = 0
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        while True:
+            block = file.read(buffer_size)
+            final = not block
+            buffer += block
+
+            # Only hand complete lines to the chunker while more of the file remains, unless a
+            # single line has outgrown the buffer
+            cut = len(buffer)
+            if not final:
+                newline = buffer.rfind("\n")
+                if newline >= 0 and len(buffer) - newline <= buffer_size:
+                    cut = newline + 1
+
+            spans = _chunk_spans(enc, buffer[:cut], token_limit, final=final)
+            while True:
+                try:
+                    start_char, start_byte, content, content_tokens = next(spans)
+                except StopIteration as stop:
+                    resume_char, resume_byte = stop.value
+                    break
+
+                chunk = {
+                    "content": content,
+                    "start_loc": base_char + start_char,
+                    "end_loc": base_char + start_char + len(content),
+                    "start_byte": base_byte + start_byte,
+                    "end_byte": base_byte + start_byte + len(content.encode("utf-8"))
+                }
+                if return_tokens:
+                    chunk["tokens"] = content_tokens
+                yield chunk
+
+            if final:
+                break
+
+            buffer = buffer[resume_char:]
+            base_char += resume_char
+            base_byte += resume_byte
+
+def get_first_n_tokens(text, n_tokens, respect_lines=True, model="gpt-4"):
+    """
+    Returns the start of the text, up to n_tokens tokens.
+
+    The text is encoded once and the cut is taken directly from the token offsets. With
+    respect_lines the cut is moved back to the end of the last complete line that fits.
+
+    Args:
+        text (str): The text to take tokens from.
+        n_tokens (int): The maximum number of tokens to return.
+        respect_lines (bool, optional): Only return complete lines. Defaults to True.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+
+    Returns:
+        str: The stripped leading text.
+    """
+    n_tokens = int(n_tokens)
+    enc = get_encoding(model)
+    tokens = enc.encode(text)
+    if len(tokens) <= n_tokens:
+        return text.strip()
+    if n_tokens <= 0:
+        return ""
+
+    data = text.encode("utf-8")
+    end = _token_byte_offsets(enc, tokens)[n_tokens]
+
+    while True:
+        if respect_lines:
+            # End of the last line that finishes within the first n tokens
+            end = data.rfind(b"\n", 0, end + 1)
+            if end < 0:
+                return ""
         else:
-            break
-    
-    return current_chunk.strip()
-
-def get_last_n_tokens(text, token_limit):
-    current_chunk = ""
-    lines = text.splitlines()
-
-    # Iterate over the lines from the end
-    for line in reversed(lines):
-        if not line:
-            continue
-        temp_chunk = line  # Initialize temp_chunk with the current line
-        if current_chunk:
-            temp_chunk += "\n" + current_chunk  # Append the existing chunk
-        token_count = count_tokens(temp_chunk)  # Re-count tokens
-
-        if token_count <= token_limit:
-            current_chunk = temp_chunk
+            # Never cut inside a character
+            while end > 0 and 0x80 <= data[end] < 0xC0:
+                end -= 1
+
+        result = data[:end].decode("utf-8").strip()
+        if len(enc.encode(result)) <= n_tokens or end == 0:
+            return result
+
+        # Re-encoding the prefix produced more tokens, so step back a line or a character
+        end -= 1
+
+def get_last_n_tokens(text, token_limit, respect_lines=True, model="gpt-4"):
+    """
+    Returns the end of the text, up to token_limit tokens.
+
+    The text is encoded once and the cut is taken directly from the token offsets. With
+    respect_lines the cut is moved forward to the start of the first complete line that fits.
+
+    Args:
+        text (str): The text to take tokens from.
+        token_limit (int): The maximum number of tokens to return.
+        respect_lines (bool, optional): Only return complete lines. Defaults to True.
+        model (str, optional): The model whose tokenizer is used. Defaults to "gpt-4".
+
+    Returns:
+        str: The stripped trailing text.
+    """
+    token_limit = int(token_limit)
+    enc = get_encoding(model)
+    tokens = enc.encode(text)
+    if len(tokens) <= token_limit:
+        return text.strip()
+    if token_limit <= 0:
+        return ""
+
+    data = text.encode("utf-8")
+    start = _token_byte_offsets(enc, tokens)[len(tokens) - token_limit]
+
+    while True:
+        if respect_lines:
+            # Start of the first line that begins within the last n tokens
+            newline = data.find(b"\n", start - 1)
+            if newline < 0:
+                return ""
+            start = newline + 1
         else:
-            # If adding this line exceeds the limit, break the loop
-            break
+            # Never cut inside a character
+            while start < len(data) and 0x80 <= data[start] < 0xC0:
+                start += 1
+
+        result = data[start:].decode("utf-8").strip()
+        if len(enc.encode(result)) <= token_limit or start >= len(data):
+            return result
+
+        # Re-encoding the suffix produced more tokens, so step forward a line or a character
+        start += 1
+
+def get_last_n_tokens_from_tokens(tokens, token_limit, respect_lines=True, model="gpt-4"):
+    """
+    Returns the text of the last token_limit tokens of an already encoded text, such as the
+    tokens yielded by chunk_large_text or chunk_file with return_tokens=True.
 
-    return current_chunk.strip()  # Return the final chunk as is
+    Args:
+        tokens (list): The token ids of the text.
+        token_limit (int): The maximum number of tokens to return.
+        respect_lines (bool, optional): Drop a partial first line. Defaults to True.
+        model (str, optional): The model whose tokenizer produced the tokens. Defaults to "gpt-4".
+
+    Returns:
+        str: The stripped trailing text.
+    """
+    token_limit = int(token_limit)
+    if token_limit <= 0:
+        return ""
+
+    enc = get_encoding(model)
+    data = enc.decode_bytes(tokens[-token_limit:])
+
+    # The window starts mid-line unless the token before it ends a line
+    if respect_lines and len(tokens) > token_limit:
+        if not enc.decode_single_token_bytes(tokens[-token_limit - 1]).endswith(b"\n"):
+            newline = data.find(b"\n")
+            data = data[newline + 1:] if newline >= 0 else b""
+
+    return data.decode("utf-8", errors="ignore").strip()
 
 
 # Split text at the first line containing a keyword, returning the text before and after the keyword
@@ -163,4 +491,72 @@ def remove_single_line_breaks(text):
     # Replace single line breaks with nothing, but leave double line breaks
     # This pattern looks for instances of \n not followed or preceded by another \n
     cleaned_text = re.sub(r'(?<!\n)\n(?!\n)', ' ', text)
-    return cleaned_text
\ No newline at end of file
+    return cleaned_text
+
+def stitch_overlap(previous, current, window_lines=40, min_match_chars=20, slack_lines=3):
+    """
+    Joins two transcriptions of consecutive chunks that were given an overlapping window of
+    input, removing the text transcribed twice.
+
+    The last lines of previous are aligned against the first lines of current, ignoring
+    whitespace, case and blank lines. The alignment must be anchored at the boundary: it has to
+    end within slack_lines of the end of previous and, followed back through lines transcribed
+    differently, start within slack_lines of the start of current, so a line repeated elsewhere
+    (e.g. a table header) can't be taken for the overlap. previous is kept up to the end of the
+    aligned lines and current from just after them, so the boundary is taken from whichever side
+    transcribed it in full.
+
+    Args:
+        previous (str): The earlier transcription.
+        current (str): The transcription that starts with the overlap.
+        window_lines (int, optional): Lines compared on each side, the most the overlap can span. Defaults to 40.
+        min_match_chars (int, optional): Fewest characters of aligned text to trust. Defaults to 20.
+        slack_lines (int, optional): Lines allowed between the alignment and either end. Defaults to 3.
+
+    Returns:
+        tuple: (previous, current) with the duplicate removed, or None if they don't align.
+    """
+    previous_lines = previous.splitlines(keepends=True)
+    current_lines = current.splitlines(keepends=True)
+
+    def normalise(line):
+        return " ".join(line.split()).lower()
+
+    # Blank lines align with anything, so they are left out of the comparison
+    tail = [(index, normalise(line)) for index, line in enumerate(previous_lines) if line.strip()][-window_lines:]
+    head = [(index, normalise(line)) for index, line in enumerate(current_lines) if line.strip()][:window_lines]
+
+    tail_text = [line for _, line in tail]
+    head_text = [line for _, line in head]
+
+    # The longest run is aligned first, so a line repeated earlier in previous and later in current
+    # can cross the real overlap. When the alignment isn't anchored, look again after it in previous
+    # and before it in current, where the overlap then has to be
+    tail_start, head_end = 0, len(head)
+    while tail_start < len(tail) and head_end > 0:
+        matcher = difflib.SequenceMatcher(None, tail_text[tail_start:], head_text[:head_end], autojunk=False)
+        blocks = [(tail_start + a, b, size) for a, b, size in matcher.get_matching_blocks()[:-1]]
+
+        # The last aligned run long enough to trust must reach the end of previous
+        for position in range(len(blocks) - 1, -1, -1):
+            anchor_a, anchor_b, anchor_size = blocks[position]
+            if sum(len(line) for line in tail_text[anchor_a:anchor_a + anchor_size]) >= min_match_chars:
+                break
+        else:
+            return None
+
+        # Follow the alignment back across paraphrased lines; it must begin at the start of current
+        start_a, start_b = anchor_a, anchor_b
+        for a, b, size in reversed(blocks[:position]):
+            if start_a - (a + size) > slack_lines or start_b - (b + size) > slack_lines:
+                break
+            start_a, start_b = a, b
+
+        if len(tail) - (anchor_a + anchor_size) <= slack_lines and start_b <= slack_lines:
+            previous_end = tail[anchor_a + anchor_size - 1][0] + 1
+            current_start = head[anchor_b + anchor_size - 1][0] + 1
+            return "".join(previous_lines[:previous_end]), "".join(current_lines[current_start:])
+
+        tail_start, head_end = anchor_a + anchor_size, anchor_b
+
+    return None
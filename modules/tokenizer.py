@@ -0,0 +1,188 @@
+import os
+import array
+import hashlib
+import threading
+from collections import OrderedDict
+import tiktoken
+
+# Encoding used for models tiktoken doesn't recognise (e.g. some fine-tuned model names)
+FALLBACK_ENCODING = "cl100k_base"
+
+# Number of token counts remembered across the process
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 8192))
+
+# Threads used by tiktoken for batch encoding
+TOKENIZER_THREADS = int(os.getenv("TOKENIZER_THREADS", 8))
+
+_encodings = {}
+_token_byte_lengths = {}
+_registry_lock = threading.Lock()
+
+
+class TokenCountCache:
+    """Thread-safe LRU of token counts keyed by encoding name and a hash of the content."""
+
+    def __init__(self, maxsize=TOKEN_COUNT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(encoding_name, text):
+        return (encoding_name, hashlib.md5(text.encode("utf-8", "surrogatepass")).digest())
+
+    def get(self, key):
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._counts.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def set(self, key, count):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._counts), "maxsize": self.maxsize}
+
+
+token_count_cache = TokenCountCache()
+
+
+def get_encoding(model="gpt-4"):
+    """
+    Returns the tiktoken encoding for a model, loading it at most once per process.
+
+    Args:
+        model (str, optional): The model name. Defaults to "gpt-4".
+
+    Returns:
+        tiktoken.Encoding: The encoding for the model, or the fallback encoding if the model is unknown.
+    """
+    enc = _encodings.get(model)
+    if enc is None:
+        with _registry_lock:
+            enc = _encodings.get(model)
+            if enc is None:
+                try:
+                    enc = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    enc = tiktoken.get_encoding(FALLBACK_ENCODING)
+                _encodings[model] = enc
+    return enc
+
+
+def token_byte_lengths(enc):
+    """
+    Returns the byte length of every token in an encoding's vocabulary, computed once per encoding.
+
+    Args:
+        enc (tiktoken.Encoding): The encoding.
+
+    Returns:
+        array.array: Byte lengths indexed by token id (0 for unused ids).
+    """
+    lengths = _token_byte_lengths.get(enc.name)
+    if lengths is None:
+        lengths = array.array('l', bytes(array.array('l').itemsize * (enc.max_token_value + 1)))
+        for token in range(enc.max_token_value + 1):
+            try:
+                lengths[token] = len(enc.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        with _registry_lock:
+            _token_byte_lengths.setdefault(enc.name, lengths)
+            lengths = _token_byte_lengths[enc.name]
+    return lengths
+
+
+def encode(text, model="gpt-4"):
+    return get_encoding(model).encode(text)
+
+
+def encode_batch(texts, model="gpt-4", num_threads=TOKENIZER_THREADS):
+    """
+    Encodes a list of strings using tiktoken's threaded batch encoder.
+
+    Args:
+        texts (list): The strings to encode.
+        model (str, optional): The model name. Defaults to "gpt-4".
+        num_threads (int, optional): Number of encoder threads.
+
+    Returns:
+        list: A list of token lists, in the same order as texts.
+    """
+    return get_encoding(model).encode_batch(list(texts), num_threads=num_threads)
+
+
+def count_tokens(text, model="gpt-4"):
+    """
+    Counts the tokens in a string, reusing the cached count for content seen before.
+
+    Args:
+        text (str): The text to count.
+        model (str, optional): The model name. Defaults to "gpt-4".
+
+    Returns:
+        int: The number of tokens.
+    """
+    enc = get_encoding(model)
+    key = TokenCountCache.key(enc.name, text)
+    count = token_count_cache.get(key)
+    if count is None:
+        count = len(enc.encode(text))
+        token_count_cache.set(key, count)
+    return count
+
+
+def count_tokens_batch(texts, model="gpt-4", num_threads=TOKENIZER_THREADS):
+    """
+    Counts the tokens in each of a list of strings. Cached counts are reused and the
+    remaining strings are encoded together in a single threaded batch.
+
+    Args:
+        texts (list): The strings to count.
+        model (str, optional): The model name. Defaults to "gpt-4".
+        num_threads (int, optional): Number of encoder threads.
+
+    Returns:
+        list: The token count of each string, in the same order as texts.
+    """
+    enc = get_encoding(model)
+    texts = list(texts)
+    keys = [TokenCountCache.key(enc.name, text) for text in texts]
+    counts = [token_count_cache.get(key) for key in keys]
+
+    # Encode each distinct uncached string once
+    missing = {}
+    for index, count in enumerate(counts):
+        if count is None:
+            missing.setdefault(keys[index], index)
+
+    if missing:
+        indices = list(missing.values())
+        encoded = enc.encode_batch([texts[index] for index in indices], num_threads=num_threads)
+        for index, tokens in zip(indices, encoded):
+            token_count_cache.set(keys[index], len(tokens))
+            missing[keys[index]] = len(tokens)
+
+        counts = [missing[key] if count is None else count for key, count in zip(keys, counts)]
+
+    return counts
@@ -0,0 +1,86 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("anthropic")
+pytest.importorskip("tenacity")
+pytest.importorskip("tiktoken")
+
+from classes.ai.anthropic import AnthropicHandler
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+class FakeMessages:
+    """Stands in for client.messages, recording the kwargs of every request."""
+
+    def __init__(self):
+        self.requests = []
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        usage = SimpleNamespace(input_tokens=12, output_tokens=5, cache_read_input_tokens=900, cache_creation_input_tokens=40)
+        return SimpleNamespace(content=[SimpleNamespace(text="Drafted section.")], usage=usage)
+
+
+@pytest.fixture
+def handler():
+    client = SimpleNamespace(messages=FakeMessages())
+    return AnthropicHandler(api_key="test", client=client, prompt_caching=True, rate_limits={}, cache=None)
+
+
+def breakpoints(request):
+    marked = [block for block in request["system"] if "cache_control" in block]
+    for message in request["messages"]:
+        if isinstance(message["content"], list):
+            marked.extend(part for part in message["content"] if "cache_control" in part)
+    return marked
+
+
+def test_cache_breakpoints_mark_system_and_last_two_user_turns(handler):
+    # A report conversation: each section appends a user prompt and the drafted reply
+    messages = [
+        {"role": "system", "content": "You write reports."},
+        {"role": "user", "content": "Answers and the first section brief."},
+        {"role": "assistant", "content": "First section."},
+        {"role": "user", "content": [{"type": "text", "text": "Second section brief."}]},
+        {"role": "assistant", "content": "Second section."},
+        {"role": "user", "content": "Third section brief."},
+    ]
+    original = copy.deepcopy(messages)
+    usage = {}
+
+    assert handler.request_completion(messages=messages, usage=usage) == "Drafted section."
+
+    request = handler.client.messages.requests[-1]
+    assert request["system"] == [{"type": "text", "text": "You write reports.", "cache_control": EPHEMERAL}]
+
+    first, _, second, _, third = request["messages"]
+    assert first["content"] == "Answers and the first section brief."
+    assert second["content"][-1]["cache_control"] == EPHEMERAL
+    assert third["content"] == [{"type": "text", "text": "Third section brief.", "cache_control": EPHEMERAL}]
+    assert len(breakpoints(request)) <= AnthropicHandler.MAX_CACHE_BREAKPOINTS
+
+    # The caller's messages are left as they were
+    assert messages == original
+
+    assert usage == {"input_tokens": 12, "output_tokens": 5, "cache_read_tokens": 900, "cache_write_tokens": 40}
+
+
+def test_cache_breakpoints_stay_within_the_limit(handler):
+    messages = [{"role": "user", "content": f"Turn {n}"} for n in range(8)]
+
+    handler.submit(messages, system_prompt="System prompt.")
+
+    request = handler.client.messages.requests[-1]
+    assert len(breakpoints(request)) == 3 <= AnthropicHandler.MAX_CACHE_BREAKPOINTS
+
+
+def test_no_breakpoints_without_prompt_caching(handler):
+    handler.prompt_caching = False
+    handler.submit([{"role": "user", "content": "Hello"}], system_prompt="System prompt.")
+
+    request = handler.client.messages.requests[-1]
+    assert request["system"] == "System prompt."
+    assert request["messages"] == [{"role": "user", "content": "Hello"}]
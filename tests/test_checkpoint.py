@@ -0,0 +1,99 @@
+import os
+import stat
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tiktoken")
+
+from classes.ai.openai import OpenAIHandler
+from classes.ai.checkpoint import CheckpointJournal, atomic_write
+from modules.text import chunk_file
+
+
+def make_handler():
+    return OpenAIHandler(api_key="test", max_output_tokens=50, max_context_tokens=100000, client=object())
+
+
+def write_inputs(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_text("".join(f"Line {i} of the source document, with a few more words.\n" for i in range(60)))
+    prompt = tmp_path / "prompt.txt"
+    prompt.write_text("Transcribe the text.")
+    return str(source), str(prompt)
+
+
+# A structure header keeps prompt_memory_header a string for the context check
+HEADERS = {"prompt_structure_header": "Titles so far."}
+
+
+def test_smart_transcribe_resumes_after_failure(tmp_path):
+    source, prompt = write_inputs(tmp_path)
+    output = tmp_path / "output.md"
+    total_chunks = len(list(chunk_file(source, int(50 * 0.95))))
+    assert total_chunks > 3
+
+    handler = make_handler()
+    calls = []
+
+    def failing_completion(system_prompt, prompt, messages=None, **kwargs):
+        calls.append(prompt)
+        if len(calls) == 3:
+            raise RuntimeError("transient failure")
+        return f"Transcription {len(calls)}"
+
+    handler.request_completion = failing_completion
+    with pytest.raises(RuntimeError):
+        handler.smart_transcribe(source, str(output), prompt, **HEADERS)
+
+    # Nothing partial is left at the output path, only the journal of the two completed chunks
+    assert not output.exists()
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".checkpoint")]
+
+    resumed = []
+
+    def completion(system_prompt, prompt, messages=None, **kwargs):
+        resumed.append(prompt)
+        return f"Resumed {len(resumed)}"
+
+    handler.request_completion = completion
+    handler.smart_transcribe(source, str(output), prompt, **HEADERS)
+
+    text = output.read_text()
+    assert len(resumed) == total_chunks - 2
+    assert text.startswith("Transcription 1\n\nTranscription 2\n\nResumed 1")
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".checkpoint")]
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_journal_is_private(tmp_path):
+    journal = CheckpointJournal.for_job("summary", "0" * 64, str(tmp_path / "checkpoints"))
+    journal.record((0,), "Secret summary")
+
+    assert mode(tmp_path / "checkpoints") == 0o700
+    assert mode(journal.path) == 0o600
+
+
+def test_journal_drops_a_partial_record(tmp_path):
+    journal = CheckpointJournal(str(tmp_path / "job.checkpoint"))
+    journal.record((0,), "first")
+    with open(journal.path, "a") as file:
+        file.write('{"key": [1], "out')
+
+    journal.record((2,), "third")
+    assert journal.outputs() == {(0,): "first", (2,): "third"}
+
+
+def test_atomic_write_keeps_permissions(tmp_path):
+    output = tmp_path / "output.md"
+    output.write_text("old")
+    os.chmod(output, 0o640)
+
+    with atomic_write(str(output)) as file:
+        file.write("new")
+
+    assert output.read_text() == "new"
+    assert mode(output) == 0o640
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from classes.ai.hedging import HedgePolicy
+
+
+class Provider:
+    """A stand-in request that answers after delay seconds, or raises error, recording a cancellation."""
+
+    def __init__(self, answer, delay=0.0, error=None):
+        self.answer = answer
+        self.delay = delay
+        self.error = error
+        self.started = False
+        self.cancelled = False
+
+    async def __call__(self):
+        self.started = True
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+def policy(**options):
+    return HedgePolicy(**{"initial_delay": 0.05, "min_delay": 0, "max_delay": 10, "min_samples": 5, **options})
+
+
+def run(hedge_policy, primary, backup, failover=False):
+    return asyncio.run(hedge_policy.run(primary, backup, "gpt-4o", failover=failover))
+
+
+def test_fast_request_isnt_hedged():
+    hedge_policy = policy()
+    primary, backup = Provider("primary"), Provider("backup")
+
+    assert run(hedge_policy, primary, backup) == "primary"
+    assert not backup.started
+    assert hedge_policy.info() == {"calls": 1, "hedges": 0, "hedge_wins": 0, "failovers": 0}
+
+
+def test_hedge_wins_and_the_slow_request_is_cancelled():
+    hedge_policy = policy()
+    primary, backup = Provider("primary", delay=5), Provider("backup")
+
+    assert run(hedge_policy, primary, backup) == "backup"
+    assert primary.cancelled
+    assert hedge_policy.info() == {"calls": 1, "hedges": 1, "hedge_wins": 1, "failovers": 0}
+
+
+def test_primary_can_still_win_after_hedging():
+    hedge_policy = policy()
+    primary, backup = Provider("primary", delay=0.1), Provider("backup", delay=5)
+
+    assert run(hedge_policy, primary, backup) == "primary"
+    assert backup.started and backup.cancelled
+    assert hedge_policy.info() == {"calls": 1, "hedges": 1, "hedge_wins": 0, "failovers": 0}
+
+
+def test_failed_hedge_falls_back_to_the_primary():
+    hedge_policy = policy()
+    primary, backup = Provider("primary", delay=0.1), Provider("backup", error=RuntimeError("backup down"))
+
+    assert run(hedge_policy, primary, backup) == "primary"
+    assert hedge_policy.info()["hedge_wins"] == 0
+
+
+def test_failover_on_error():
+    hedge_policy = policy()
+    primary, backup = Provider("primary", error=RuntimeError("primary down")), Provider("backup")
+
+    assert run(hedge_policy, primary, backup, failover=True) == "backup"
+    assert hedge_policy.info() == {"calls": 1, "hedges": 0, "hedge_wins": 0, "failovers": 1}
+
+
+def test_error_is_raised_without_failover():
+    hedge_policy = policy()
+    primary, backup = Provider("primary", error=RuntimeError("primary down")), Provider("backup")
+
+    with pytest.raises(RuntimeError, match="primary down"):
+        run(hedge_policy, primary, backup)
+    assert not backup.started
+
+
+def test_threshold_follows_observed_percentile():
+    hedge_policy = policy(percentile=0.9, min_delay=0.5, max_delay=5)
+
+    # Too few samples to trust, so the initial delay (raised to min_delay) applies
+    for latency in (1, 2, 3, 4):
+        hedge_policy.observe("gpt-4o", latency)
+    assert hedge_policy.delay("gpt-4o") == 0.5
+
+    for latency in range(5, 11):
+        hedge_policy.observe("gpt-4o", latency)
+    assert hedge_policy.delay("gpt-4o") == 5  # The 90th percentile, 10, capped at max_delay
+
+    hedge_policy.max_delay = 60
+    assert hedge_policy.delay("gpt-4o") == 10
+    assert hedge_policy.delay("other-model") == 0.5
+
+
+def test_observed_latency_triggers_the_hedge():
+    hedge_policy = policy(min_samples=3, initial_delay=10)
+    for _ in range(3):
+        hedge_policy.observe("gpt-4o", 0.05)
+
+    # Slower than every call seen so far, so it's hedged well before the initial delay
+    primary, backup = Provider("primary", delay=5), Provider("backup")
+    assert run(hedge_policy, primary, backup) == "backup"
+    assert primary.cancelled
@@ -0,0 +1,38 @@
+import base64
+import struct
+import zlib
+
+from modules import images
+from modules.images import ImagePayload, as_image_payload
+
+
+def png(width, height, padding=0):
+    # A valid header followed by filler, enough for the dimensions to be read
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    return b"\x89PNG\r\n\x1a\n" + chunk + b"\0" * padding
+
+
+def test_from_base64_only_decodes_the_header(monkeypatch):
+    encoded = base64.b64encode(png(1024, 768, padding=1 << 20)).decode("ascii")
+
+    decoded = []
+    b64decode = base64.b64decode
+    monkeypatch.setattr(images.base64, "b64decode", lambda data: decoded.append(len(data)) or b64decode(data))
+
+    payload = as_image_payload(encoded)
+
+    assert (payload.format, payload.width, payload.height) == ("png", 1024, 768)
+    assert max(decoded) < len(encoded)
+    assert payload.base64 is encoded
+
+    # The image itself is decoded when it's needed
+    assert payload.data == png(1024, 768, padding=1 << 20)
+
+
+def test_payload_from_bytes():
+    payload = ImagePayload(png(600, 400))
+
+    assert (payload.format, payload.width, payload.height) == ("png", 600, 400)
+    assert payload.media_type == "image/png"
+    assert base64.b64decode(payload.base64) == payload.data
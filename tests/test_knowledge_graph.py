@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+pytest.importorskip("neo4j")
+pytest.importorskip("elasticsearch")
+pytest.importorskip("tiktoken")
+
+# The drivers are created on import, but only connect when used
+os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+os.environ.setdefault("ELASTIC_URL", "http://localhost:9200")
+for name in ("NEO4J_USERNAME", "NEO4J_PASSWORD", "ELASTIC_USERNAME", "ELASTIC_PASSWORD"):
+    os.environ.setdefault(name, "test")
+
+from classes.Knowledge import KnowledgeGraph as knowledge_graph
+from classes.Knowledge.KnowledgeGraph import KnowledgeGraph
+
+
+class FakeDocuments:
+    """Stands in for the documents and claims indices, holding one stored revision."""
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.claim_updates = []
+
+    def search_es(self, index_name, query):
+        if "sort" not in query:
+            # The shared chunk lookup; no other document shares chunks
+            return {"hits": {"total": {"value": 0}, "hits": []}}
+
+        superseded = query["query"]["bool"]["must"][2]["bool"]["should"][1]["term"]["superseded_by.keyword"]
+        if self.stored["_source"].get("superseded_by") not in (None, superseded):
+            return {"hits": {"total": {"value": 0}, "hits": []}}
+        return {"hits": {"total": {"value": 1}, "hits": [self.stored]}}
+
+    def update_document(self, index_name, document_id, fields):
+        self.stored["_source"].update(fields)
+
+    def bulk_update_by_query(self, index_name, body):
+        self.claim_updates.append(body)
+
+
+def make_graph():
+    graph = KnowledgeGraph.__new__(KnowledgeGraph)
+    graph.project_id = "project"
+    graph.global_graph = {"entities": [], "relationships": []}
+    graph.graph_modified = False
+    graph._revisions = {}
+    graph._retired_chunk_ids = set()
+    return graph
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    stored = {"_id": "es-1", "_source": {"document_id": "v1", "chunks": [{"chunk_id": "a"}, {"chunk_id": "b"}]}}
+    fake = FakeDocuments(stored)
+    for name in ("search_es", "update_document", "bulk_update_by_query"):
+        monkeypatch.setattr(knowledge_graph, name, getattr(fake, name))
+    return fake
+
+
+def new_revision():
+    return {
+        "document_id": "v2", "source_id": "doc.md", "document_metadata": {}, "document_summary": "",
+        "chunks": [{"chunk_id": "a"}, {"chunk_id": "c"}]
+    }
+
+
+def test_graph_revision_leaves_claims_to_the_claims_run(documents):
+    document = new_revision()
+
+    graph = make_graph()
+    graph._apply_graph_revision(document, graph._get_previous_revision(document))
+
+    assert documents.claim_updates == []
+    assert graph._retired_chunk_ids == {"b"}
+    assert documents.stored["_source"]["superseded_by"] == "v2"
+
+    # A later incremental claims run, in a new instance, still finds the revision and its diff
+    claims_graph = make_graph()
+    revision = claims_graph._get_previous_revision(document)
+    assert revision["new_chunk_ids"] == {"c"}
+    assert revision["removed_chunk_ids"] == {"b"}
+
+    claims_graph._apply_claims_revision(document, revision)
+    retired, moved = documents.claim_updates
+    assert retired["query"]["bool"]["must"][2] == {"terms": {"chunk_id.keyword": ["b"]}}
+    assert moved["script"]["params"]["document_id"] == "v2"
+
+
+def test_claims_revision_is_applied_once(documents):
+    document = new_revision()
+
+    graph = make_graph()
+    revision = graph._get_previous_revision(document)
+    graph._apply_claims_revision(document, revision)
+    graph._apply_claims_revision(document, revision)
+    graph._apply_graph_revision(document, revision)
+
+    assert len(documents.claim_updates) == 2
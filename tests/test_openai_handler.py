@@ -0,0 +1,297 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("tiktoken")
+
+from classes.ai import openai as openai_module
+from classes.ai.openai import OpenAIHandler
+from classes.ai.hedging import HedgePolicy
+from classes.ai.retry import RetryPolicy
+from classes.ai.cache import ResponseCache, MemoryCacheBackend
+
+
+class FakeClient:
+    """Stands in for OpenAI and AsyncOpenAI, recording whether it was closed."""
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+        FakeClient.instances.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAsyncClient(FakeClient):
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    FakeClient.instances = []
+    monkeypatch.setattr(openai_module, "AsyncOpenAI", FakeAsyncClient)
+    monkeypatch.setattr(openai_module, "create_http_client", lambda **kwargs: None)
+
+    handler = OpenAIHandler(api_key="test", client=FakeClient())
+
+    # Stands in for a request: takes this loop's client and answers
+    async def request_completion_async(**request):
+        handler._get_async_state()
+        return request["prompt"]
+
+    handler.request_completion_async = request_completion_async
+    return handler
+
+
+def test_complete_many_closes_its_async_client(handler):
+    assert handler.complete_many([{"prompt": "a"}, {"prompt": "b"}]) == ["a", "b"]
+
+    async_clients = [client for client in FakeClient.instances if isinstance(client, FakeAsyncClient)]
+    assert len(async_clients) == 1 and async_clients[0].closed
+    assert handler._async_state == {}
+
+
+def test_close_closes_async_clients_of_open_loops(handler):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(handler.gather_completions([{"prompt": "a"}]))
+        async_client, _ = handler._async_state[loop]
+
+        handler.close()
+        assert async_client.closed
+        assert handler.client.closed
+    finally:
+        loop.close()
+
+
+def test_aclose_leaves_a_given_async_client_open(handler):
+    given = FakeAsyncClient()
+    handler._async_client = given
+
+    handler.complete_many([{"prompt": "a"}])
+    assert not given.closed
+
+
+def test_sync_hedged_requests_share_one_async_client(handler):
+    handler.hedge_policy = HedgePolicy(initial_delay=30)
+
+    assert handler.request_completion(prompt="a") == "a"
+    assert handler.request_completion(prompt="b") == "b"
+
+    async_clients = [client for client in FakeClient.instances if isinstance(client, FakeAsyncClient)]
+    assert len(async_clients) == 1 and not async_clients[0].closed
+    assert handler.hedge_info()["calls"] == 2
+
+    handler.close()
+    assert async_clients[0].closed
+    assert handler._hedge_loop is None
+
+
+class OtherProvider:
+
+    def request_completion(self, system_prompt="", prompt="", model=None, messages=[], temperature=0.2, max_tokens=None, json_output=False, usage=None):
+        return prompt
+
+
+def test_fallback_to_another_provider_drops_the_model(handler):
+    request = {"prompt": "a", "model": "gpt-4o", "temperature": 0.2}
+    fallback = OtherProvider()
+
+    target, fallback_request = HedgePolicy(fallback=fallback).fallback_target(handler, request)
+    assert target is fallback
+    assert "model" not in fallback_request
+
+    target, fallback_request = HedgePolicy(fallback=handler).fallback_target(handler, request)
+    assert fallback_request["model"] == "gpt-4o"
+
+
+class FlakyFineTuningClient(FakeClient):
+    """Every fine-tuning call fails once with a dropped connection before succeeding."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.files = SimpleNamespace(create=self.flaky("upload", lambda file, purpose: SimpleNamespace(id="file-1", size=len(file.read()))), delete=self.flaky("delete", lambda file_id: None))
+        self.fine_tuning = SimpleNamespace(jobs=SimpleNamespace(
+            create=self.flaky("create", lambda **params: SimpleNamespace(id="job-1")),
+            retrieve=self.flaky("retrieve", lambda job_id: SimpleNamespace(status="succeeded", fine_tuned_model="ft:gpt-4o:test"))
+        ))
+
+    def flaky(self, name, fn):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            if self.calls.count(name) == 1:
+                raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+            return fn(*args, **kwargs)
+        return call
+
+
+def test_fine_tune_model_retries_transient_errors(tmp_path):
+    training_file = tmp_path / "training.jsonl"
+    training_file.write_text("{}\n" * 10)
+
+    client = FlakyFineTuningClient()
+    handler = OpenAIHandler(api_key="test", client=client, retry_policy=RetryPolicy(openai_module.retry_reason, base_delay=0.001, max_delay=0.001))
+
+    result = handler.fine_tune_model(str(training_file))
+
+    assert result["status"] == "succeeded" and result["model"] == "ft:gpt-4o:test"
+    assert client.calls == ["upload", "upload", "create", "create", "retrieve", "retrieve", "delete", "delete"]
+
+
+class FakeBatchClient(FakeClient):
+    """Stands in for the files and batches endpoints. respond maps the submitted requests to output lines."""
+
+    def __init__(self, respond=None, statuses=("in_progress", "completed")):
+        super().__init__()
+        self.respond = respond
+        self.statuses = list(statuses)
+        self.submitted = None
+        self.cancel_error = None
+        self.calls = []
+        self.files = SimpleNamespace(create=self.create_file, content=self.file_content)
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve_batch, cancel=self.cancel_batch)
+
+    def create_file(self, file, purpose):
+        self.calls.append("files.create")
+        self.submitted = [json.loads(line) for line in file[1].decode("utf-8").splitlines()]
+        return SimpleNamespace(id="file-in")
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        self.calls.append("batches.create")
+        return self.batch()
+
+    def retrieve_batch(self, batch_id):
+        self.calls.append("batches.retrieve")
+        return self.batch()
+
+    def cancel_batch(self, batch_id):
+        self.calls.append("batches.cancel")
+        if self.cancel_error is not None:
+            raise self.cancel_error
+
+    def batch(self):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return SimpleNamespace(id="batch-1", status=status, output_file_id="file-out" if status == "completed" else None)
+
+    def file_content(self, file_id):
+        self.calls.append("files.content")
+        return SimpleNamespace(text="\n".join(json.dumps(line) for line in self.respond(self.submitted)))
+
+
+def batch_line(request, content, finish_reason="stop", status_code=200, error=None):
+    return {
+        "custom_id": request["custom_id"],
+        "error": error,
+        "response": {"status_code": status_code, "body": {
+            "model": request["body"]["model"],
+            "choices": [{"message": {"content": content}, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5}
+        }}
+    }
+
+
+def batch_handler(client, cache=None):
+    handler = OpenAIHandler(api_key="test", client=client, cache=cache)
+    handler.request_completion = lambda **request: f"direct {request['prompt']}"
+    return handler
+
+
+def test_run_batch_maps_results_and_falls_back(monkeypatch):
+    monkeypatch.setattr(openai_module.time, "sleep", lambda seconds: None)
+
+    def respond(submitted):
+        a, b, c, d, e = submitted
+        # Out of order, with one line of each kind of failure
+        return [
+            batch_line(e, "answer e"),
+            batch_line(d, "not json"),
+            batch_line(c, "cut sho", finish_reason="length"),
+            batch_line(b, None, status_code=500, error={"message": "server error"}),
+            batch_line(a, "answer a"),
+        ]
+
+    client = FakeBatchClient(respond)
+    handler = batch_handler(client, cache=ResponseCache(MemoryCacheBackend()))
+    requests = [{"prompt": "a"}, {"prompt": "b"}, {"prompt": "c"}, {"prompt": "d", "json_output": True}, {"prompt": "e"}]
+
+    assert handler.run_batch(requests) == ["answer a", "direct b", "direct c", "direct d", "answer e"]
+    assert client.calls == ["files.create", "batches.create", "batches.retrieve", "files.content"]
+
+    # Answers from the job were cached, so only the others are submitted again
+    client.statuses = ["completed"]
+    client.respond = lambda submitted: [batch_line(request, '{"again": true}') for request in submitted]
+    assert handler.run_batch(requests) == ["answer a", '{"again": true}', '{"again": true}', '{"again": true}', "answer e"]
+    assert [request["custom_id"] for request in client.submitted] == ["request-1", "request-2", "request-3"]
+
+    # Nothing is submitted when every request is cached
+    client.calls = []
+    assert handler.run_batch([requests[0], requests[4]]) == ["answer a", "answer e"]
+    assert client.calls == []
+
+
+def test_run_batch_raises_when_the_job_fails():
+    client = FakeBatchClient(statuses=("failed",))
+
+    with pytest.raises(ValueError, match="failed"):
+        batch_handler(client).run_batch([{"prompt": "a"}])
+
+
+def test_run_batch_cancels_on_timeout():
+    client = FakeBatchClient(statuses=("in_progress",))
+
+    with pytest.raises(TimeoutError):
+        batch_handler(client).run_batch([{"prompt": "a"}], poll_interval=0, timeout=-1)
+    assert client.calls[-1] == "batches.cancel"
+
+
+def test_run_batch_still_times_out_when_cancelling_fails():
+    client = FakeBatchClient(statuses=("in_progress",))
+    client.cancel_error = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+    handler = batch_handler(client)
+    handler.retry_policy = RetryPolicy(openai_module.retry_reason, base_delay=0.001, max_delay=0.001)
+
+    with pytest.raises(TimeoutError, match="Cancelling it failed"):
+        handler.run_batch([{"prompt": "a"}], poll_interval=0, timeout=-1)
+    assert client.calls.count("batches.cancel") > 1
+
+
+class QuickProvider:
+    """A stand-in fallback provider that answers at once."""
+
+    def request_completion(self, system_prompt="", prompt="", model=None, messages=[], temperature=0.2, top_p=None, max_tokens=None, json_output=False, image=None, use_cache=True, usage=None):
+        return f"fallback {prompt}"
+
+    async def request_completion_async(self, **request):
+        return self.request_completion(**request)
+
+
+def test_slow_request_is_hedged_to_the_fallback(handler):
+    cancelled = []
+
+    async def slow_request(**request):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(request["prompt"])
+            raise
+        return request["prompt"]
+
+    handler.request_completion_async = slow_request
+    handler.hedge_policy = HedgePolicy(fallback=QuickProvider(), initial_delay=0.05, min_delay=0)
+
+    try:
+        assert handler.request_completion(prompt="a") == "fallback a"
+    finally:
+        handler.close()
+
+    assert cancelled == ["a"]
+    assert handler.hedge_info() == {"calls": 1, "hedges": 1, "hedge_wins": 1, "failovers": 0}
@@ -0,0 +1,44 @@
+import warnings
+
+import pytest
+
+from classes.ai import rate_limit
+from classes.ai.rate_limit import RateLimiter, get_rate_limiter
+
+
+@pytest.fixture(autouse=True)
+def limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+
+
+def test_handlers_share_one_limiter():
+    assert get_rate_limiter("openai", "gpt-4o", 60, 1000) is get_rate_limiter("openai", "gpt-4o", 60, 1000)
+    assert get_rate_limiter("openai", "gpt-4o") is None
+
+
+def test_conflicting_limits_keep_the_stricter_without_refilling():
+    limiter = get_rate_limiter("openai", "gpt-4o", requests_per_minute=60, tokens_per_minute=1000)
+    limiter.acquire(900)
+
+    # Handlers alternating between configurations must not refill the quota
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        for _ in range(3):
+            assert get_rate_limiter("openai", "gpt-4o", requests_per_minute=None, tokens_per_minute=5000) is limiter
+            assert get_rate_limiter("openai", "gpt-4o", requests_per_minute=60, tokens_per_minute=1000) is limiter
+
+    assert caught and "Conflicting rate limits" in str(caught[0].message)
+    info = limiter.info()
+    assert (info["requests_per_minute"], info["tokens_per_minute"]) == (60, 1000)
+    assert info["tokens_available"] < 200
+
+
+def test_configure_keeps_the_balance():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    limiter.acquire(800)
+
+    limiter.configure(tokens_per_minute=2000)
+    assert limiter.info()["tokens_available"] < 300
+
+    limiter.configure(tokens_per_minute=100)
+    assert limiter.info()["tokens_available"] <= 100
@@ -0,0 +1,52 @@
+import contextvars
+
+from classes.ai import telemetry
+
+
+def current_tags():
+    return telemetry._stage.get(), telemetry._project.get()
+
+
+def steps(count):
+    for _ in range(count):
+        yield current_tags()
+    return "done"
+
+
+def test_tagged_sets_tags_only_while_the_generator_runs():
+    seen = []
+    for tags in telemetry.tagged(steps(2), stage="report_section", project="p1"):
+        # The consumer never sees the tags
+        assert current_tags() == (None, None)
+        seen.append(tags)
+
+    assert seen == [("report_section", "p1")] * 2
+
+
+def test_tagged_returns_the_generator_value():
+    def outer():
+        return (yield from telemetry.tagged(steps(1), stage="s"))
+
+    generator = outer()
+    next(generator)
+    try:
+        next(generator)
+    except StopIteration as stop:
+        assert stop.value == "done"
+
+
+def test_tagged_keeps_interleaved_generators_apart():
+    first = telemetry.tagged(steps(2), project="p1")
+    second = telemetry.tagged(steps(2), project="p2")
+
+    assert [tags[1] for tags in (next(first), next(second), next(first), next(second))] == ["p1", "p2", "p1", "p2"]
+
+
+def test_tagged_can_resume_in_another_context():
+    generator = telemetry.tagged(steps(2), stage="s", project="p1")
+    next(generator)
+
+    # Holding a token across the yield would fail to reset here
+    assert contextvars.copy_context().run(next, generator) == ("s", "p1")
+    generator.close()
+    assert current_tags() == (None, None)
@@ -0,0 +1,189 @@
+import os
+import stat
+
+import pytest
+
+pytest.importorskip("tiktoken")
+
+from modules import text
+from modules.markdown import chunk_markdown
+from modules.text import sanitise_file, stitch_overlap, chunk_large_text, chunk_file, get_first_n_tokens, get_last_n_tokens
+from modules.tokenizer import get_encoding
+
+# Short and long lines, a line too long for any chunk, multi-byte characters and runs of whitespace
+TEXT = (
+    "# Witness statement\n\n"
+    + "".join(f"On day {n} the café opened at nine, and the naïve clerk said so.\n" for n in range(12))
+    + "\n   \n"
+    + "The longest paragraph ran on without a break " * 12 + "\n"
+    + "日本語のテキスト" * 20 + "\n\n"
+    + "Closing remarks. Résumé attached; see exhibit B.\n"
+)
+
+
+def test_stitch_overlap_removes_duplicate():
+    previous = "# Witness statement\n\nI arrived at the station at nine.\nThe platform was empty.\n"
+    current = "I arrived at the station at nine.\nThe platform was empty.\n\nThe train was late.\n"
+
+    stitched = stitch_overlap(previous, current)
+
+    assert stitched is not None
+    assert "".join(stitched) == "# Witness statement\n\nI arrived at the station at nine.\nThe platform was empty.\n\nThe train was late.\n"
+
+
+def test_stitch_overlap_ignores_repeated_table_header():
+    header = "| Date | Event | Notes |\n|------|-------|-------|\n"
+    rows = "".join(f"| {day} May | Payment {day} received into escrow | Filed |\n" for day in range(1, 7))
+    previous = header + rows + "The parties then met to discuss the schedule.\n"
+    new_content = "".join(f"Revision {n} to the timeline was agreed in writing.\n" for n in range(5))
+    current = "The parties then met to discuss the schedule.\n\n" + new_content + "\n" + header + "| 9 June | Works began on site | New |\n"
+
+    previous_kept, current_kept = stitch_overlap(previous, current)
+
+    # The header in current is new content and must survive, along with previous's rows
+    assert previous_kept == previous
+    assert current_kept == "\n" + new_content + "\n" + header + "| 9 June | Works began on site | New |\n"
+
+
+def test_stitch_overlap_rejects_match_away_from_boundary():
+    header = "| Date | Event | Notes |\n"
+    previous = header + "| 1 May | Contract signed | Filed |\n" + "".join(f"Earlier paragraph {n} about the dispute.\n" for n in range(6))
+    current = "".join(f"Later paragraph {n} about the hearing.\n" for n in range(6)) + header + "| 9 June | Hearing listed | New |\n"
+
+    assert stitch_overlap(previous, current) is None
+
+
+def test_stitch_overlap_handles_paraphrased_overlap():
+    previous = (
+        "Opening remarks were made by the chair.\n"
+        "The first witness was called at ten o'clock.\n"
+        "She described the night of the fire in detail.\n"
+        "Counsel asked about the smoke alarm in the hallway.\n"
+        "She said she had not heard it sound at any point.\n"
+    )
+    current = (
+        "The first witness was called at ten o'clock.\n"
+        "She gave a detailed account of the night of the fire.\n"
+        "Counsel asked about the smoke alarm in the hallway.\n"
+        "She said she never heard it go off.\n"
+        "The hearing was adjourned for lunch.\n"
+    )
+
+    previous_kept, current_kept = stitch_overlap(previous, current)
+
+    # Aligned up to the last line both sides transcribed the same way; the rest comes from current
+    assert previous_kept.endswith("Counsel asked about the smoke alarm in the hallway.\n")
+    assert "had not heard it" not in previous_kept
+    assert current_kept == "She said she never heard it go off.\nThe hearing was adjourned for lunch.\n"
+
+
+def test_sanitise_file_keeps_permissions(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("It’s here.")
+    os.chmod(path, 0o644)
+
+    sanitise_file(str(path))
+
+    assert path.read_text() == "It's here."
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+
+def test_sanitise_file_creates_output_with_default_permissions(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Text")
+    output = tmp_path / "clean.txt"
+
+    umask = os.umask(0o022)
+    try:
+        sanitise_file(str(path), str(output))
+    finally:
+        os.umask(umask)
+
+    assert stat.S_IMODE(os.stat(output).st_mode) == 0o644
+
+
+def test_default_permissions_leave_the_umask_alone(tmp_path, monkeypatch):
+    path = tmp_path / "notes.txt"
+    path.write_text("Text")
+    output = tmp_path / "clean.txt"
+
+    # Without /proc, the umask read at import is used rather than toggling it
+    monkeypatch.setattr(text.os, "umask", lambda mask: pytest.fail("umask was changed"))
+    monkeypatch.setattr(text, "_UMASK", 0o027)
+    def no_proc(file, *args, **kwargs):
+        if str(file).startswith("/proc"):
+            raise FileNotFoundError(file)
+        return open(file, *args, **kwargs)
+    monkeypatch.setattr(text, "open", no_proc, raising=False)
+
+    sanitise_file(str(path), str(output))
+
+    assert stat.S_IMODE(os.stat(output).st_mode) == 0o640
+
+
+def assert_chunks_rebuild(text, chunks, token_limit):
+    enc = get_encoding("gpt-4")
+    position = 0
+    rebuilt = ""
+    for chunk in chunks:
+        assert len(enc.encode(chunk["content"])) <= token_limit
+        assert text[chunk["start_loc"]:chunk["end_loc"]] == chunk["content"]
+
+        # Only whitespace is dropped between chunks
+        assert text[position:chunk["start_loc"]].strip() == ""
+        rebuilt += text[position:chunk["start_loc"]] + chunk["content"]
+        position = chunk["end_loc"]
+
+    assert text[position:].strip() == ""
+    assert rebuilt + text[position:] == text
+
+
+# A chunk can never be smaller than one character, so the smallest limit fits the widest character
+@pytest.mark.parametrize("token_limit", [4, 7, 30, 200, 10000])
+def test_chunk_large_text_invariants(token_limit):
+    assert_chunks_rebuild(TEXT, list(chunk_large_text(TEXT, token_limit)), token_limit)
+
+
+@pytest.mark.parametrize("token_limit", [7, 30, 200])
+def test_chunk_markdown_invariants(token_limit):
+    assert_chunks_rebuild(TEXT, list(chunk_markdown(TEXT, token_limit)), token_limit)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 97, 113, 4096])
+def test_chunk_file_matches_chunk_large_text(tmp_path, buffer_size):
+    path = tmp_path / "statement.txt"
+    path.write_bytes(TEXT.encode("utf-8"))
+
+    # The buffer is raised to 16 characters per token of the limit, so blocks are 112 characters
+    # and the last ones end inside the run of multi-byte characters
+    expected = list(chunk_large_text(TEXT, 7))
+    chunks = list(chunk_file(str(path), 7, buffer_size=buffer_size))
+
+    assert [{key: chunk[key] for key in expected[0]} for chunk in chunks] == expected
+    for chunk in chunks:
+        assert chunk["start_byte"] == len(TEXT[:chunk["start_loc"]].encode("utf-8"))
+        assert chunk["end_byte"] == len(TEXT[:chunk["end_loc"]].encode("utf-8"))
+
+
+def test_chunk_file_splits_a_multibyte_block_boundary(tmp_path):
+    path = tmp_path / "statement.txt"
+    text = "a" * 111 + "日本語のテキスト" * 40
+    path.write_bytes(text.encode("utf-8"))
+
+    assert [chunk["content"] for chunk in chunk_file(str(path), 7, buffer_size=1)] == [chunk["content"] for chunk in chunk_large_text(text, 7)]
+
+
+@pytest.mark.parametrize("n_tokens", [1, 5, 40, 100])
+def test_first_and_last_n_tokens_match_the_token_slice(n_tokens):
+    enc = get_encoding("gpt-4")
+    text = "".join(f"Line {n} of the statement, read into the record.\n" for n in range(10))
+    tokens = enc.encode(text)
+
+    assert get_first_n_tokens(text, n_tokens, respect_lines=False) == enc.decode(tokens[:n_tokens]).strip()
+    assert get_last_n_tokens(text, n_tokens, respect_lines=False) == enc.decode(tokens[-n_tokens:]).strip()
+
+    # Whole lines only: the complete lines within the same slice
+    first = enc.decode(tokens[:n_tokens])
+    assert get_first_n_tokens(text, n_tokens) == first[:first.rfind("\n") + 1].strip()
+    last = enc.decode(tokens[-n_tokens:])
+    assert get_last_n_tokens(text, n_tokens) == last[last.find("\n") + 1:].strip()